@@ -21,6 +21,9 @@ def create_app():
     with app.app_context():
         db.create_all()
 
+    from .services import metrics
+    metrics.init_app(app)
+
     from .routes_public import bp as public_bp
     from .routes_api import bp as api_bp
     from .routes_admin import bp as admin_bp
@@ -32,4 +35,11 @@ def create_app():
     def health():
         return {'ok': True}
 
+    # Redis pool exhausted, or a call that must not fall back (revocation) while it is down
+    from .services.breaker import StoreUnavailable
+
+    @app.errorhandler(StoreUnavailable)
+    def store_unavailable(e):
+        return {'error': 'store_unavailable'}, 503, {'Retry-After': '1'}
+
     return app
@@ -0,0 +1,229 @@
+import re, json, time, asyncio
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from . import create_app
+from .models import Code, Redemption, Product, Content
+from .services import catalog, storage, revocation, metrics, audit, last_seen, payments, code_pool, decode
+from .services.metrics import span
+from .services.async_store import AsyncStore
+from .services.breaker import StoreUnavailable
+from .services.access import AccessError, bearer_payload, check_content
+from .services.rate_limit import RateLimited, redeem_writes, prefilter
+from .services.redeem import (RedeemError, admission, check_code, grant, new_redemption, mark_redeemed,
+                              audit_redeemed, response_body, rate_limited_headers)
+
+# ASGI entry point: /api/redeem and /api/content/<id> are served natively with
+# redis.asyncio and an async SQLAlchemy engine, so slow clients and long polls
+# do not pin worker threads. Every other route falls through to the Flask app.
+#
+#   gunicorn -c gunicorn_asgi.conf.py 'app.asgi:create_asgi_app()'
+
+_ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'postgres': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+_CONTENT = re.compile(r'/api/content/(\d+)')
+_MAX_BODY = 64 * 1024
+
+def async_db_url(url: str) -> str:
+    scheme, rest = url.split('://', 1)
+    return f"{_ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)}://{rest}"
+
+class AsyncApp:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.engine = None
+        self.sessions = None
+        self.store = None
+
+    def _ensure(self):
+        if self.engine is None:
+            with self.flask_app.app_context():
+                self.engine = create_async_engine(async_db_url(self.flask_app.config['SQLALCHEMY_DATABASE_URI']))
+                self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+                self.store = AsyncStore.from_app()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] == 'http':
+            path, method = scope['path'], scope['method']
+            if path == '/api/redeem' and method == 'POST':
+                return await self._timed('/api/redeem', method, send, self._redeem_http, scope, receive)
+            m = _CONTENT.fullmatch(path)
+            if m and method == 'GET':
+                return await self._timed('/api/content/<int:content_id>', method, send,
+                                         self.content, scope, int(m.group(1)))
+        return await self.wsgi(scope, receive, send)
+
+    async def _timed(self, route: str, method: str, send, handler, *args):
+        # Native routes skip Flask's request hooks; record the same route histogram here
+        self._ensure()
+        t0, status = time.perf_counter(), [500]
+
+        async def send_(msg):
+            if msg['type'] == 'http.response.start':
+                status[0] = msg['status']
+            await send(msg)
+        try:
+            return await handler(*args[:1], send_, *args[1:])
+        finally:
+            metrics.observe_request(route, method, status[0], time.perf_counter() - t0)
+
+    async def _redeem_http(self, scope, send, receive):
+        body = await _read_body(receive)
+        if body is None:
+            return await _send_json(send, 413, {'error': 'too_large'})
+        return await _send_json(send, *await self.redeem(scope, body))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            msg = await receive()
+            if msg['type'] == 'lifespan.startup':
+                self._ensure()
+                await asyncio.to_thread(code_pool.warm, self.flask_app)
+                await asyncio.to_thread(decode.warm, self.flask_app)
+                await send({'type': 'lifespan.startup.complete'})
+            elif msg['type'] == 'lifespan.shutdown':
+                # Void pool codes, drain webhook events, audit rows and last_seen touches before exiting
+                await asyncio.to_thread(code_pool.shutdown)
+                await asyncio.to_thread(payments.shutdown)
+                await asyncio.to_thread(audit.shutdown)
+                await asyncio.to_thread(last_seen.shutdown)
+                if self.engine is not None:
+                    await self.store.aclose()
+                    await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def redeem(self, scope, body: bytes):
+        try:
+            data = json.loads(body or b'{}') or {}
+        except ValueError:
+            return 400, {'error': 'bad_request'}, {}
+        device_id = data.get('device_id')
+        ip = (scope.get('client') or ('0.0.0.0',))[0]
+        with self.flask_app.app_context():
+            try:
+                # Same as redeem.admit(): one store call charges the buckets before any DB work
+                ids, buckets = admission(data.get('opaque'), ip)
+                await self._check_rate(buckets)
+                if ids is None:
+                    raise RedeemError('invalid_code', 400)
+                code_id, merchant_id = ids
+                async with self.sessions() as s:
+                    with span('db.code_lookup'):
+                        row = (await s.execute(
+                            select(Code, Redemption).outerjoin(Redemption, Redemption.code_id == Code.id)
+                            .where(Code.id == code_id).limit(1))).first()
+                    code, red = row if row else (None, None)
+                    check_code(code, red, device_id)
+                    if red is None:
+                        red = new_redemption(code.id, device_id, ip, _header(scope, b'user-agent'))
+                        s.add(red)
+                    terms = catalog.lookup(code.product_id)
+                    if terms is catalog.MISS:
+                        prow = (await s.execute(select(Product.content_id, Product.default_duration_min)
+                                                .where(Product.id == code.product_id))).first()
+                        terms = (prow[0], prow[1]) if prow else None
+                        catalog.remember(code.product_id, terms)
+                    g = grant(code, terms, device_id, ip)
+                    await self.store.take_tokens(
+                        (), redeem_writes(code.id, device_id, g['jti'], g['exp_ts'], g['jti_ttl']))
+                    mark_redeemed(red, g['jti'])
+                    with span('db.commit'):
+                        await s.commit()
+                audit_redeemed(code, g, device_id, ip)
+                return 200, response_body(g), {}
+            except RedeemError as e:
+                return e.status, {'error': e.error}, {}
+            except RateLimited as e:
+                return 429, {'error': 'rate_limited'}, rate_limited_headers(e)
+            except StoreUnavailable:
+                return 503, {'error': 'store_unavailable'}, {'Retry-After': '1'}
+
+    async def _check_rate(self, buckets):
+        prefilter(buckets)
+        wait = await self.store.take_tokens(buckets)
+        if wait:
+            raise RateLimited(wait / 1000)
+
+    async def content(self, scope, send, content_id: int):
+        with self.flask_app.app_context():
+            try:
+                payload = bearer_payload(_header(scope, b'authorization') or '')
+                jti = payload.get('jti', '')
+                live, gen = revocation.lookup(jti)
+                if not live:
+                    live = await self.store.exists(f"jti:{jti}") == 1
+                    if live:
+                        revocation.remember(jti, payload.get('exp'), gen)
+                check_content(payload, content_id, live)
+                await last_seen.atouch(self.store, int(payload['sub']))
+            except AccessError as e:
+                return await _send_json(send, e.status, {'error': e.error})
+            except StoreUnavailable:
+                return await _send_json(send, 503, {'error': 'store_unavailable'}, {'Retry-After': '1'})
+            blob = catalog.lookup_blob(content_id)
+            if blob is catalog.MISS:
+                async with self.sessions() as s:
+                    row = (await s.execute(select(Content.url_or_blob_ref, Content.mime_type)
+                                           .where(Content.id == content_id))).first()
+                blob = (row[0], row[1]) if row else None
+                catalog.remember_blob(content_id, blob)
+            if blob is None:
+                return await _send_json(send, 404, {'error': 'not_found'})
+            try:
+                p = await asyncio.to_thread(storage.plan, blob[0], _header(scope, b'if-none-match'),
+                                            _header(scope, b'range'), _header(scope, b'if-range'))
+            except storage.BlobNotFound:
+                return await _send_json(send, 404, {'error': 'not_found'})
+            except storage.StorageError:
+                return await _send_json(send, 502, {'error': 'storage_unavailable'})
+        headers = p['headers']
+        if p['status'] in (200, 206):
+            headers['Content-Type'] = blob[1] or 'application/octet-stream'
+        await _send_stream(send, p['status'], headers, storage.body_chunks(p))
+
+def _header(scope, name: bytes):
+    for k, v in scope['headers']:
+        if k == name:
+            return v.decode('latin-1')
+    return None
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        msg = await receive()
+        body += msg.get('body', b'')
+        if len(body) > _MAX_BODY:
+            return None
+        if not msg.get('more_body'):
+            return body
+
+async def _send(send, status: int, body: bytes, headers: dict):
+    hdrs = [(k.lower().encode(), str(v).encode()) for k, v in headers.items()]
+    hdrs.append((b'content-length', str(len(body)).encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': hdrs})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def _send_stream(send, status: int, headers: dict, chunks):
+    # Blob bodies are pulled one chunk at a time off the event loop; headers carry Content-Length
+    hdrs = [(k.lower().encode(), str(v).encode()) for k, v in headers.items()]
+    await send({'type': 'http.response.start', 'status': status, 'headers': hdrs})
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            await asyncio.to_thread(close)
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def _send_json(send, status: int, payload: dict, headers: dict|None = None):
+    await _send(send, status, json.dumps(payload).encode(), {'Content-Type': 'application/json', **(headers or {})})
+
+def create_asgi_app():
+    return AsyncApp(create_app())
@@ -7,12 +7,121 @@ class Config:
     JWT_PRIVATE_KEY = os.environ.get('JWT_PRIVATE_KEY')
     JWT_PUBLIC_KEY = os.environ.get('JWT_PUBLIC_KEY')
     JWT_ALG = 'RS256'
+    JWT_KEYS_DIR = os.environ.get('JWT_KEYS_DIR')
+    JWT_ACTIVE_KID = os.environ.get('JWT_ACTIVE_KID')
+    JWT_KEYS_RELOAD_S = int(os.environ.get('JWT_KEYS_RELOAD_S', '30'))
+    JWKS_MAX_AGE_S = int(os.environ.get('JWKS_MAX_AGE_S', '300'))
+    JWT_VERIFY_CACHE_SIZE = int(os.environ.get('JWT_VERIFY_CACHE_SIZE', '10000'))
     MERCHANT_SALT = os.environ.get('MERCHANT_SALT', 'salt')
+    # QR opaque token: 'v1' (binary, base32) or 'legacy'; both are always accepted
+    OPAQUE_FORMAT = os.environ.get('OPAQUE_FORMAT', 'v1')
+    OPAQUE_MAC_BYTES = int(os.environ.get('OPAQUE_MAC_BYTES', '10'))
+    # Opaque tokens older than this are refused; CODE_TTL_S sets Code.expires_at at issuance (0 = never)
+    OPAQUE_MAX_AGE_S = int(os.environ.get('OPAQUE_MAX_AGE_S', '86400'))
+    CODE_TTL_S = int(os.environ.get('CODE_TTL_S', '86400'))
     REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', '50'))
+    REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_POOL_TIMEOUT', '1.0'))
+    REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', '0.25'))
+    REDIS_CONNECT_TIMEOUT = float(os.environ.get('REDIS_CONNECT_TIMEOUT', '0.25'))
+    REDIS_BREAKER_THRESHOLD = int(os.environ.get('REDIS_BREAKER_THRESHOLD', '3'))
+    REDIS_RECOVERY_INTERVAL_S = float(os.environ.get('REDIS_RECOVERY_INTERVAL_S', '2.0'))
+    MEMSTORE_MAX_KEYS = int(os.environ.get('MEMSTORE_MAX_KEYS', '1000000'))
+    MEMSTORE_SHARDS = int(os.environ.get('MEMSTORE_SHARDS', '16'))
+    # Token buckets as "<requests>/<seconds>"; empty disables that tier
+    RATE_LIMIT_IP = os.environ.get('RATE_LIMIT_IP', '20/60')
+    RATE_LIMIT_MERCHANT = os.environ.get('RATE_LIMIT_MERCHANT', '1200/60')
+    RATE_LIMIT_CODE = os.environ.get('RATE_LIMIT_CODE', '10/60')
+    RATE_LIMIT_LOCAL = os.environ.get('RATE_LIMIT_LOCAL', '1').lower() not in ('0', 'false', 'no')
+    RATE_LIMIT_LOCAL_MAX_KEYS = int(os.environ.get('RATE_LIMIT_LOCAL_MAX_KEYS', '100000'))
+    # Per-worker cache of live jtis, kept coherent by revocations published on REVOKE_CHANNEL
+    JTI_CACHE_SIZE = int(os.environ.get('JTI_CACHE_SIZE', '100000'))
+    JTI_CACHE_MAX_AGE_S = int(os.environ.get('JTI_CACHE_MAX_AGE_S', '300'))
+    REVOKE_CHANNEL = os.environ.get('REVOKE_CHANNEL', 'jti:revoked')
+    # Audit log writer: bounded per-worker queue flushed as multi-row INSERTs on size or time.
+    # AUDIT_OVERFLOW when full: drop_oldest | drop_new | block (up to AUDIT_BLOCK_S)
+    AUDIT_ENABLED = os.environ.get('AUDIT_ENABLED', '1').lower() not in ('0', 'false', 'no')
+    AUDIT_QUEUE_MAX = int(os.environ.get('AUDIT_QUEUE_MAX', '10000'))
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', '500'))
+    AUDIT_FLUSH_INTERVAL_S = float(os.environ.get('AUDIT_FLUSH_INTERVAL_S', '1.0'))
+    AUDIT_OVERFLOW = os.environ.get('AUDIT_OVERFLOW', 'drop_oldest')
+    AUDIT_BLOCK_S = float(os.environ.get('AUDIT_BLOCK_S', '0.05'))
+    # Redemption.last_seen_at is written behind: content accesses touch a store hash (at most
+    # once per code per worker every LAST_SEEN_MAX_STALENESS_S), flushed every LAST_SEEN_FLUSH_S
+    LAST_SEEN_ENABLED = os.environ.get('LAST_SEEN_ENABLED', '1').lower() not in ('0', 'false', 'no')
+    LAST_SEEN_FLUSH_S = float(os.environ.get('LAST_SEEN_FLUSH_S', '10'))
+    LAST_SEEN_MAX_STALENESS_S = float(os.environ.get('LAST_SEEN_MAX_STALENESS_S', '60'))
     BASE_URL = os.environ.get('BASE_URL', 'http://localhost:5000')
+    DECODE_PROCESSES = int(os.environ.get('DECODE_PROCESSES', '2'))
+    DECODE_QUEUE = int(os.environ.get('DECODE_QUEUE', '8'))
+    DECODE_TIMEOUT_S = float(os.environ.get('DECODE_TIMEOUT_S', '10'))
+    DECODE_MAX_BATCH = int(os.environ.get('DECODE_MAX_BATCH', '8'))
+    # Blob storage for Content.url_or_blob_ref: file:// refs may be confined to a root,
+    # s3:// refs go to AWS or any S3-compatible endpoint (MinIO, ...), http(s):// refs are
+    # proxied from their origin with this timeout per request
+    STORAGE_FILE_ROOT = os.environ.get('STORAGE_FILE_ROOT')
+    STORAGE_HTTP_TIMEOUT_S = float(os.environ.get('STORAGE_HTTP_TIMEOUT_S', '5'))
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+    S3_REGION = os.environ.get('S3_REGION')
     HLS_SEGMENT_DURATION = int(os.environ.get('HLS_SEGMENT_DURATION', '6'))
+    # Playback tokens for /api/hls: HMAC key (defaults to one derived from SECRET_KEY) and
+    # lifetime, which is also the upper bound on how long a revoked jti keeps streaming
+    SEGMENT_TOKEN_KEY = os.environ.get('SEGMENT_TOKEN_KEY')
+    SEGMENT_TOKEN_TTL_S = int(os.environ.get('SEGMENT_TOKEN_TTL_S', '120'))
+    # Packaging worker: "<height>:<video kbps>" renditions, one ffmpeg process each
+    HLS_RENDITIONS = os.environ.get('HLS_RENDITIONS', '1080:5000,720:2800,480:1400')
+    HLS_OUTPUT_DIR = os.environ.get('HLS_OUTPUT_DIR', 'hls')
+    HLS_PROCESSES = int(os.environ.get('HLS_PROCESSES', '2'))
+    HLS_POLL_S = float(os.environ.get('HLS_POLL_S', '2'))
+    HLS_PROGRESS_S = float(os.environ.get('HLS_PROGRESS_S', '5'))
+    HLS_JOB_STALE_S = int(os.environ.get('HLS_JOB_STALE_S', '120'))
+    HLS_MAX_ATTEMPTS = int(os.environ.get('HLS_MAX_ATTEMPTS', '3'))
+    FFMPEG_BIN = os.environ.get('FFMPEG_BIN', 'ffmpeg')
     ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY')
+    # Bearer token for the Prometheus scraper on /metrics (the admin key is accepted too)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
     WEBHOOK_KEY = os.environ.get('WEBHOOK_KEY')
+    # Payment webhook: event ids are deduped in the store (pending, then minted), and codes
+    # are minted by a per-worker background queue in batches of WEBHOOK_BATCH_SIZE
+    WEBHOOK_DEDUPE_TTL_S = int(os.environ.get('WEBHOOK_DEDUPE_TTL_S', '259200'))
+    WEBHOOK_PENDING_TTL_S = int(os.environ.get('WEBHOOK_PENDING_TTL_S', '300'))
+    WEBHOOK_QUEUE_MAX = int(os.environ.get('WEBHOOK_QUEUE_MAX', '10000'))
+    WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', '200'))
+    WEBHOOK_FLUSH_S = float(os.environ.get('WEBHOOK_FLUSH_S', '0.05'))
+    # Tries before a failing event is dropped from the queue (its pending key with it)
+    WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '5'))
+    ISSUE_BATCH_MAX = int(os.environ.get('ISSUE_BATCH_MAX', '100000'))
+    ISSUE_BATCH_CHUNK = int(os.environ.get('ISSUE_BATCH_CHUNK', '1000'))
+    # Code ids are reserved CODE_ID_BLOCK at a time per worker (id_block table); single
+    # issues are group-committed, CODE_WRITE_BATCH rows max, after lingering CODE_WRITE_LINGER_S
+    CODE_ID_BLOCK = int(os.environ.get('CODE_ID_BLOCK', '1000'))
+    CODE_WRITE_BATCH = int(os.environ.get('CODE_WRITE_BATCH', '500'))
+    CODE_WRITE_LINGER_S = float(os.environ.get('CODE_WRITE_LINGER_S', '0.002'))
+    CODE_WRITE_TIMEOUT_S = float(os.environ.get('CODE_WRITE_TIMEOUT_S', '5'))
+    # Pre-minted issue_qr pool per "merchant:product:duration" key (CODE_POOL_KEYS are filled at
+    # start, others on first miss): refilled to CODE_POOL_TARGET below CODE_POOL_LOW_WATER.
+    # Per worker: a restart voids up to workers x keys x CODE_POOL_TARGET codes. CODE_POOL_MAX_AGE_S
+    # is capped at 1% of OPAQUE_MAX_AGE_S
+    CODE_POOL_ENABLED = os.environ.get('CODE_POOL_ENABLED', '1').lower() not in ('0', 'false', 'no')
+    CODE_POOL_KEYS = os.environ.get('CODE_POOL_KEYS', '')
+    CODE_POOL_LOW_WATER = int(os.environ.get('CODE_POOL_LOW_WATER', '20'))
+    CODE_POOL_TARGET = int(os.environ.get('CODE_POOL_TARGET', '100'))
+    CODE_POOL_MAX_AGE_S = int(os.environ.get('CODE_POOL_MAX_AGE_S', '600'))
+    CODE_POOL_MAX_KEYS = int(os.environ.get('CODE_POOL_MAX_KEYS', '64'))
+    CODE_POOL_IDLE_S = float(os.environ.get('CODE_POOL_IDLE_S', '5'))
+    CATALOG_TTL_S = int(os.environ.get('CATALOG_TTL_S', '300'))
+    # workers/archiver.py: codes dead for ARCHIVE_RETENTION_DAYS move to the archive tables,
+    # ARCHIVE_CHUNK rows per transaction
+    ARCHIVE_RETENTION_DAYS = float(os.environ.get('ARCHIVE_RETENTION_DAYS', '90'))
+    ARCHIVE_CHUNK = int(os.environ.get('ARCHIVE_CHUNK', '1000'))
+    ARCHIVE_PAUSE_S = float(os.environ.get('ARCHIVE_PAUSE_S', '0'))
+    ARCHIVE_INTERVAL_S = int(os.environ.get('ARCHIVE_INTERVAL_S', '3600'))
+    # workers/expiry_sweeper.py: flips issued codes past expires_at to 'expired', EXPIRY_SWEEP_BATCH
+    # rows per UPDATE, waking on a heap of upcoming expiries read EXPIRY_LOOKAHEAD_S ahead
+    EXPIRY_SWEEP_BATCH = int(os.environ.get('EXPIRY_SWEEP_BATCH', '1000'))
+    EXPIRY_LOOKAHEAD_S = int(os.environ.get('EXPIRY_LOOKAHEAD_S', '3600'))
+    EXPIRY_HEAP_MAX = int(os.environ.get('EXPIRY_HEAP_MAX', '100000'))
+    EXPIRY_MAX_SLEEP_S = float(os.environ.get('EXPIRY_MAX_SLEEP_S', '300'))
 
     def __init__(self):
         # Optional fallbacks to support Secret Files on Render (/etc/secrets)
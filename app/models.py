@@ -3,6 +3,9 @@ from sqlalchemy import func
 
 db = SQLAlchemy()
 
+# BIGINT primary keys only autoincrement on SQLite as INTEGER (rowid alias)
+BigId = db.BigInteger().with_variant(db.Integer, 'sqlite')
+
 class Merchant(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -29,19 +32,19 @@ class Product(db.Model):
     policy_one_device = db.Column(db.Boolean, default=True)
 
 class Code(db.Model):
-    id = db.Column(db.BigInteger, primary_key=True)
+    id = db.Column(BigId, primary_key=True)
     merchant_id = db.Column(db.Integer, db.ForeignKey('merchant.id'))
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
     code_hash = db.Column(db.Text, nullable=False, unique=True)
-    batch_id = db.Column(db.String(64))
+    batch_id = db.Column(db.String(64), index=True)
     duration_min = db.Column(db.Integer)
     issued_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
-    expires_at = db.Column(db.DateTime(timezone=True))
-    status = db.Column(db.String(32), default='issued')
+    expires_at = db.Column(db.DateTime(timezone=True), index=True)
+    status = db.Column(db.String(32), default='issued', index=True)
 
 class Redemption(db.Model):
-    id = db.Column(db.BigInteger, primary_key=True)
-    code_id = db.Column(db.BigInteger, db.ForeignKey('code.id'))
+    id = db.Column(BigId, primary_key=True)
+    code_id = db.Column(db.BigInteger, db.ForeignKey('code.id'), index=True)
     device_id = db.Column(db.String(64))
     first_redeemed_at = db.Column(db.DateTime(timezone=True))
     last_seen_at = db.Column(db.DateTime(timezone=True))
@@ -50,9 +53,58 @@ class Redemption(db.Model):
     user_agent_first = db.Column(db.Text)
 
 class AuditLog(db.Model):
-    id = db.Column(db.BigInteger, primary_key=True)
+    id = db.Column(BigId, primary_key=True)
     ts = db.Column(db.DateTime(timezone=True), server_default=func.now())
     actor_type = db.Column(db.String(32))
     actor_id = db.Column(db.String(64))
     event_type = db.Column(db.String(64))
     payload_json = db.Column(db.JSON)
+
+class HlsJob(db.Model):
+    # Durable packaging queue; rows are claimed by workers/hls_packager.py
+    id = db.Column(db.Integer, primary_key=True)
+    content_id = db.Column(db.Integer, db.ForeignKey('content.id'), nullable=False, index=True)
+    status = db.Column(db.String(16), default='queued', index=True)  # queued|running|done|failed
+    attempts = db.Column(db.Integer, default=0)
+    worker = db.Column(db.String(64))
+    heartbeat_at = db.Column(db.DateTime(timezone=True))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+class IdBlock(db.Model):
+    # Hi-lo allocator state: next id not yet handed out per sequence (services/ids.py)
+    name = db.Column(db.String(32), primary_key=True)
+    next_id = db.Column(db.BigInteger, nullable=False)
+
+# Archive copies of Code/Redemption rows moved out by services/archive.py; same
+# columns plus archived_at, no foreign keys or unique constraints
+class CodeArchive(db.Model):
+    __tablename__ = 'code_archive'
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    merchant_id = db.Column(db.Integer)
+    product_id = db.Column(db.Integer)
+    code_hash = db.Column(db.Text, nullable=False)
+    batch_id = db.Column(db.String(64))
+    duration_min = db.Column(db.Integer)
+    issued_at = db.Column(db.DateTime(timezone=True))
+    expires_at = db.Column(db.DateTime(timezone=True))
+    status = db.Column(db.String(32))
+    archived_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+class RedemptionArchive(db.Model):
+    __tablename__ = 'redemption_archive'
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    code_id = db.Column(db.BigInteger, index=True)
+    device_id = db.Column(db.String(64))
+    first_redeemed_at = db.Column(db.DateTime(timezone=True))
+    last_seen_at = db.Column(db.DateTime(timezone=True))
+    access_jwt_id = db.Column(db.String(64))
+    ip_first = db.Column(db.String(64))
+    user_agent_first = db.Column(db.Text)
+    archived_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+class JobCursor(db.Model):
+    # Resume point of chunked background jobs (keyset position)
+    name = db.Column(db.String(32), primary_key=True)
+    position = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
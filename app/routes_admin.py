@@ -1,13 +1,16 @@
-from flask import Blueprint, jsonify, request, current_app, send_file
-from datetime import datetime
+from flask import Blueprint, jsonify, request, current_app, send_file, Response, stream_with_context, url_for
 import secrets
-import io
-import time
 import hashlib
+import io
+import json
 import base64
-from .models import db, Code
-from .services.tokens import make_opaque
-from .services.qr import make_qr_bytes
+from .models import db, Content
+from .services.qr import make_qr_bytes, make_qr_svg, EC_LEVELS
+from .services import catalog, qr, decode, hls, revocation, audit, last_seen, payments, ids, code_pool
+from .services.rate_limit import r, local_stats, load_session
+from .services.issuance import (new_code_hash, redeem_url_for, batch_progress, missing_slots, stream_batch, persist_code,
+                                writer_stats, code_expiry)
+from .services.ids import next_code_id
 
 bp = Blueprint('admin', __name__)
 
@@ -15,55 +18,195 @@ bp = Blueprint('admin', __name__)
 def ping():
     return jsonify({'admin': 'ok'})
 
-@bp.post('/issue-qr')
-def issue_qr():
+def _is_admin() -> bool:
     # Simple API-key auth
     api_key = request.headers.get('X-Admin-Key') or request.args.get('key')
-    if not api_key or api_key != (current_app.config.get('ADMIN_API_KEY') or ''):
+    return bool(api_key) and api_key == (current_app.config.get('ADMIN_API_KEY') or '')
+
+@bp.get('/stats')
+def stats():
+    # Per-worker cache and store counters
+    if not _is_admin():
+        return jsonify({'error': 'unauthorized'}), 401
+    return jsonify({'store': r().stats(), 'rate_local': local_stats(), 'catalog': catalog.stats(), 'qr_cache': qr.cache_stats(),
+                    'decode': decode.stats(), 'jti_cache': revocation.stats(),
+                    'audit': audit.stats(), 'last_seen': last_seen.stats(),
+                    'webhook': payments.stats(), 'code_ids': ids.stats(), 'code_writer': writer_stats(),
+                    'code_pool': code_pool.stats()})
+
+@bp.post('/catalog/invalidate')
+def catalog_invalidate():
+    # Drops this worker's product cache; other workers converge within CATALOG_TTL_S
+    if not _is_admin():
+        return jsonify({'error': 'unauthorized'}), 401
+    data = request.get_json(silent=True) or {}
+    pid = data.get('product_id')
+    catalog.invalidate(int(pid) if pid is not None else None)
+    return jsonify({'ok': True, 'stats': catalog.stats()})
+
+@bp.post('/revoke')
+def revoke():
+    # Kills an access token everywhere: store key deleted, worker caches evicted via pub/sub.
+    # Its code is set to 'void' first, so the holder cannot redeem it again for a fresh token.
+    if not _is_admin():
+        return jsonify({'error': 'unauthorized'}), 401
+    data = request.get_json(silent=True) or {}
+    jti = data.get('jti')
+    code_id = int(data['code_id']) if data.get('code_id') is not None else None
+    if not jti and code_id is not None:
+        sess = load_session(code_id)
+        jti = sess and sess.get('jti')
+    if not jti and code_id is None:
+        return jsonify({'error': 'missing_jti'}), 400
+    voided = revocation.void_code(code_id, jti)
+    return jsonify({'jti': jti, 'code_id': voided, 'revoked': revocation.revoke(jti) if jti else False})
+
+@bp.post('/content/<int:content_id>/hls')
+def hls_enqueue(content_id: int):
+    # Queues HLS packaging for a media content; workers/hls_packager.py picks it up
+    if not _is_admin():
+        return jsonify({'error': 'unauthorized'}), 401
+    try:
+        job, created = hls.enqueue(content_id)
+    except hls.PackagingError as e:
+        err = str(e)
+        return jsonify({'error': err}), 404 if err == 'not_found' else 400
+    return jsonify({'job_id': job.id, 'status': job.status, 'created': created}), 202
+
+@bp.get('/content/<int:content_id>/hls')
+def hls_status(content_id: int):
+    if not _is_admin():
+        return jsonify({'error': 'unauthorized'}), 401
+    content = db.session.get(Content, content_id)
+    if content is None:
+        return jsonify({'error': 'not_found'}), 404
+    return jsonify((content.meta or {}).get('hls') or {'status': 'none'})
+
+@bp.post('/issue-qr')
+def issue_qr():
+    if not _is_admin():
         return jsonify({'error': 'unauthorized'}), 401
 
     data = request.get_json(silent=True) or {}
     merchant_id = int(data.get('merchant_id') or 1)
     product_id = int(data.get('product_id') or 1)
     duration_min = int(data.get('duration_min') or 15)
+    qr_opts = {
+        'error_correction': str(data.get('qr_ec') or 'M').upper(),
+        'box_size': int(data.get('qr_box_size') or 10),
+    }
+    if qr_opts['error_correction'] not in EC_LEVELS or not 1 <= qr_opts['box_size'] <= 40:
+        return jsonify({'error': 'invalid_qr_options'}), 400
 
-    # Create a lightweight code record
-    now = datetime.utcnow()
-    random_value = secrets.token_hex(16)
-    code_hash = hashlib.sha256(f"{merchant_id}.{product_id}.{random_value}".encode()).hexdigest()
-    code = Code(
-        merchant_id=merchant_id,
-        product_id=product_id,
-        code_hash=code_hash,
-        duration_min=duration_min,
-        status='issued',
-    )
-    db.session.add(code)
-    db.session.commit()
-
-    opaque = make_opaque(code.id, merchant_id, int(time.time()))
-    redeem_url = f"{current_app.config.get('BASE_URL')}/redeem?c={opaque}"
-    png = make_qr_bytes(redeem_url)
+    accept = request.headers.get('Accept', '')
+    if qr_opts == {'error_correction': 'M', 'box_size': 10} and 'image/svg+xml' not in accept:
+        # Pre-minted code with its PNG already rendered: no DB or render work here
+        ready = code_pool.take(merchant_id, product_id, duration_min)
+        if ready is not None:
+            return _issued(*ready, accept)
+
+    # The id comes from this worker's reserved block: the row is group-committed
+    # in the background while the token and QR are rendered
+    code_id = next_code_id()
+    saved = persist_code({
+        'id': code_id,
+        'merchant_id': merchant_id,
+        'product_id': product_id,
+        'code_hash': new_code_hash(merchant_id, product_id),
+        'duration_min': duration_min,
+        'expires_at': code_expiry(),
+        'status': 'issued',
+    })
+    redeem_url = redeem_url_for(code_id, merchant_id)
 
     # Return multipart-like JSON + optional binary when asked
-    accept = request.headers.get('Accept', '')
+    if 'image/svg+xml' in accept:
+        body = make_qr_svg(redeem_url, **qr_opts)
+    else:
+        png = make_qr_bytes(redeem_url, **qr_opts)
+    try:
+        saved.result(timeout=current_app.config['CODE_WRITE_TIMEOUT_S'])
+    except Exception:
+        return jsonify({'error': 'issue_failed'}), 503
+    if 'image/svg+xml' in accept:
+        return Response(body, mimetype='image/svg+xml')
+    return _issued(code_id, redeem_url, png, accept)
+
+def _issued(code_id: int, redeem_url: str, png: bytes, accept: str):
     if 'image/png' in accept:
         return send_file(
-            io.BytesIO(png), mimetype='image/png', as_attachment=False, download_name=f"qr_{code.id}.png",
+            io.BytesIO(png), mimetype='image/png', as_attachment=False, download_name=f"qr_{code_id}.png",
             etag=False,
         )
     return jsonify({
         'ok': True,
-        'code_id': code.id,
+        'code_id': code_id,
         'redeem_url': redeem_url,
         'qr_png_b64': base64.b64encode(png).decode('ascii'),
     })
 
-@bp.post('/payment-webhook')
-def payment_webhook():
+@bp.post('/issue-qr/batch')
+def issue_qr_batch():
+    """Mint `count` codes under one batch id and stream their redeem URLs as NDJSON.
+
+    Re-posting the same batch_id with the same terms resumes: codes already
+    minted are streamed back first and only the missing slots are inserted.
+    """
+    if not _is_admin():
+        return jsonify({'error': 'unauthorized'}), 401
+
+    data = request.get_json(silent=True) or {}
+    merchant_id = int(data.get('merchant_id') or 1)
+    product_id = int(data.get('product_id') or 1)
+    duration_min = int(data.get('duration_min') or 15)
+    count = int(data.get('count') or 0)
+    if count < 1 or count > current_app.config['ISSUE_BATCH_MAX']:
+        return jsonify({'error': 'invalid_count', 'max': current_app.config['ISSUE_BATCH_MAX']}), 400
+    batch_id = str(data.get('batch_id') or secrets.token_hex(8))
+    # 'evt:' ids belong to the payment webhook (payments.event_batch_id), whose code hashes they would share
+    if len(batch_id) > 64 or batch_id.startswith('evt:'):
+        return jsonify({'error': 'invalid_batch_id'}), 400
+
+    _, terms = batch_progress(batch_id)
+    if terms and terms != {(merchant_id, product_id, duration_min)}:
+        return jsonify({'error': 'batch_mismatch', 'batch_id': batch_id}), 409
+    missing = missing_slots(batch_id, count) if terms else list(range(count))
+    chunk = current_app.config['ISSUE_BATCH_CHUNK']
+
+    def generate():
+        yield json.dumps({'batch_id': batch_id, 'count': count, 'resumed_from': count - len(missing)}) + '\n'
+        minted = 0
+        try:
+            for code_id, redeem_url, resumed in stream_batch(batch_id, merchant_id, product_id, duration_min,
+                                                             count, chunk, missing):
+                minted += 0 if resumed else 1
+                yield json.dumps({'code_id': code_id, 'redeem_url': redeem_url}) + '\n'
+        except Exception as e:
+            db.session.rollback()
+            yield json.dumps({'error': 'batch_failed', 'detail': str(e), 'minted': minted}) + '\n'
+            return
+        yield json.dumps({'done': True, 'batch_id': batch_id, 'minted': minted}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-store', 'X-Batch-Id': batch_id})
+
+def _webhook_authorized() -> bool:
     # Minimal shared-secret auth for webhook
     key = request.headers.get('X-Webhook-Key')
-    if not key or key != (current_app.config.get('WEBHOOK_KEY') or ''):
+    return bool(key) and key == (current_app.config.get('WEBHOOK_KEY') or '')
+
+def _webhook_event_id(body: dict, data: dict) -> str:
+    # Provider event id; without one, retries of the same payload still share the body hash
+    eid = body.get('id') or data.get('event_id')
+    return str(eid) if eid else hashlib.sha256(request.get_data()).hexdigest()
+
+@bp.post('/payment-webhook')
+def payment_webhook():
+    """Acknowledge a payment event with 202 once queued; the code is minted in the background.
+
+    Retries of an event already minted get its code back with 200.
+    """
+    if not _webhook_authorized():
         return jsonify({'error': 'unauthorized'}), 401
 
     body = request.get_json(silent=True) or {}
@@ -72,24 +215,32 @@ def payment_webhook():
     if event != 'payment.succeeded':
         return jsonify({'ok': True, 'skipped': True})
 
+    event_id = _webhook_event_id(body, data)
     merchant_id = int(data.get('merchant_id') or 1)
     product_id = int(data.get('product_id') or 1)
     duration_min = int(data.get('duration_min') or 15)
 
-    # Reuse issuance logic
-    random_value = secrets.token_hex(16)
-    code_hash = hashlib.sha256(f"{merchant_id}.{product_id}.{random_value}".encode()).hexdigest()
-    code = Code(
-        merchant_id=merchant_id,
-        product_id=product_id,
-        code_hash=code_hash,
-        duration_min=duration_min,
-        status='issued',
-    )
-    db.session.add(code)
-    db.session.commit()
-
-    opaque = make_opaque(code.id, merchant_id, int(time.time()))
-    redeem_url = f"{current_app.config.get('BASE_URL')}/redeem?c={opaque}"
-    # Return simple payload for your system to email/SMS the link or QR
-    return jsonify({'ok': True, 'code_id': code.id, 'redeem_url': redeem_url})
+    try:
+        status, state = payments.accept(event_id, merchant_id, product_id, duration_min, data.get('id'))
+    except payments.InvalidEvent:
+        return jsonify({'error': 'unknown_product', 'event_id': event_id}), 422
+    except payments.QueueFull:
+        return jsonify({'error': 'busy'}), 503, {'Retry-After': '5'}
+    if state is not None:
+        return jsonify({'ok': True, 'event_id': event_id, 'status': 'done', 'code_id': state['code_id'],
+                        'redeem_url': redeem_url_for(state['code_id'], state['merchant_id'])})
+    # Poll the status URL for the redeem link to email/SMS
+    return jsonify({'ok': True, 'event_id': event_id, 'status': 'queued', 'duplicate': status == 'duplicate',
+                    'status_url': url_for('admin.payment_event', event_id=event_id)}), 202
+
+@bp.get('/payment-webhook/<event_id>')
+def payment_event(event_id: str):
+    if not (_webhook_authorized() or _is_admin()):
+        return jsonify({'error': 'unauthorized'}), 401
+    status, code = payments.lookup(event_id)
+    if status is None:
+        return jsonify({'error': 'not_found'}), 404
+    if code is None:
+        return jsonify({'event_id': event_id, 'status': status}), 202
+    return jsonify({'event_id': event_id, 'status': status, 'code_id': code.id,
+                    'redeem_url': redeem_url_for(code.id, code.merchant_id)})
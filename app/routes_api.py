@@ -1,56 +1,105 @@
+import os, re, time
 from flask import Blueprint, request, jsonify, Response, current_app
 from .services.redeem import do_redeem
-from .services.rate_limit import has_jti
-import jwt
+from .services.tokens import make_segment_token, check_segment_token
+from .services.decode import DecoderBusy, pool as decode_pool
+from .services import catalog, storage, revocation, last_seen
+from .services.access import AccessError, bearer_payload, check_content
 
 bp = Blueprint('api', __name__)
 
+_HLS_FILE = re.compile(r'master\.m3u8|\d+p/(index\.m3u8|seg_\d+\.ts)')
+
 @bp.post('/redeem')
 def redeem():
     return do_redeem()
 
 @bp.get('/content/<int:content_id>')
 def content(content_id: int):
-    auth = request.headers.get('Authorization','')
-    if not auth.startswith('Bearer '):
-        return jsonify({'error': 'missing_token'}), 401
-    token = auth.split(' ')[1]
     try:
-        pub = current_app.config.get('JWT_PUBLIC_KEY')
-        alg = current_app.config.get('JWT_ALG', 'RS256')
-        payload = jwt.decode(token, pub, algorithms=[alg])
-    except jwt.ExpiredSignatureError:
-        return jsonify({'error': 'expired'}), 401
-    except Exception:
-        return jsonify({'error': 'invalid'}), 401
+        payload = bearer_payload(request.headers.get('Authorization',''))
+        check_content(payload, content_id, revocation.is_live(payload.get('jti',''), payload.get('exp')))
+    except AccessError as e:
+        return jsonify({'error': e.error}), e.status
+    last_seen.touch(int(payload['sub']))
+    blob = catalog.content_blob(content_id)
+    if blob is None:
+        return jsonify({'error': 'not_found'}), 404
+    try:
+        return storage.send_blob(blob[0], blob[1], request)
+    except storage.BlobNotFound:
+        return jsonify({'error': 'not_found'}), 404
+    except storage.StorageError:
+        return jsonify({'error': 'storage_unavailable'}), 502
 
-    if not has_jti(payload.get('jti','')):
-        return jsonify({'error': 'revoked'}), 403
-    if int(payload.get('content_id', -1)) != content_id:
-        return jsonify({'error': 'wrong_content'}), 403
+@bp.post('/playback/<int:content_id>')
+def playback(content_id: int):
+    # Trades the access JWT for a short-lived HMAC token scoped to /api/hls/<content_id>/ and bound
+    # to the JWT's jti. The player calls this again before expires_at to renew it (refresh_in).
+    try:
+        payload = bearer_payload(request.headers.get('Authorization',''))
+        check_content(payload, content_id, revocation.is_live(payload.get('jti',''), payload.get('exp')))
+    except AccessError as e:
+        return jsonify({'error': e.error}), e.status
+    last_seen.touch(int(payload['sub']))
+    now = int(time.time())
+    exp_ts = min(now + current_app.config['SEGMENT_TOKEN_TTL_S'], int(payload['exp']))
+    token = make_segment_token(content_id, exp_ts, payload['jti'])
+    base = f"/api/hls/{content_id}/"
+    resp = jsonify({'token': token, 'expires_at': exp_ts, 'refresh_in': max((exp_ts - now) * 3 // 4, 1),
+                    'master_url': f"{base}master.m3u8?st={token}"})
+    resp.set_cookie('st', token, max_age=exp_ts - now, path=base, httponly=True,
+                    secure=request.is_secure, samesite='Lax')
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
 
-    return Response(f"<html><body>Protected content {content_id}</body></html>", mimetype='text/html', headers={'Cache-Control':'no-store'})
+@bp.get('/hls/<int:content_id>/<path:name>')
+def hls_file(content_id: int, name: str):
+    # One HMAC and an in-process revocation check per playlist/segment request: no JWT verify,
+    # no store or DB lookup
+    query_token = request.args.get('st')
+    jti = check_segment_token(query_token or request.cookies.get('st') or '', content_id)
+    if jti is None or revocation.revoked_recently(jti):
+        return jsonify({'error': 'forbidden'}), 403
+    if not _HLS_FILE.fullmatch(name):
+        return jsonify({'error': 'not_found'}), 404
+    root = os.path.join(current_app.config['HLS_OUTPUT_DIR'], str(content_id))
+    if name.endswith('.m3u8'):
+        try:
+            with open(os.path.join(root, name)) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return jsonify({'error': 'not_found'}), 404
+        if query_token:
+            # Cookie-less players: carry the token on every URI the playlist references
+            lines = [l if not l or l.startswith('#') else f"{l}?st={query_token}" for l in lines]
+        return Response('\n'.join(lines) + '\n', mimetype='application/vnd.apple.mpegurl',
+                        headers={'Cache-Control': 'no-store'})
+    try:
+        return storage.send_from(storage.FileStorage(root), os.path.join(root, name), 'video/mp2t', request)
+    except storage.BlobNotFound:
+        return jsonify({'error': 'not_found'}), 404
 
 @bp.post('/decode')
 def decode_qr():
-    # Accept multipart/form-data with file field 'image'
-    if 'image' not in request.files:
+    # Accept multipart/form-data with one or more file fields 'image'
+    files = request.files.getlist('image')
+    if not files:
         return jsonify({'error': 'missing_file'}), 400
-    file = request.files['image']
-    data = file.read()
-    if not data:
+    if len(files) > current_app.config.get('DECODE_MAX_BATCH', 8):
+        return jsonify({'error': 'too_many_files'}), 400
+    images = [f.read() for f in files]
+    if not all(images):
         return jsonify({'error': 'empty_file'}), 400
     try:
-        import numpy as np
-        import cv2
-        arr = np.frombuffer(data, dtype=np.uint8)
-        img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-        if img is None:
-            return jsonify({'error': 'bad_image'}), 400
-        detector = cv2.QRCodeDetector()
-        val, points, _ = detector.detectAndDecode(img)
-        if not val:
-            return jsonify({'ok': False})
-        return jsonify({'ok': True, 'raw': val})
+        results = decode_pool(current_app.config).decode_many(images)
+    except DecoderBusy:
+        return jsonify({'error': 'decoder_busy'}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'error': 'decode_failed', 'detail': str(e)}), 500
+    if len(files) > 1:
+        return jsonify({'results': results})
+    res = results[0]
+    if 'error' in res:
+        return jsonify(res), 400
+    return jsonify(res)
@@ -1,5 +1,6 @@
-from flask import Blueprint, render_template, request
+from flask import Blueprint, render_template, request, jsonify, current_app
 from .services.device import fingerprint_device
+from .services.keyring import jwks
 
 bp = Blueprint('public', __name__)
 
@@ -12,3 +13,11 @@ def redeem_page():
     opaque = request.args.get('c','')
     device_id, resp_cookie = fingerprint_device()
     return render_template('redeem.html', opaque=opaque, device_id=device_id)
+
+@bp.get('/.well-known/jwks.json')
+def jwks_json():
+    resp = jsonify(jwks())
+    resp.cache_control.public = True
+    resp.cache_control.max_age = current_app.config.get('JWKS_MAX_AGE_S', 300)
+    resp.add_etag()
+    return resp.make_conditional(request)
@@ -0,0 +1,28 @@
+import jwt
+from .tokens import verify_access_jwt
+
+# Bearer checks shared by the WSGI and ASGI content endpoints; the jti lookup is
+# left to the caller so each can use its own (sync or async) store.
+
+class AccessError(Exception):
+    def __init__(self, error: str, status: int):
+        super().__init__(error)
+        self.error = error
+        self.status = status
+
+def bearer_payload(auth: str) -> dict:
+    if not auth.startswith('Bearer '):
+        raise AccessError('missing_token', 401)
+    token = auth.split(' ')[1]
+    try:
+        return verify_access_jwt(token)
+    except jwt.ExpiredSignatureError:
+        raise AccessError('expired', 401)
+    except Exception:
+        raise AccessError('invalid', 401)
+
+def check_content(payload: dict, content_id: int, jti_live: bool):
+    if not jti_live:
+        raise AccessError('revoked', 403)
+    if int(payload.get('content_id', -1)) != content_id:
+        raise AccessError('wrong_content', 403)
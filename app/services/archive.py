@@ -0,0 +1,79 @@
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, insert, delete, exists, or_, and_, func
+from ..models import db, Code, Redemption, CodeArchive, RedemptionArchive, JobCursor
+from .metrics import observe
+
+# Moves dead codes, with their redemptions, to code_archive/redemption_archive.
+# A code is dead once it is older than the retention window by any of:
+#   expires_at                    (set at issuance / by the expiry sweeper)
+#   issued_at, for status void|expired
+#   its redemption's last_seen_at (first_redeemed_at when never seen again)
+# Work goes in keyset chunks of Code.id: each chunk is copied, deleted and the
+# cursor advanced in one transaction, so a run stopped at any point resumes after
+# the last committed chunk and never archives a row twice. A completed pass
+# resets the cursor to 0.
+
+CURSOR = 'archive'
+
+_CODE_COLS = ['id', 'merchant_id', 'product_id', 'code_hash', 'batch_id', 'duration_min', 'issued_at',
+              'expires_at', 'status']
+_REDEMPTION_COLS = ['id', 'code_id', 'device_id', 'first_redeemed_at', 'last_seen_at', 'access_jwt_id',
+                    'ip_first', 'user_agent_first']
+
+def cutoff_for(retention_days: float, now: datetime|None = None) -> datetime:
+    return (now or datetime.now(timezone.utc)) - timedelta(days=retention_days)
+
+def archivable(cutoff: datetime):
+    used = exists().where(Redemption.code_id == Code.id,
+                          func.coalesce(Redemption.last_seen_at, Redemption.first_redeemed_at) < cutoff)
+    return or_(Code.expires_at < cutoff,
+               and_(Code.status.in_(('void', 'expired')), Code.issued_at < cutoff),
+               used)
+
+def _cursor() -> JobCursor:
+    cur = db.session.get(JobCursor, CURSOR)
+    if cur is None:
+        cur = JobCursor(name=CURSOR, position=0)
+        db.session.add(cur)
+    return cur
+
+def archive_chunk(cutoff: datetime, chunk: int = 1000) -> int:
+    """Archive the next chunk after the cursor; returns rows moved (0 ends the pass)."""
+    cur = _cursor()
+    ids = db.session.scalars(select(Code.id).where(Code.id > cur.position, archivable(cutoff))
+                             .order_by(Code.id).limit(chunk)).all()
+    if not ids:
+        cur.position = 0
+        db.session.commit()
+        return 0
+    db.session.execute(insert(CodeArchive).from_select(
+        _CODE_COLS, select(*(getattr(Code, c) for c in _CODE_COLS)).where(Code.id.in_(ids))))
+    db.session.execute(insert(RedemptionArchive).from_select(
+        _REDEMPTION_COLS, select(*(getattr(Redemption, c) for c in _REDEMPTION_COLS))
+        .where(Redemption.code_id.in_(ids))))
+    db.session.execute(delete(Redemption).where(Redemption.code_id.in_(ids))
+                       .execution_options(synchronize_session=False))
+    db.session.execute(delete(Code).where(Code.id.in_(ids)).execution_options(synchronize_session=False))
+    cur.position = ids[-1]
+    db.session.commit()
+    return len(ids)
+
+def run(retention_days: float, chunk: int = 1000, max_chunks: int|None = None, pause_s: float = 0.0,
+        should_stop=lambda: False) -> dict:
+    """Archive until the pass completes, max_chunks is reached or should_stop() is true."""
+    cutoff = cutoff_for(retention_days)
+    moved = chunks = 0
+    t0 = time.perf_counter()
+    while not should_stop() and (max_chunks is None or chunks < max_chunks):
+        c0 = time.perf_counter()
+        n = archive_chunk(cutoff, chunk)
+        observe('archive.chunk', time.perf_counter() - c0)
+        if not n:
+            break
+        moved += n
+        chunks += 1
+        if pause_s:
+            time.sleep(pause_s)
+    return {'moved': moved, 'chunks': chunks, 'seconds': round(time.perf_counter() - t0, 3),
+            'cursor': _cursor().position, 'cutoff': cutoff.isoformat()}
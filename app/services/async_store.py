@@ -0,0 +1,91 @@
+import os, time
+import redis.asyncio as aredis
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from flask import current_app
+from . import rate_limit
+from .metrics import span
+from .breaker import StoreUnavailable, pool_exhausted
+
+_TRIP = (RedisConnectionError, RedisTimeoutError)
+
+class AsyncStore:
+    """Async twin of rate_limit.r() for the ASGI app.
+
+    Talks to Redis through redis.asyncio with its own pool. On connection errors
+    (or with USE_REDIS=0) calls go to the worker's local store for
+    REDIS_RECOVERY_INTERVAL_S before Redis is tried again. An exhausted pool is
+    load, not an outage: it raises StoreUnavailable instead.
+    """
+
+    def __init__(self, client, local, retry_after: float):
+        self.client = client
+        self.local = local
+        self.retry_after = retry_after
+        self._down_until = 0.0
+        self._take = client.register_script(rate_limit._TAKE_LUA) if client is not None else None
+
+    @classmethod
+    def from_app(cls):
+        cfg = current_app.config
+        sync = rate_limit.r()
+        local = getattr(sync, 'fallback', sync)
+        use_redis = os.environ.get('USE_REDIS', '1').lower() not in ('0', 'false', 'no')
+        client = None
+        if use_redis and cfg.get('REDIS_URL'):
+            client = aredis.from_url(
+                cfg['REDIS_URL'], decode_responses=True,
+                max_connections=cfg.get('REDIS_MAX_CONNECTIONS', 50),
+                socket_timeout=cfg.get('REDIS_SOCKET_TIMEOUT', 0.25),
+                socket_connect_timeout=cfg.get('REDIS_CONNECT_TIMEOUT', 0.25),
+            )
+        return cls(client, local, cfg.get('REDIS_RECOVERY_INTERVAL_S', 2.0))
+
+    def _remote(self) -> bool:
+        return self.client is not None and time.monotonic() >= self._down_until
+
+    def _down(self):
+        self._down_until = time.monotonic() + self.retry_after
+
+    def _failed(self, e: Exception):
+        if pool_exhausted(e):
+            raise StoreUnavailable('redis connection pool exhausted') from e
+        self._down()
+
+    async def take_tokens(self, buckets, writes=()):
+        if self._remote():
+            keys = [b[0] for b in buckets] + [w[0] for w in writes]
+            args = [len(buckets)]
+            for _, cap, rate in buckets:
+                args += [cap, repr(rate)]
+            for _, ttl, value in writes:
+                args += [max(1, int(ttl)), value]
+            try:
+                with span('redis.take_tokens'):
+                    return int(await self._take(keys=keys, args=args))
+            except _TRIP as e:
+                self._failed(e)
+        return self.local.take_tokens(buckets, writes)
+
+    async def exists(self, key: str) -> int:
+        if self._remote():
+            try:
+                with span('redis.exists'):
+                    found = await self.client.exists(key)
+                if found:
+                    return 1
+            except _TRIP as e:
+                self._failed(e)
+        return self.local.exists(key)
+
+    async def hset(self, key: str, field: str, value) -> int:
+        if self._remote():
+            try:
+                with span('redis.hset'):
+                    return await self.client.hset(key, field, value)
+            except _TRIP as e:
+                self._failed(e)
+        return self.local.hset(key, field, value)
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
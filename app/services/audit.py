@@ -0,0 +1,154 @@
+import os, time, atexit, threading
+from collections import deque
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import insert
+from ..models import db, AuditLog
+from .metrics import observe
+
+# Audit events are queued in process and written by a background thread as
+# multi-row INSERTs, one commit per batch, so request handlers never wait on the
+# audit table. A batch goes out when AUDIT_BATCH_SIZE rows are waiting or
+# AUDIT_FLUSH_INTERVAL_S after the previous flush. The queue is bounded by
+# AUDIT_QUEUE_MAX; when it is full AUDIT_OVERFLOW decides what is lost:
+#   drop_oldest  evict the oldest queued row (default: the newest events win)
+#   drop_new     refuse the incoming row
+#   block        wait up to AUDIT_BLOCK_S for room, then refuse it
+# The queue is drained at interpreter exit and from gunicorn's worker_exit hook.
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_new', 'block')
+
+class AuditWriter:
+    def __init__(self, app, max_queue: int = 10000, batch_size: int = 500, interval: float = 1.0,
+                 overflow: str = 'drop_oldest', block_s: float = 0.05):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"AUDIT_OVERFLOW must be one of {OVERFLOW_POLICIES}")
+        self.app = app
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.interval = interval
+        self.overflow = overflow
+        self.block_s = block_s
+        self._q = deque()           # (enqueued_at monotonic, row)
+        self._cv = threading.Condition()
+        self._closed = False
+        self.stats = {'enqueued': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'errors': 0,
+                      'last_batch_lag_ms': 0.0, 'max_batch_lag_ms': 0.0, 'last_flush_ms': 0.0}
+        self._thread = threading.Thread(target=self._run, name='audit-flusher', daemon=True)
+        self._thread.start()
+
+    def put(self, row: dict) -> bool:
+        """Queue one row; False when it was dropped."""
+        with self._cv:
+            if self._closed:
+                self.stats['dropped'] += 1
+                return False
+            if len(self._q) >= self.max_queue:
+                if self.overflow == 'drop_oldest':
+                    self._q.popleft()
+                    self.stats['dropped'] += 1
+                elif self.overflow == 'block' and self._cv.wait_for(
+                        lambda: len(self._q) < self.max_queue or self._closed, timeout=self.block_s) \
+                        and not self._closed:
+                    pass
+                else:
+                    self.stats['dropped'] += 1
+                    return False
+            self._q.append((time.monotonic(), row))
+            self.stats['enqueued'] += 1
+            if len(self._q) >= self.batch_size:
+                self._cv.notify_all()
+            return True
+
+    def _run(self):
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: len(self._q) >= self.batch_size or self._closed, timeout=self.interval)
+                batch = [self._q.popleft() for _ in range(min(self.batch_size, len(self._q)))]
+                done = self._closed and not self._q
+                # Room was made: wake producers blocked by the 'block' policy
+                self._cv.notify_all()
+            if batch and not self._write(batch):
+                time.sleep(self.interval)
+            if done and not batch:
+                return
+
+    def _write(self, batch: list) -> bool:
+        t0 = time.monotonic()
+        try:
+            with self.app.app_context():
+                db.session.execute(insert(AuditLog), [row for _, row in batch])
+                db.session.commit()
+        except Exception:
+            self.stats['errors'] += 1
+            with self._cv:
+                # Retry later if there is room; what does not fit is counted as dropped
+                room = max(0, self.max_queue - len(self._q))
+                self._q.extendleft(reversed(batch[:room]))
+                self.stats['dropped'] += len(batch) - min(room, len(batch))
+            return False
+        now = time.monotonic()
+        lag = (now - batch[0][0]) * 1000
+        s = self.stats
+        s['written'] += len(batch)
+        s['batches'] += 1
+        s['last_batch_lag_ms'] = round(lag, 2)
+        s['max_batch_lag_ms'] = max(s['max_batch_lag_ms'], round(lag, 2))
+        s['last_flush_ms'] = round((now - t0) * 1000, 2)
+        observe('audit.flush', now - t0)
+        observe('audit.lag', now - batch[0][0])
+        return True
+
+    def close(self, timeout: float = 5.0):
+        """Stop accepting rows and wait for the queue to drain."""
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+        self._thread.join(timeout)
+
+    def snapshot(self) -> dict:
+        with self._cv:
+            depth = len(self._q)
+            lag = (time.monotonic() - self._q[0][0]) * 1000 if self._q else 0.0
+        return {**self.stats, 'queued': depth, 'lag_ms': round(lag, 2), 'overflow': self.overflow}
+
+_writer = None
+_pid = None
+_lock = threading.Lock()
+
+def writer():
+    """This worker's AuditWriter, started after fork (gunicorn preload_app); None when disabled."""
+    global _writer, _pid
+    if _pid == os.getpid():
+        return _writer
+    with _lock:
+        if _pid != os.getpid():
+            cfg = current_app.config
+            _writer = None
+            if cfg.get('AUDIT_ENABLED', True):
+                _writer = AuditWriter(current_app._get_current_object(),
+                                      cfg.get('AUDIT_QUEUE_MAX', 10000), cfg.get('AUDIT_BATCH_SIZE', 500),
+                                      cfg.get('AUDIT_FLUSH_INTERVAL_S', 1.0), cfg.get('AUDIT_OVERFLOW', 'drop_oldest'),
+                                      cfg.get('AUDIT_BLOCK_S', 0.05))
+            _pid = os.getpid()
+    return _writer
+
+def record(actor_type: str, actor_id, event_type: str, payload: dict|None = None) -> bool:
+    """Queue an audit event; never blocks on the database."""
+    w = writer()
+    if w is None:
+        return False
+    return w.put({'ts': datetime.now(timezone.utc), 'actor_type': actor_type,
+                  'actor_id': None if actor_id is None else str(actor_id)[:64],
+                  'event_type': event_type, 'payload_json': payload})
+
+def shutdown(timeout: float = 5.0):
+    if _writer is not None and _pid == os.getpid():
+        _writer.close(timeout)
+
+def stats() -> dict:
+    if _writer is None or _pid != os.getpid():
+        return {'enabled': False}
+    return {'enabled': True, **_writer.snapshot()}
+
+atexit.register(shutdown)
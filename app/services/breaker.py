@@ -0,0 +1,154 @@
+import os, time, threading
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from .metrics import observe
+
+_TRIP = (RedisConnectionError, RedisTimeoutError)
+_LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, float('inf'))
+# redis-py raises ConnectionError (MaxConnectionsError in recent versions) when no
+# pooled connection frees up in time: Redis is healthy, this process is just busy
+_POOL_EXHAUSTED = ('No connection available', 'Too many connections')
+
+class StoreUnavailable(RuntimeError):
+    """The shared store cannot serve this call right now; the request should be retried (503)."""
+
+def pool_exhausted(e: Exception) -> bool:
+    return isinstance(e, RedisConnectionError) and str(e).startswith(_POOL_EXHAUSTED)
+
+class ManagedStore:
+    """Routes store calls to Redis, degrading to a local store while Redis is unreachable.
+
+    closed: calls go to the primary; `threshold` consecutive connection/timeout
+            errors open the breaker (the failing call is replayed on the fallback).
+    open:   calls go to the fallback while a background thread pings the primary
+            every `interval` seconds and closes the breaker once it answers.
+    Reads that miss on the primary after a recovery also consult the fallback, so
+    sessions and jtis written during the outage stay visible, but only until the
+    last key written there expires.
+
+    Pool exhaustion is load, not an outage: it raises StoreUnavailable for that
+    call and neither counts towards the threshold nor falls back.
+    """
+
+    _READS = ('get', 'exists')
+
+    def __init__(self, primary, fallback, threshold: int = 3, interval: float = 2.0):
+        self.primary = primary
+        self.fallback = fallback
+        self.threshold = threshold
+        self.interval = interval
+        self._lock = threading.RLock()
+        self._open_since = None
+        self._failures = 0
+        self._fallback_dirty = False   # written since the last settle
+        self._fallback_until = 0.0     # read misses consult the fallback until then (epoch s)
+        self._recovering = False
+        self._pid = os.getpid()
+        self.counters = {'calls': 0, 'errors': 0, 'fallback_calls': 0, 'opened': 0, 'recovered': 0,
+                         'pool_exhausted': 0, 'fallback_seconds': 0.0, 'latency_ms_sum': 0.0,
+                         'latency_ms_max': 0.0}
+        self.latency_hist = [0] * len(_LATENCY_BUCKETS_MS)
+        try:
+            primary.ping()
+        except _TRIP:
+            self._trip()
+
+    @property
+    def is_open(self) -> bool:
+        return self._open_since is not None
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            return self._call(name, args, kwargs)
+        return call
+
+    def _call(self, name, args, kwargs):
+        if self._open_since is not None:
+            self._ensure_recovery()
+            return self._on_fallback(name, args, kwargs)
+        if self._fallback_dirty:
+            self._settle_fallback()
+        t0 = time.perf_counter()
+        try:
+            out = getattr(self.primary, name)(*args, **kwargs)
+        except _TRIP as e:
+            if pool_exhausted(e):
+                self.counters['pool_exhausted'] += 1
+                raise StoreUnavailable('redis connection pool exhausted') from e
+            self.counters['errors'] += 1
+            with self._lock:
+                self._failures += 1
+                if self._failures >= self.threshold:
+                    self._trip()
+            return self._on_fallback(name, args, kwargs)
+        self._observe(name, (time.perf_counter() - t0) * 1000)
+        self._failures = 0
+        if name in self._READS and not out and self._fallback_until > time.time():
+            return getattr(self.fallback, name)(*args, **kwargs)
+        return out
+
+    def _settle_fallback(self):
+        # Back on the primary: outage writes only matter until their TTLs run out
+        with self._lock:
+            if self._fallback_dirty:
+                self._fallback_dirty = False
+                self._fallback_until = max(self._fallback_until, self.fallback.last_expiry())
+
+    def _on_fallback(self, name, args, kwargs):
+        self.counters['fallback_calls'] += 1
+        if name not in self._READS:
+            self._fallback_dirty = True
+        return getattr(self.fallback, name)(*args, **kwargs)
+
+    def _observe(self, name: str, ms: float):
+        observe(f"redis.{name}", ms / 1000)
+        c = self.counters
+        c['calls'] += 1
+        c['latency_ms_sum'] += ms
+        if ms > c['latency_ms_max']:
+            c['latency_ms_max'] = ms
+        for i, edge in enumerate(_LATENCY_BUCKETS_MS):
+            if ms <= edge:
+                self.latency_hist[i] += 1
+                break
+
+    def _trip(self):
+        if self._open_since is None:
+            self._open_since = time.monotonic()
+            self.counters['opened'] += 1
+        self._ensure_recovery()
+
+    def _ensure_recovery(self):
+        # The recovery thread does not survive a fork (gunicorn preload_app)
+        if self._recovering and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._recovering and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._recovering = True
+        threading.Thread(target=self._recover, name='redis-breaker', daemon=True).start()
+
+    def _recover(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.primary.ping()
+            except Exception:
+                continue
+            with self._lock:
+                if self._open_since is not None:
+                    self.counters['fallback_seconds'] += time.monotonic() - self._open_since
+                    self.counters['recovered'] += 1
+                self._open_since = None
+                self._failures = 0
+                self._recovering = False
+            return
+
+    def stats(self) -> dict:
+        c = dict(self.counters)
+        if self._open_since is not None:
+            c['fallback_seconds'] += time.monotonic() - self._open_since
+        c['latency_ms_avg'] = c['latency_ms_sum'] / c['calls'] if c['calls'] else 0.0
+        c['latency_ms_hist'] = {str(edge): n for edge, n in zip(_LATENCY_BUCKETS_MS, self.latency_hist)}
+        return {'backend': 'redis', 'state': 'open' if self.is_open else 'closed', **c,
+                'fallback': self.fallback.stats()}
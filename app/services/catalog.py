@@ -0,0 +1,112 @@
+import time, threading
+from flask import current_app
+from sqlalchemy import event
+from ..models import db, Product, Content
+from .metrics import span
+
+# Process-local read-through cache of product -> (content_id, default_duration_min),
+# product -> merchant_id and content -> (url_or_blob_ref, mime_type). Products and contents almost never
+# change; writes through the ORM invalidate locally and CATALOG_TTL_S bounds
+# staleness across workers.
+_terms = {}
+_owners = {}
+_blobs = {}
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+MISS = object()
+
+def lookup(product_id: int):
+    """Cached (content_id, default_duration_min) for a product, or MISS."""
+    hit = _terms.get(product_id)
+    if hit is not None and hit[0] > time.monotonic():
+        _stats['hits'] += 1
+        return hit[1]
+    _stats['misses'] += 1
+    return MISS
+
+def remember(product_id: int, val):
+    if val is not None:
+        ttl = current_app.config.get('CATALOG_TTL_S', 300)
+        with _lock:
+            _terms[product_id] = (time.monotonic() + ttl, val)
+
+def product_terms(product_id: int):
+    """Return (content_id, default_duration_min) for a product, or None if it does not exist."""
+    val = lookup(product_id)
+    if val is MISS:
+        with span('db.product_terms'):
+            row = (db.session.query(Product.content_id, Product.default_duration_min)
+                   .filter(Product.id == product_id).first())
+        val = (row[0], row[1]) if row else None
+        remember(product_id, val)
+    return val
+
+def product_merchant(product_id: int):
+    """Return the merchant_id owning a product, or None if it does not exist."""
+    hit = _owners.get(product_id)
+    if hit is not None and hit[0] > time.monotonic():
+        _stats['hits'] += 1
+        return hit[1]
+    _stats['misses'] += 1
+    with span('db.product_terms'):
+        val = db.session.query(Product.merchant_id).filter(Product.id == product_id).scalar()
+    if val is not None:
+        with _lock:
+            _owners[product_id] = (time.monotonic() + current_app.config.get('CATALOG_TTL_S', 300), val)
+    return val
+
+def lookup_blob(content_id: int):
+    """Cached (url_or_blob_ref, mime_type) for a content, or MISS."""
+    hit = _blobs.get(content_id)
+    if hit is not None and hit[0] > time.monotonic():
+        _stats['hits'] += 1
+        return hit[1]
+    _stats['misses'] += 1
+    return MISS
+
+def remember_blob(content_id: int, val):
+    if val is not None:
+        ttl = current_app.config.get('CATALOG_TTL_S', 300)
+        with _lock:
+            _blobs[content_id] = (time.monotonic() + ttl, val)
+
+def content_blob(content_id: int):
+    """Return (url_or_blob_ref, mime_type) for a content, or None if it does not exist."""
+    val = lookup_blob(content_id)
+    if val is MISS:
+        row = (db.session.query(Content.url_or_blob_ref, Content.mime_type)
+               .filter(Content.id == content_id).first())
+        val = (row[0], row[1]) if row else None
+        remember_blob(content_id, val)
+    return val
+
+def invalidate(product_id: int|None = None):
+    """Drop one product (or everything when product_id is None) from the cache."""
+    with _lock:
+        if product_id is None:
+            _terms.clear()
+            _owners.clear()
+            _blobs.clear()
+        else:
+            _terms.pop(product_id, None)
+            _owners.pop(product_id, None)
+        _stats['invalidations'] += 1
+
+def stats() -> dict:
+    return {**_stats, 'size': len(_terms), 'blobs': len(_blobs)}
+
+@event.listens_for(Product, 'after_update')
+@event.listens_for(Product, 'after_delete')
+def _product_changed(mapper, connection, target):
+    invalidate(target.id)
+
+@event.listens_for(Content, 'after_update')
+def _content_updated(mapper, connection, target):
+    with _lock:
+        _blobs.pop(target.id, None)
+        _stats['invalidations'] += 1
+
+@event.listens_for(Content, 'after_delete')
+def _content_deleted(mapper, connection, target):
+    invalidate()
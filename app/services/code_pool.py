@@ -0,0 +1,241 @@
+import os, time, atexit, threading
+from collections import deque
+from datetime import timedelta
+from flask import current_app
+from sqlalchemy import insert, update
+from ..models import db, Code
+from .ids import code_ids
+from .issuance import new_code_hash, redeem_url_for, code_expiry
+from .qr import qr_matrix, matrix_to_png, DEFAULT_MASK
+from . import metrics
+
+# Per-worker pool of ready codes for issue_qr, keyed by (merchant, product,
+# duration): each entry is a committed Code row with its redeem URL and default
+# PNG (EC 'M', box 10) already rendered, so an issue is a deque pop. A background
+# thread tops a key up to CODE_POOL_TARGET whenever it falls below
+# CODE_POOL_LOW_WATER. The pool is started when the worker starts (gunicorn
+# post_fork, ASGI lifespan) and fills the keys listed in CODE_POOL_KEYS; any
+# other key joins on its first miss, up to CODE_POOL_MAX_KEYS. A key nobody has
+# popped for CODE_POOL_MAX_AGE_S is left to drain: its stale codes are voided and
+# nothing is minted for it until its next miss.
+#
+# Pooled codes are real 'issued' rows (batch_id 'pool') whose tokens never left
+# the server. Both clocks start at mint time, so waiting in the pool must not
+# cost the buyer validity:
+#   - expires_at is stamped CODE_TTL_S + CODE_POOL_MAX_AGE_S ahead, so a code is
+#     valid for at least CODE_TTL_S once handed out;
+#   - the token's timestamp ages from mint, so entries older than
+#     CODE_POOL_MAX_AGE_S are never handed out, and that age is capped at 1% of
+#     OPAQUE_MAX_AGE_S.
+#
+# Pools are per worker, not shared: every worker mints its own and sets what is
+# left to 'void' at shutdown, so each restart voids (and skips the ids of) up to
+# workers x keys x CODE_POOL_TARGET codes. A crashed worker leaves its pool rows
+# unreachable until they expire.
+
+POOL_BATCH_ID = 'pool'
+
+def parse_keys(spec: str) -> list:
+    """'1:2:15,1:3:60' -> [(1, 2, 15), (1, 3, 60)] as (merchant_id, product_id, duration_min)."""
+    keys = []
+    for part in (spec or '').split(','):
+        if part.strip():
+            m, p, d = (int(x) for x in part.strip().split(':'))
+            keys.append((m, p, d))
+    return keys
+
+class CodePool:
+    def __init__(self, app, keys: list, low_water: int = 20, target: int = 100, max_age: float = 3600,
+                 max_keys: int = 64, idle_s: float = 5.0):
+        self.app = app
+        self.low_water = low_water
+        self.target = max(target, low_water + 1)
+        self.max_age = max_age
+        self.max_keys = max_keys
+        self.idle_s = idle_s
+        self._pools = {key: deque() for key in keys}
+        self._last_pop = {}     # key -> monotonic time of its last pop
+        self._started = time.monotonic()
+        self._void = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'minted': 0, 'refills': 0, 'errors': 0}
+        self._thread = threading.Thread(target=self._run, name='code-pool', daemon=True)
+        self._thread.start()
+        self._wake.set()
+
+    def pop(self, key: tuple):
+        """(code_id, redeem_url, png) or None on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            q = self._pools.get(key)
+            if q is None and len(self._pools) < self.max_keys:
+                q = self._pools[key] = deque()
+            if q is not None:
+                self._last_pop[key] = now
+            item = None
+            while q:
+                minted_at, code_id, url, png = q.popleft()
+                if now - minted_at <= self.max_age:
+                    item = (code_id, url, png)
+                    break
+                self._void.append(code_id)
+                self.stats['expired'] += 1
+                metrics.pool_pop('expired')
+            depth = len(q) if q is not None else 0
+            self.stats['hits' if item else 'misses'] += 1
+        metrics.pool_pop('hit' if item else 'miss')
+        metrics.pool_depth(key, depth)
+        if q is not None and depth < self.low_water:
+            self._wake.set()
+        return item
+
+    def _due(self) -> list:
+        now = time.monotonic()
+        due, drained = [], []
+        with self._lock:
+            for key, q in self._pools.items():
+                if now - self._last_pop.get(key, self._started) > self.max_age:
+                    # Idle key: void what went stale, mint nothing until it is popped again
+                    if q and now - q[0][0] > self.max_age:
+                        while q and now - q[0][0] > self.max_age:
+                            self._void.append(q.popleft()[1])
+                            self.stats['expired'] += 1
+                        drained.append((key, len(q)))
+                elif len(q) < self.low_water or (q and now - q[0][0] > self.max_age):
+                    due.append(key)
+        for key, depth in drained:
+            metrics.pool_depth(key, depth)
+        return due
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.idle_s)
+            self._wake.clear()
+            for key in self._due():
+                if self._closed:
+                    break
+                try:
+                    with self.app.app_context():
+                        self._refill(key)
+                except Exception:
+                    self.stats['errors'] += 1
+            if self._void:
+                try:
+                    with self.app.app_context():
+                        self._void_codes()
+                except Exception:
+                    self.stats['errors'] += 1
+
+    def _refill(self, key: tuple):
+        merchant_id, product_id, duration_min = key
+        now = time.monotonic()
+        with self._lock:
+            q = self._pools[key]
+            while q and now - q[0][0] > self.max_age:
+                self._void.append(q.popleft()[1])
+                self.stats['expired'] += 1
+            n = self.target - len(q)
+        if n <= 0:
+            return
+        ids = code_ids().take(n)
+        # Time spent waiting in the pool comes on top of CODE_TTL_S
+        expires_at = code_expiry()
+        if expires_at is not None:
+            expires_at += timedelta(seconds=self.max_age)
+        db.session.execute(insert(Code), [{
+            'id': code_id,
+            'merchant_id': merchant_id,
+            'product_id': product_id,
+            'code_hash': new_code_hash(merchant_id, product_id),
+            'batch_id': POOL_BATCH_ID,
+            'duration_min': duration_min,
+            'expires_at': expires_at,
+            'status': 'issued',
+        } for code_id in ids])
+        db.session.commit()
+        # Rendered after the commit: nothing is handed out before its row exists
+        ts = int(time.time())
+        minted_at = time.monotonic()
+        items = []
+        for code_id in ids:
+            url = redeem_url_for(code_id, merchant_id, ts)
+            items.append((minted_at, code_id, url, matrix_to_png(qr_matrix(url, 'M', 4, DEFAULT_MASK), 10)))
+        with self._lock:
+            q = self._pools[key]
+            q.extend(items)
+            depth = len(q)
+        self.stats['minted'] += n
+        self.stats['refills'] += 1
+        metrics.pool_depth(key, depth)
+
+    def _void_codes(self):
+        with self._lock:
+            ids, self._void = self._void, []
+        for i in range(0, len(ids), 1000):
+            db.session.execute(update(Code).where(Code.id.in_(ids[i:i + 1000]), Code.status == 'issued')
+                               .values(status='void'))
+        db.session.commit()
+
+    def close(self, timeout: float = 5.0):
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout)
+        with self._lock:
+            for key, q in self._pools.items():
+                self._void.extend(item[1] for item in q)
+                q.clear()
+                metrics.pool_depth(key, 0)
+        if self._void:
+            with self.app.app_context():
+                self._void_codes()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            depth = {':'.join(map(str, key)): len(q) for key, q in self._pools.items()}
+        return {**self.stats, 'depth': depth, 'low_water': self.low_water, 'target': self.target,
+                'max_age_s': self.max_age}
+
+_pool = None
+_pid = None
+_lock = threading.Lock()
+
+def pool():
+    """This worker's CodePool, started after fork (gunicorn preload_app); None when disabled."""
+    global _pool, _pid
+    if _pid == os.getpid():
+        return _pool
+    with _lock:
+        if _pid != os.getpid():
+            cfg = current_app.config
+            _pool = None
+            if cfg.get('CODE_POOL_ENABLED', True):
+                # A pooled token must not visibly lose validity to its wait in the pool
+                max_age = min(cfg.get('CODE_POOL_MAX_AGE_S', 600), cfg.get('OPAQUE_MAX_AGE_S', 86400) / 100)
+                _pool = CodePool(current_app._get_current_object(), parse_keys(cfg.get('CODE_POOL_KEYS', '')),
+                                 cfg.get('CODE_POOL_LOW_WATER', 20), cfg.get('CODE_POOL_TARGET', 100),
+                                 max_age, cfg.get('CODE_POOL_MAX_KEYS', 64), cfg.get('CODE_POOL_IDLE_S', 5.0))
+            _pid = os.getpid()
+    return _pool
+
+def warm(app):
+    """Start this worker's pool now (post_fork / lifespan startup) rather than on the first issue."""
+    with app.app_context():
+        pool()
+
+def take(merchant_id: int, product_id: int, duration_min: int):
+    """A ready (code_id, redeem_url, png), or None when the pool has none for this key."""
+    p = pool()
+    return p.pop((merchant_id, product_id, duration_min)) if p is not None else None
+
+def shutdown(timeout: float = 5.0):
+    if _pool is not None and _pid == os.getpid():
+        _pool.close(timeout)
+
+def stats() -> dict:
+    if _pool is None or _pid != os.getpid():
+        return {'enabled': False}
+    return {'enabled': True, **_pool.snapshot()}
+
+atexit.register(shutdown)
@@ -0,0 +1,144 @@
+import os, threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# QR decoding off the request thread: a per-worker process pool whose processes
+# each keep one warm cv2.QRCodeDetector. Admission is bounded (processes + queue
+# depth), so a burst of large uploads is refused instead of piling up. A child
+# that dies (OOM kill, cv2 segfault) breaks the executor: the batches it held
+# fail and the executor is replaced, so later requests get a fresh pool.
+#
+# Executors start their children lazily, on the first submit. Every new executor
+# (at pool creation and after each rebuild) is sent one no-op per process, so all
+# children fork and build their detector before a request needs them; warm()
+# creates the pool at worker start (gunicorn post_fork / ASGI lifespan).
+
+class DecoderBusy(Exception):
+    pass
+
+_detector = None
+
+def _init_process():
+    global _detector
+    import cv2
+    cv2.setNumThreads(1)
+    _detector = cv2.QRCodeDetector()
+
+def _ready() -> bool:
+    return _detector is not None
+
+# JPEG/PNG decoded at 1/4, then 1/2, then full resolution: most phone photos
+# resolve at a reduced level, which libjpeg decodes far faster than 12 MP.
+_PYRAMID = ('IMREAD_REDUCED_GRAYSCALE_4', 'IMREAD_REDUCED_GRAYSCALE_2', 'IMREAD_GRAYSCALE')
+_MIN_SIDE = 240
+
+def _decode(data: bytes) -> dict:
+    import numpy as np
+    import cv2
+    arr = np.frombuffer(data, dtype=np.uint8)
+    for level, flag in enumerate(_PYRAMID):
+        img = cv2.imdecode(arr, getattr(cv2, flag))
+        if img is None:
+            return {'error': 'bad_image'}
+        last = level == len(_PYRAMID) - 1
+        if not last and max(img.shape[:2]) < _MIN_SIDE:
+            continue
+        val, points, _ = _detector.detectAndDecode(img)
+        if val:
+            return {'ok': True, 'raw': val}
+    return {'ok': False}
+
+class DecodePool:
+    def __init__(self, processes: int, queue_depth: int, timeout: float):
+        self.processes = processes
+        self.timeout = timeout
+        self.capacity = processes + queue_depth
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._pool = self._new_pool()
+        self.rejected = 0
+        self.rebuilds = 0
+
+    def _new_pool(self):
+        executor = ProcessPoolExecutor(max_workers=self.processes, initializer=_init_process)
+        # Submitted back to back, before any child is idle: each one starts a process
+        for _ in range(self.processes):
+            executor.submit(_ready)
+        return executor
+
+    def _release(self, n: int = 1):
+        with self._lock:
+            self._in_flight -= n
+
+    def _replace(self, broken):
+        # Only the first batch to notice swaps the executor; the others see the new one
+        with self._lock:
+            if self._pool is not broken:
+                return
+            self._pool = self._new_pool()
+            self.rebuilds += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def decode_many(self, images: list) -> list:
+        """Decode a batch; raises DecoderBusy when the pool cannot admit every image."""
+        with self._lock:
+            if self._in_flight + len(images) > self.capacity:
+                self.rejected += 1
+                raise DecoderBusy()
+            self._in_flight += len(images)
+            pool = self._pool
+        futures = []
+        try:
+            for data in images:
+                fut = pool.submit(_decode, data)
+                futures.append(fut)
+                fut.add_done_callback(lambda _: self._release())
+        except BaseException as e:
+            self._release(len(images) - len(futures))
+            if isinstance(e, BrokenProcessPool):
+                self._replace(pool)
+            raise
+        done, pending = wait(futures, timeout=self.timeout)
+        for fut in pending:
+            fut.cancel()
+        if pending:
+            raise DecoderBusy()
+        try:
+            return [fut.result() for fut in futures]
+        except BrokenProcessPool:
+            self._replace(pool)
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = self._in_flight
+        return {'processes': self.processes, 'in_flight': in_flight, 'free_slots': self.capacity - in_flight,
+                'rejected': self.rejected, 'rebuilds': self.rebuilds}
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+
+def pool(cfg) -> DecodePool:
+    """The worker's decode pool, created after fork (gunicorn preload_app)."""
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = DecodePool(cfg.get('DECODE_PROCESSES', 2), cfg.get('DECODE_QUEUE', 8),
+                               cfg.get('DECODE_TIMEOUT_S', 10.0))
+            _pool_pid = os.getpid()
+    return _pool
+
+def warm(app):
+    """Start this worker's decode processes now rather than on the first upload."""
+    pool(app.config)
+
+def stats() -> dict:
+    if _pool is None or _pool_pid != os.getpid():
+        return {'processes': 0}
+    return _pool.stats()
@@ -0,0 +1,120 @@
+import time, heapq, math
+from datetime import datetime, timezone
+from sqlalchemy import select, update
+from ..models import db, Code
+from .metrics import observe
+
+# Expiry sweeper: codes still 'issued' past Code.expires_at become 'expired'.
+# Redeem already refuses them from expires_at alone; the sweep keeps status
+# (and the status index) truthful for admin queries and archival.
+#
+# Rather than polling the table, the sweeper keeps a min-heap of the distinct
+# upcoming expiry instants (whole seconds), read from the expires_at index up to
+# EXPIRY_LOOKAHEAD_S ahead, and sleeps until the earliest is due. Each wake runs
+# batched UPDATEs for everything due, so an expiry the heap missed (the heap is
+# bounded, and codes issued since the last read are only seen at the next one)
+# is still caught by the following sweep, at most EXPIRY_MAX_SLEEP_S later.
+
+def utc_ts(dt: datetime) -> float:
+    # SQLite hands back naive datetimes; they are stored as UTC
+    return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+
+class ExpiryHeap:
+    """Bounded min-heap of distinct expiry seconds, covering everything up to `horizon`."""
+
+    def __init__(self, max_items: int = 100_000):
+        self.max_items = max_items
+        self._heap = []
+        self._set = set()
+        self.horizon = 0.0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, ts: float) -> bool:
+        sec = math.ceil(ts)
+        if sec in self._set:
+            return True
+        if len(self._heap) >= self.max_items:
+            return False
+        heapq.heappush(self._heap, sec)
+        self._set.add(sec)
+        return True
+
+    def next_due(self):
+        return self._heap[0] if self._heap else None
+
+    def pop_due(self, now: float) -> int:
+        n = 0
+        while self._heap and self._heap[0] <= now:
+            self._set.discard(heapq.heappop(self._heap))
+            n += 1
+        return n
+
+def load_upcoming(heap: ExpiryHeap, now: float, lookahead: float) -> int:
+    """Read expiries in (heap.horizon, now + lookahead] from the index; returns how many were added."""
+    start = max(heap.horizon, now)
+    end = now + lookahead
+    if start >= end:
+        return 0
+    room = heap.max_items - len(heap)
+    if room <= 0:
+        return 0
+    rows = db.session.scalars(
+        select(Code.expires_at).distinct()
+        .where(Code.status == 'issued',
+               Code.expires_at > datetime.fromtimestamp(start, timezone.utc),
+               Code.expires_at <= datetime.fromtimestamp(end, timezone.utc))
+        .order_by(Code.expires_at).limit(room + 1)).all()
+    db.session.rollback()
+    added = sum(heap.push(utc_ts(dt)) for dt in rows[:room])
+    # A full heap only covers what it read; the next load continues from there
+    heap.horizon = utc_ts(rows[room - 1]) if len(rows) > room else end
+    return added
+
+def sweep(now: float|None = None, batch: int = 1000) -> int:
+    """Flip issued codes with expires_at <= now to 'expired', batch rows per UPDATE and commit."""
+    cutoff = datetime.fromtimestamp(now if now is not None else time.time(), timezone.utc)
+    total = 0
+    while True:
+        t0 = time.perf_counter()
+        due = select(Code.id).where(Code.status == 'issued', Code.expires_at <= cutoff).limit(batch)
+        n = db.session.execute(update(Code).where(Code.id.in_(due)).values(status='expired')
+                               .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        observe('expiry.sweep_batch', time.perf_counter() - t0)
+        total += n
+        if n < batch:
+            return total
+
+class Sweeper:
+    """Sleeps until the earliest known expiry (or max_sleep), sweeps, and re-reads the lookahead window."""
+
+    def __init__(self, batch: int = 1000, lookahead: float = 3600, heap_max: int = 100_000,
+                 max_sleep: float = 300):
+        self.batch = batch
+        self.lookahead = lookahead
+        self.max_sleep = max_sleep
+        self.heap = ExpiryHeap(heap_max)
+        self._next_load = 0.0
+        self.stats = {'wakes': 0, 'sweeps': 0, 'expired': 0, 'loads': 0}
+
+    def step(self, now: float|None = None) -> float:
+        """One wake; returns the seconds to sleep before the next."""
+        now = now if now is not None else time.time()
+        self.stats['wakes'] += 1
+        reload = now >= self._next_load
+        if self.heap.pop_due(now) or reload:
+            self.stats['expired'] += sweep(now, self.batch)
+            self.stats['sweeps'] += 1
+        if reload:
+            load_upcoming(self.heap, now, self.lookahead)
+            self.stats['loads'] += 1
+            self._next_load = now + self.max_sleep
+        nxt = self.heap.next_due()
+        wake = self._next_load if nxt is None else min(nxt, self._next_load)
+        return max(0.0, wake - time.time())
+
+    def snapshot(self) -> dict:
+        return {**self.stats, 'heap': len(self.heap), 'next_due': self.heap.next_due(),
+                'horizon': self.heap.horizon}
@@ -0,0 +1,384 @@
+import os, re, math, time, shutil, subprocess
+from datetime import datetime, timezone, timedelta
+from flask import current_app
+from sqlalchemy import select, update, or_, and_
+from ..models import db, Content, HlsJob
+from . import storage
+
+# HLS packaging for Content(type='media'). Jobs live in the hls_job table and are
+# leased by workers/hls_packager.py (heartbeat + stale takeover); each rendition is
+# one ffmpeg child of the worker, HLS_PROCESSES at a time. Segments are cut on
+# forced keyframes every HLS_SEGMENT_DURATION seconds, so an interrupted rendition
+# restarts from its last complete segment instead of from zero. Progress lands in
+# Content.meta['hls'].
+#
+# A lease is (job id, worker, attempt). Each attempt packages into its own
+# directory, HLS_OUTPUT_DIR/.jobs/<content_id>/<job_id>.<attempt>/; a takeover
+# renames the previous attempt's directory to its own, keeping the finished
+# segments while the old owner can no longer create files there. The holder kills
+# its ffmpeg children as soon as the lease is lost, and Content.meta is only
+# written while the lease is held. A finished attempt is published by swapping the
+# HLS_OUTPUT_DIR/<content_id> symlink to its directory.
+
+class PackagingError(RuntimeError):
+    pass
+
+class LeaseLost(PackagingError):
+    def __init__(self):
+        super().__init__('lease_lost')
+
+_DURATION = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+_VIDEO_SIZE = re.compile(r'Video: .*?, (\d{2,5})x(\d{2,5})')
+
+def parse_renditions(spec: str) -> list:
+    """'1080:5000,720:2800' -> [(height, video_kbps), ...], tallest first."""
+    out = []
+    for part in (spec or '').split(','):
+        if part.strip():
+            h, kbps = part.split(':')
+            out.append((int(h), int(kbps)))
+    return sorted(out, reverse=True)
+
+def _now():
+    return datetime.now(timezone.utc)
+
+# --- Queue ---
+
+def enqueue(content_id: int):
+    """(job, created) -- reuses a queued or running job for the same content."""
+    content = db.session.get(Content, content_id)
+    if content is None:
+        raise PackagingError('not_found')
+    if content.type != 'media':
+        raise PackagingError('not_media')
+    job = db.session.execute(select(HlsJob).where(HlsJob.content_id == content_id,
+                                                  HlsJob.status.in_(('queued', 'running')))
+                             .limit(1)).scalar()
+    if job is not None:
+        return job, False
+    job = HlsJob(content_id=content_id, status='queued', attempts=0)
+    db.session.add(job)
+    _set_meta(content, {'status': 'queued', 'progress': 0.0})
+    db.session.commit()
+    return job, True
+
+def claim(worker: str, stale_s: int, max_attempts: int):
+    """Lease the oldest runnable job (queued, or running with a stale heartbeat)."""
+    cutoff = _now() - timedelta(seconds=stale_s)
+    stale = and_(HlsJob.status == 'running', HlsJob.heartbeat_at < cutoff)
+    # No in-session evaluation: SQLite hands back naive heartbeat_at values
+    db.session.execute(update(HlsJob).where(stale, HlsJob.attempts >= max_attempts)
+                       .values(status='failed', error='abandoned').execution_options(synchronize_session=False))
+    runnable = and_(or_(HlsJob.status == 'queued', stale), HlsJob.attempts < max_attempts)
+    ids = db.session.execute(select(HlsJob.id).where(runnable).order_by(HlsJob.id).limit(8)).scalars().all()
+    for job_id in ids:
+        res = db.session.execute(update(HlsJob).where(HlsJob.id == job_id, runnable)
+                                 .values(status='running', worker=worker, heartbeat_at=_now(),
+                                         attempts=HlsJob.attempts + 1)
+                                 .execution_options(synchronize_session=False))
+        db.session.commit()
+        if res.rowcount == 1:
+            return db.session.get(HlsJob, job_id)
+    db.session.commit()
+    return None
+
+def _held(job_id: int, worker: str, attempt: int|None = None):
+    cond = and_(HlsJob.id == job_id, HlsJob.worker == worker, HlsJob.status == 'running')
+    return cond if attempt is None else and_(cond, HlsJob.attempts == attempt)
+
+def heartbeat(job_id: int, worker: str, attempt: int|None = None) -> bool:
+    """Renew the lease; False when another worker has taken the job over."""
+    res = db.session.execute(update(HlsJob).where(_held(job_id, worker, attempt)).values(heartbeat_at=_now()))
+    db.session.commit()
+    return res.rowcount == 1
+
+def _set_meta(content, hls: dict):
+    # JSON columns are not mutation-tracked: assign a fresh dict
+    meta = dict(content.meta or {})
+    meta['hls'] = {**(meta.get('hls') or {}), **hls}
+    content.meta = meta
+
+def set_progress(content_id: int, hls: dict, lease: tuple|None = None) -> bool:
+    """Merge hls into Content.meta['hls']; with a (job_id, worker, attempt) lease, only while it is held."""
+    if lease is not None:
+        # The job row stays locked until the commit (PostgreSQL), so a takeover cannot slip in between
+        held = db.session.execute(select(HlsJob.id).where(_held(*lease)).with_for_update()).first()
+        if held is None:
+            db.session.rollback()
+            return False
+    content = db.session.get(Content, content_id)
+    _set_meta(content, hls)
+    db.session.commit()
+    return True
+
+# --- ffmpeg: probing, playlists and rendition commands; each rendition runs as a
+# Popen child of the worker process (see _package) ---
+
+def probe(ffmpeg: str, src: str):
+    """(duration_s, width, height) parsed from ffmpeg's input banner."""
+    proc = subprocess.run([ffmpeg, '-hide_banner', '-nostdin', '-i', src], capture_output=True, text=True)
+    d, s = _DURATION.search(proc.stderr), _VIDEO_SIZE.search(proc.stderr)
+    if not d or not s:
+        raise PackagingError(f"unreadable media: {src}")
+    duration = int(d.group(1)) * 3600 + int(d.group(2)) * 60 + float(d.group(3))
+    return duration, int(s.group(1)), int(s.group(2))
+
+def _entries(path: str):
+    """([(duration, uri, discontinuity_before), ...], ended) of a media playlist."""
+    out, disc, ended, dur = [], False, False, 0.0
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line == '#EXT-X-DISCONTINUITY':
+                    disc = True
+                elif line.startswith('#EXTINF:'):
+                    dur = float(line[8:].split(',')[0])
+                elif line == '#EXT-X-ENDLIST':
+                    ended = True
+                elif line and not line.startswith('#'):
+                    out.append((dur, line, disc))
+                    disc = False
+    except FileNotFoundError:
+        pass
+    return out, ended
+
+def _write_playlist(path: str, entries: list, seg_s: int, ended: bool):
+    target = max([seg_s] + [math.ceil(d) for d, _, _ in entries])
+    lines = ['#EXTM3U', '#EXT-X-VERSION:6', f"#EXT-X-TARGETDURATION:{target}", '#EXT-X-MEDIA-SEQUENCE:0',
+             f"#EXT-X-PLAYLIST-TYPE:{'VOD' if ended else 'EVENT'}", '#EXT-X-INDEPENDENT-SEGMENTS']
+    for d, uri, disc in entries:
+        if disc:
+            lines.append('#EXT-X-DISCONTINUITY')
+        lines += [f"#EXTINF:{d:.6f},", uri]
+    if ended:
+        lines.append('#EXT-X-ENDLIST')
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp, path)
+
+def _fold(out_dir: str, entries: list) -> bool:
+    # Move the segments of the last ffmpeg run (run.m3u8) into index.m3u8's list
+    run = os.path.join(out_dir, 'run.m3u8')
+    new, ended = _entries(run)
+    if new and entries:
+        new[0] = (new[0][0], new[0][1], True)
+    entries += new
+    return ended
+
+def playlist_state(out_dir: str):
+    """(segment durations, ended) of a rendition so far, including the running ffmpeg pass."""
+    entries, ended = _entries(os.path.join(out_dir, 'index.m3u8'))
+    if not ended:
+        entries += _entries(os.path.join(out_dir, 'run.m3u8'))[0]
+    return [d for d, _, _ in entries], ended
+
+def start_rendition(ffmpeg: str, src: str, out_dir: str, height: int, kbps: int, seg_s: int):
+    """ffmpeg command encoding one rendition into out_dir after its last complete segment.
+
+    ffmpeg writes each pass to run.m3u8; completed passes are folded into
+    index.m3u8, which only ever lists whole segments. None when the rendition
+    is already complete.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    playlist, run = os.path.join(out_dir, 'index.m3u8'), os.path.join(out_dir, 'run.m3u8')
+    entries, ended = _entries(playlist)
+    if ended:
+        return None
+    ended = _fold(out_dir, entries)
+    _write_playlist(playlist, entries, seg_s, ended)
+    if os.path.exists(run):
+        os.remove(run)
+    if ended:
+        return None
+    done = len(entries)
+    for name in os.listdir(out_dir):
+        # Drop the segment that was being written when the job died
+        m = re.fullmatch(r'seg_(\d+)\.ts', name)
+        if m and int(m.group(1)) >= done:
+            os.remove(os.path.join(out_dir, name))
+    offset = sum(d for d, _, _ in entries)
+    cmd = [ffmpeg, '-hide_banner', '-nostdin', '-loglevel', 'error', '-y']
+    if offset:
+        cmd += ['-ss', f"{offset:.3f}"]
+    cmd += ['-i', src, '-map', '0:v:0', '-map', '0:a:0?',
+            '-vf', f"scale=-2:{height}", '-c:v', 'libx264', '-preset', 'veryfast',
+            '-b:v', f"{kbps}k", '-maxrate', f"{int(kbps * 1.07)}k", '-bufsize', f"{int(kbps * 1.5)}k",
+            '-force_key_frames', f"expr:gte(t,n_forced*{seg_s})", '-sc_threshold', '0',
+            '-c:a', 'aac', '-b:a', '128k', '-ac', '2',
+            '-f', 'hls', '-hls_time', str(seg_s), '-hls_playlist_type', 'event',
+            '-hls_flags', 'independent_segments', '-start_number', str(done),
+            '-hls_segment_filename', os.path.join(out_dir, 'seg_%05d.ts')]
+    if offset:
+        cmd += ['-output_ts_offset', f"{offset:.3f}"]
+    cmd.append(run)
+    return cmd
+
+def finish_rendition(out_dir: str, seg_s: int) -> str:
+    """Fold a successful ffmpeg pass into index.m3u8 and close the playlist."""
+    playlist = os.path.join(out_dir, 'index.m3u8')
+    entries, _ = _entries(playlist)
+    _fold(out_dir, entries)
+    _write_playlist(playlist, entries, seg_s, True)
+    os.remove(os.path.join(out_dir, 'run.m3u8'))
+    return playlist
+
+# --- Output directories ---
+
+def attempt_dir(root: str, content_id: int, job_id: int, attempt: int) -> str:
+    """This attempt's directory, taking over the latest earlier attempt's segments when there is one."""
+    base = os.path.join(root, '.jobs', str(content_id))
+    mine = os.path.join(base, f"{job_id}.{attempt}")
+    if os.path.isdir(mine):
+        return mine
+    os.makedirs(base, exist_ok=True)
+    earlier = sorted((int(m.group(1)), name) for name in os.listdir(base)
+                     if (m := re.fullmatch(rf"{job_id}\.(\d+)", name)) and int(m.group(1)) < attempt)
+    if earlier:
+        # A rename, so a previous owner still running can no longer create files in it
+        os.rename(os.path.join(base, earlier[-1][1]), mine)
+        for _, name in earlier[:-1]:
+            shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+    else:
+        os.makedirs(mine)
+    return mine
+
+def publish(root: str, content_id: int, out_dir: str):
+    """Point HLS_OUTPUT_DIR/<content_id> at out_dir with one rename, then drop the previous output."""
+    link = os.path.join(root, str(content_id))
+    previous = os.path.realpath(link) if os.path.islink(link) else None
+    if previous is None and os.path.isdir(link):
+        # Packaged in place before per-attempt directories: retire it first
+        shutil.rmtree(link)
+    tmp = f"{link}.{os.getpid()}.swap"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(os.path.relpath(out_dir, root), tmp)
+    os.replace(tmp, link)
+    if previous and previous != os.path.realpath(out_dir):
+        shutil.rmtree(previous, ignore_errors=True)
+
+# --- Orchestration (worker process, app context) ---
+
+def _source_path(ref: str, workdir: str) -> str:
+    """Local path for ffmpeg; remote blobs are downloaded once, resuming a partial download."""
+    backend, key = storage.resolve(ref)
+    local_path = getattr(backend, 'local_path', None)
+    if local_path is not None:
+        return local_path(key)
+    dest = os.path.join(workdir, 'source')
+    size, _, _ = backend.stat(key)
+    if os.path.exists(dest) and os.path.getsize(dest) == size:
+        return dest
+    part = dest + '.part'
+    have = os.path.getsize(part) if os.path.exists(part) else 0
+    with open(part, 'ab') as f:
+        for chunk in backend.read_chunks(key, have, size - have):
+            f.write(chunk)
+    os.replace(part, dest)
+    return dest
+
+def _master(renditions: list, src_w: int, src_h: int) -> str:
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-INDEPENDENT-SEGMENTS']
+    for height, kbps in renditions:
+        width = round(src_w * height / src_h / 2) * 2
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={(kbps + 128) * 1000},RESOLUTION={width}x{height}")
+        lines.append(f"{height}p/index.m3u8")
+    return '\n'.join(lines) + '\n'
+
+def _log_tail(path: str) -> str:
+    try:
+        with open(path, errors='replace') as f:
+            return f.read()[-500:].strip()
+    except FileNotFoundError:
+        return ''
+
+def run_job(job, worker: str):
+    """Package one leased job; failures requeue it until HLS_MAX_ATTEMPTS."""
+    cfg = current_app.config
+    lease = (job.id, worker, job.attempts)
+    try:
+        _package(job, lease, cfg)
+    except LeaseLost:
+        # The new owner carries on from our segments; the job row and meta are its now
+        db.session.rollback()
+        return False
+    except Exception as e:
+        db.session.rollback()
+        final = lease[2] >= cfg['HLS_MAX_ATTEMPTS']
+        res = db.session.execute(update(HlsJob).where(_held(*lease))
+                                 .values(status='failed' if final else 'queued', error=str(e)[:2000]))
+        if res.rowcount == 1:
+            set_progress(job.content_id, {'status': 'failed' if final else 'queued', 'error': str(e)[:500]})
+        else:
+            db.session.commit()
+        return False
+    return True
+
+def _package(job, lease: tuple, cfg):
+    content_id = job.content_id
+    content = db.session.get(Content, content_id)
+    ffmpeg, seg_s, root = cfg['FFMPEG_BIN'], cfg['HLS_SEGMENT_DURATION'], cfg['HLS_OUTPUT_DIR']
+    workdir = attempt_dir(root, content_id, lease[0], lease[2])
+    if not set_progress(content_id, {'status': 'packaging', 'job_id': lease[0], 'error': None}, lease):
+        raise LeaseLost()
+    src = _source_path(content.url_or_blob_ref, workdir)
+    duration, src_w, src_h = probe(ffmpeg, src)
+    wanted = parse_renditions(cfg['HLS_RENDITIONS'])
+    renditions = [r for r in wanted if r[0] <= src_h] or wanted[-1:]
+    todo = [(h, kbps, os.path.join(workdir, f"{h}p")) for h, kbps in renditions]
+    running = {}    # out_dir -> (ffmpeg Popen, its stderr log)
+    next_tick = time.monotonic() + cfg['HLS_PROGRESS_S']
+    try:
+        while todo or running:
+            while todo and len(running) < cfg['HLS_PROCESSES']:
+                h, kbps, out_dir = todo.pop(0)
+                cmd = start_rendition(ffmpeg, src, out_dir, h, kbps, seg_s)
+                if cmd is not None:
+                    log = open(os.path.join(out_dir, 'ffmpeg.log'), 'w')
+                    running[out_dir] = (subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                                         stderr=log), log)
+            for out_dir, (proc, log) in list(running.items()):
+                if proc.poll() is None:
+                    continue
+                del running[out_dir]
+                log.close()
+                if proc.returncode != 0:
+                    raise PackagingError(_log_tail(log.name) or f"ffmpeg exited {proc.returncode}")
+                finish_rendition(out_dir, seg_s)
+            if time.monotonic() >= next_tick or not (todo or running):
+                next_tick = time.monotonic() + cfg['HLS_PROGRESS_S']
+                progress = {}
+                for h, _ in renditions:
+                    durations, ended = playlist_state(os.path.join(workdir, f"{h}p"))
+                    progress[f"{h}p"] = (1.0 if ended else round(min(1.0, sum(durations) / duration), 3)
+                                         if duration else 0.0)
+                if not heartbeat(*lease) or not set_progress(
+                        content_id, {'progress': round(sum(progress.values()) / len(progress), 3),
+                                     'renditions': progress}, lease):
+                    raise LeaseLost()
+            if running:
+                time.sleep(0.2)
+    finally:
+        # Lease lost, failed rendition or worker error: no ffmpeg outlives this attempt
+        for proc, log in running.values():
+            proc.kill()
+            proc.wait()
+            log.close()
+    with open(os.path.join(workdir, 'master.m3u8'), 'w') as f:
+        f.write(_master(renditions, src_w, src_h))
+    if src.startswith(workdir + os.sep):
+        os.remove(src)
+    # Only the lease holder flips the job to done, and only then is its output swapped in
+    res = db.session.execute(update(HlsJob).where(_held(*lease)).values(status='done', error=None))
+    db.session.commit()
+    if res.rowcount != 1:
+        raise LeaseLost()
+    publish(root, content_id, workdir)
+    set_progress(content_id, {
+        'status': 'ready', 'progress': 1.0, 'job_id': lease[0],
+        'master': 'file://' + os.path.abspath(os.path.join(root, str(content_id), 'master.m3u8')),
+        'segment_duration': seg_s, 'duration': round(duration, 3),
+        'renditions': {f"{h}p": 1.0 for h, _ in renditions},
+    })
@@ -0,0 +1,83 @@
+import os, threading
+from flask import current_app
+from sqlalchemy import update, insert, select, func, literal
+from sqlalchemy.exc import IntegrityError
+from ..models import db, Code, IdBlock
+
+# Hi-lo allocation of Code.id. Each worker reserves CODE_ID_BLOCK ids at a time
+# with one UPDATE id_block SET next_id = next_id + n ... RETURNING, committed on
+# its own connection, then hands them out from memory. The id is known before
+# the row exists, so the opaque token and QR can be built first and rows can be
+# written in batches. Blocks are never shared: a forked worker drops the block it
+# inherited, and ids left unused by a restart are skipped, not reused.
+#
+# Every Code insert must take its id from here: on PostgreSQL the serial sequence
+# no longer advances, and on SQLite an autoincrement id could land in a block
+# another worker still holds. The id_block row is created from MAX(code.id) + 1
+# on first use, so existing rows are respected.
+
+class IdAllocator:
+    def __init__(self, name: str, table, block_size: int = 1000):
+        self.name = name
+        self.table = table
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._pid = os.getpid()
+        self.reservations = 0
+
+    def _reserve(self, n: int) -> int:
+        """Reserve n ids; returns the first."""
+        stmt = (update(IdBlock).where(IdBlock.name == self.name)
+                .values(next_id=IdBlock.next_id + n).returning(IdBlock.next_id))
+        for _ in range(2):
+            with db.engine.begin() as conn:
+                end = conn.execute(stmt).scalar()
+            if end is not None:
+                self.reservations += 1
+                return end - n
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(insert(IdBlock).from_select(
+                        ['name', 'next_id'],
+                        select(literal(self.name), func.coalesce(func.max(self.table.c.id), 0) + 1)))
+            except IntegrityError:
+                pass  # another worker created it first
+        raise RuntimeError(f"id_block row {self.name!r} missing")
+
+    def take(self, n: int = 1) -> list:
+        """n ids, from this worker's block (or a dedicated reservation when n is large)."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._next = self._end = 0
+                self._pid = os.getpid()
+            if n > self.block_size:
+                first = self._reserve(n)
+                return list(range(first, first + n))
+            if self._end - self._next < n:
+                self._next = self._reserve(self.block_size)
+                self._end = self._next + self.block_size
+            first = self._next
+            self._next += n
+            return list(range(first, first + n))
+
+    def stats(self) -> dict:
+        return {'block_size': self.block_size, 'remaining': self._end - self._next,
+                'reservations': self.reservations}
+
+_code_ids = None
+_lock = threading.Lock()
+
+def code_ids() -> IdAllocator:
+    global _code_ids
+    if _code_ids is None:
+        with _lock:
+            if _code_ids is None:
+                _code_ids = IdAllocator('code', Code.__table__, current_app.config.get('CODE_ID_BLOCK', 1000))
+    return _code_ids
+
+def next_code_id() -> int:
+    return code_ids().take()[0]
+
+def stats() -> dict:
+    return code_ids().stats() if _code_ids is not None else {}
@@ -0,0 +1,173 @@
+import os, time, hmac, hashlib, secrets, threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import Future
+from flask import current_app
+from sqlalchemy import insert, func, select
+from .tokens import make_opaque
+from .ids import code_ids
+from .metrics import observe
+from ..models import db, Code
+
+
+def code_expiry(now: datetime|None = None) -> datetime|None:
+    """expires_at for a code issued now, from CODE_TTL_S (None: never expires)."""
+    ttl = current_app.config.get('CODE_TTL_S', 86400)
+    return (now or datetime.now(timezone.utc)) + timedelta(seconds=ttl) if ttl else None
+
+def new_code_hash(merchant_id: int, product_id: int) -> str:
+    random_value = secrets.token_hex(16)
+    return hashlib.sha256(f"{merchant_id}.{product_id}.{random_value}".encode()).hexdigest()
+
+def batch_code_hash(batch_id: str, seq: int) -> str:
+    # Deterministic per (batch, seq): the unique code_hash stops a re-run or a
+    # concurrent run from minting the same slot twice.
+    secret = current_app.config['MERCHANT_SALT'].encode()
+    return hmac.new(secret, f"batch:{batch_id}:{seq}".encode(), hashlib.sha256).hexdigest()
+
+def redeem_url_for(code_id: int, merchant_id: int, ts: int|None=None) -> str:
+    opaque = make_opaque(code_id, merchant_id, ts)
+    return f"{current_app.config.get('BASE_URL')}/redeem?c={opaque}"
+
+def batch_progress(batch_id: str):
+    """Return (issued_count, terms) for a batch.
+
+    terms is the set of distinct (merchant_id, product_id, duration_min) among its
+    codes: empty for a new batch, a single tuple for a consistent one.
+    """
+    rows = (db.session.query(Code.merchant_id, Code.product_id, Code.duration_min, func.count(Code.id))
+            .filter(Code.batch_id == batch_id)
+            .group_by(Code.merchant_id, Code.product_id, Code.duration_min).all())
+    return sum(r[3] for r in rows), {tuple(r[:3]) for r in rows}
+
+def missing_slots(batch_id: str, count: int) -> list:
+    """Slots in [0, count) that have no code yet, whatever order earlier runs filled them in."""
+    present = set(db.session.scalars(select(Code.code_hash).where(Code.batch_id == batch_id)))
+    return [seq for seq in range(count) if batch_code_hash(batch_id, seq) not in present]
+
+def iter_batch(batch_id: str, chunk: int = 1000):
+    """Yield (code_id, merchant_id, code_hash) for already minted codes, keyset-paginated by id."""
+    last_id = 0
+    while True:
+        rows = (db.session.query(Code.id, Code.merchant_id, Code.code_hash)
+                .filter(Code.batch_id == batch_id, Code.id > last_id)
+                .order_by(Code.id).limit(chunk).all())
+        if not rows:
+            return
+        for code_id, merchant_id, code_hash in rows:
+            yield code_id, merchant_id, code_hash
+        last_id = rows[-1][0]
+
+def mint_batch(batch_id: str, merchant_id: int, product_id: int, duration_min: int,
+               start: int, stop: int, chunk: int = 1000):
+    """Insert codes for slots [start, stop) in multi-row chunks, one commit per chunk.
+
+    Yields the new code ids as each chunk is committed.
+    """
+    return mint_slots(batch_id, merchant_id, product_id, duration_min, range(start, stop), chunk)
+
+def mint_slots(batch_id: str, merchant_id: int, product_id: int, duration_min: int,
+               slots, chunk: int = 1000):
+    """mint_batch for an arbitrary list of slots."""
+    slots = list(slots)
+    for lo in range(0, len(slots), chunk):
+        part = slots[lo:lo + chunk]
+        ids = code_ids().take(len(part))
+        expires_at = code_expiry()
+        rows = [{
+            'id': code_id,
+            'merchant_id': merchant_id,
+            'product_id': product_id,
+            'code_hash': batch_code_hash(batch_id, seq),
+            'batch_id': batch_id,
+            'duration_min': duration_min,
+            'expires_at': expires_at,
+            'status': 'issued',
+        } for code_id, seq in zip(ids, part)]
+        db.session.execute(insert(Code), rows)
+        db.session.commit()
+        yield from ids
+
+def stream_batch(batch_id: str, merchant_id: int, product_id: int, duration_min: int,
+                 count: int, chunk: int = 1000, missing: list|None = None):
+    """Yield (code_id, redeem_url, resumed) for every slot in [0, count) of the batch.
+
+    Codes an earlier, larger run minted past `count` are not streamed. Pass
+    `missing` when the caller already computed missing_slots().
+    """
+    if missing is None:
+        missing = missing_slots(batch_id, count)
+    wanted = {batch_code_hash(batch_id, seq) for seq in range(count)}
+    ts = int(time.time())
+    for code_id, mid, code_hash in iter_batch(batch_id, chunk):
+        if code_hash in wanted:
+            yield code_id, redeem_url_for(code_id, mid, ts), True
+    for code_id in mint_slots(batch_id, merchant_id, product_id, duration_min, missing, chunk):
+        yield code_id, redeem_url_for(code_id, merchant_id, ts), False
+
+class _CodeWriter:
+    """Group commit for single codes: concurrent submit()s share one multi-row INSERT.
+
+    Rows arrive with ids from the allocator, so the caller renders the token and QR
+    while its row waits here, then blocks on the returned future before answering.
+    """
+
+    def __init__(self, app, batch_size: int, linger: float):
+        self.app = app
+        self.batch_size = batch_size
+        self.linger = linger
+        self._q = deque()
+        self._cv = threading.Condition()
+        self.stats = {'rows': 0, 'batches': 0, 'errors': 0}
+        self._thread = threading.Thread(target=self._run, name='code-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, row: dict) -> Future:
+        fut = Future()
+        with self._cv:
+            self._q.append((row, fut))
+            self._cv.notify()
+        return fut
+
+    def _run(self):
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: self._q)
+            if len(self._q) < self.batch_size:
+                time.sleep(self.linger)
+            with self._cv:
+                batch = [self._q.popleft() for _ in range(min(self.batch_size, len(self._q)))]
+            t0 = time.perf_counter()
+            try:
+                with self.app.app_context():
+                    db.session.execute(insert(Code), [row for row, _ in batch])
+                    db.session.commit()
+            except Exception as e:
+                self.stats['errors'] += 1
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            observe('db.code_batch_insert', time.perf_counter() - t0)
+            self.stats['rows'] += len(batch)
+            self.stats['batches'] += 1
+            for row, fut in batch:
+                fut.set_result(row['id'])
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+def persist_code(row: dict) -> Future:
+    """Queue a code row (with its allocated id) for the next group commit."""
+    global _writer, _writer_pid
+    if _writer_pid != os.getpid():
+        with _writer_lock:
+            if _writer_pid != os.getpid():
+                cfg = current_app.config
+                _writer = _CodeWriter(current_app._get_current_object(), cfg.get('CODE_WRITE_BATCH', 500),
+                                      cfg.get('CODE_WRITE_LINGER_S', 0.002))
+                _writer_pid = os.getpid()
+    return _writer.submit(row)
+
+def writer_stats() -> dict:
+    return dict(_writer.stats) if _writer is not None and _writer_pid == os.getpid() else {}
@@ -0,0 +1,173 @@
+import os, json, time, base64, hashlib, threading
+import jwt
+from flask import current_app
+from cryptography.hazmat.primitives.asymmetric import rsa, ec
+from cryptography.hazmat.primitives.serialization import load_pem_private_key, load_pem_public_key
+
+# Signing/verification keys parsed once into key objects and identified by kid.
+#
+# Sources, merged in this order:
+#   - JWT_PRIVATE_KEY / JWT_PUBLIC_KEY (the single legacy pair, kid = JWK thumbprint)
+#   - JWT_KEYS_DIR: <kid>.key (private, signs and verifies) and <kid>.pub (verify only)
+# The active signing kid is JWT_ACTIVE_KID, else the content of <JWT_KEYS_DIR>/active,
+# else the newest <kid>.key, else the legacy pair. Rotate by dropping a new <kid>.key
+# in the directory; retire by deleting <kid>.key (stop signing) and later <kid>.pub
+# (stop verifying) once live tokens have expired. Workers pick changes up within
+# JWT_KEYS_RELOAD_S without a restart.
+#
+# Since workers reload at different times, a .key only signs once its file is
+# JWT_KEYS_RELOAD_S old: by then every worker verifies with it. Until then the
+# previous key keeps signing, whether the new one is picked as newest or named
+# active (unless no other key could sign at all, as on a first deployment).
+#
+# A key file that cannot be read or parsed (half-written, malformed, deleted
+# mid-scan) is logged and the previous ring is kept; it is retried at the next
+# check. Only the very first load goes ahead without it.
+
+def _b64u(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def to_jwk(pub) -> dict:
+    if isinstance(pub, rsa.RSAPublicKey):
+        return jwt.algorithms.RSAAlgorithm.to_jwk(pub, as_dict=True)
+    if isinstance(pub, ec.EllipticCurvePublicKey):
+        return jwt.algorithms.ECAlgorithm.to_jwk(pub, as_dict=True)
+    raise ValueError('unsupported key type')
+
+def thumbprint(pub) -> str:
+    """RFC 7638 JWK thumbprint (truncated) used as kid for keys without an explicit one."""
+    jwk = to_jwk(pub)
+    members = ('e', 'kty', 'n') if jwk['kty'] == 'RSA' else ('crv', 'kty', 'x', 'y')
+    canon = json.dumps({k: jwk[k] for k in members}, separators=(',', ':'), sort_keys=True)
+    return _b64u(hashlib.sha256(canon.encode()).digest())[:16]
+
+class KeyRing:
+    def __init__(self, signing: dict, verifying: dict, active: str|None, generation: int):
+        self.signing = signing        # kid -> private key object
+        self.verifying = verifying    # kid -> public key object
+        self.active = active
+        self.legacy = None            # kid of the env pair, used for tokens without a kid
+        self.generation = generation
+        self.ripens_at = None         # epoch seconds at which a pending .key becomes able to sign
+        self.errors = []              # (file name, error) for key files that were skipped
+
+def _dir_signature(path: str|None):
+    if not path or not os.path.isdir(path):
+        return ()
+    out = []
+    for name in sorted(os.listdir(path)):
+        try:
+            st = os.stat(os.path.join(path, name))
+        except OSError:
+            continue    # deleted since listdir
+        out.append((name, st.st_mtime_ns, st.st_size))
+    return tuple(out)
+
+def _load(cfg, generation: int) -> KeyRing:
+    signing, verifying, born = {}, {}, {}     # born: kid -> mtime of its .key (epoch seconds)
+    ring = KeyRing(signing, verifying, None, generation)
+    priv_pem, pub_pem = cfg.get('JWT_PRIVATE_KEY'), cfg.get('JWT_PUBLIC_KEY')
+    if priv_pem or pub_pem:
+        priv = load_pem_private_key(priv_pem.encode(), password=None) if priv_pem else None
+        pub = load_pem_public_key(pub_pem.encode()) if pub_pem else priv.public_key()
+        kid = thumbprint(pub)
+        verifying[kid] = pub
+        if priv is not None:
+            signing[kid] = priv
+        ring.legacy = kid
+    keys_dir = cfg.get('JWT_KEYS_DIR')
+    if keys_dir and os.path.isdir(keys_dir):
+        for name in sorted(os.listdir(keys_dir)):
+            kid, ext = os.path.splitext(name)
+            path = os.path.join(keys_dir, name)
+            try:
+                if ext == '.key':
+                    with open(path, 'rb') as f:
+                        priv = load_pem_private_key(f.read(), password=None)
+                        born[kid] = os.fstat(f.fileno()).st_mtime
+                    signing[kid] = priv
+                    verifying[kid] = priv.public_key()
+                elif ext == '.pub':
+                    with open(path, 'rb') as f:
+                        verifying.setdefault(kid, load_pem_public_key(f.read()))
+            except (OSError, ValueError, TypeError) as e:
+                ring.errors.append((name, e))
+    active = cfg.get('JWT_ACTIVE_KID')
+    if not active and keys_dir:
+        try:
+            with open(os.path.join(keys_dir, 'active'), 'r') as f:
+                active = f.read().strip() or None
+        except OSError:
+            pass
+    # Keys younger than one reload interval may still be unknown to other workers
+    ready_at = {kid: mtime + cfg.get('JWT_KEYS_RELOAD_S', 30) for kid, mtime in born.items()}
+    now = time.time()
+    ready = [kid for kid in sorted(born, key=born.get) if ready_at[kid] <= now]
+    fallback = ready[-1] if ready else (ring.legacy if ring.legacy in signing else None)
+    wanted = active or (max(born, key=born.get) if born else None)
+    if wanted in born and ready_at[wanted] > now and fallback is not None:
+        ring.active = fallback
+        ring.ripens_at = ready_at[wanted]
+    else:
+        ring.active = wanted or fallback
+    return ring
+
+_ring = None
+_sig = None
+_checked = 0.0
+_lock = threading.Lock()
+
+def current() -> KeyRing:
+    """The parsed key ring, reloaded when JWT_KEYS_DIR changes (checked every JWT_KEYS_RELOAD_S)."""
+    global _ring, _sig, _checked
+    now = time.monotonic()
+    if _ring is not None and now - _checked < current_app.config.get('JWT_KEYS_RELOAD_S', 30):
+        return _ring
+    with _lock:
+        if _ring is not None and now - _checked < current_app.config.get('JWT_KEYS_RELOAD_S', 30):
+            return _ring
+        cfg = current_app.config
+        sig = (cfg.get('JWT_PRIVATE_KEY'), cfg.get('JWT_PUBLIC_KEY'), cfg.get('JWT_ACTIVE_KID'),
+               _dir_signature(cfg.get('JWT_KEYS_DIR')))
+        ripe = _ring is not None and _ring.ripens_at is not None and time.time() >= _ring.ripens_at
+        if _ring is None or sig != _sig or ripe:
+            try:
+                ring = _load(cfg, (_ring.generation + 1) if _ring else 1)
+            except (OSError, ValueError, TypeError) as e:
+                # JWT_PRIVATE_KEY/JWT_PUBLIC_KEY themselves are broken
+                if _ring is None:
+                    raise
+                ring = None
+                current_app.logger.error('JWT key ring reload failed, keeping generation %d: %s',
+                                         _ring.generation, e)
+            if ring is not None and ring.errors:
+                for name, e in ring.errors:
+                    current_app.logger.error('JWT key file %s skipped: %s', name, e)
+                if _ring is not None:
+                    ring = None     # keep the previous ring; _sig is left stale so the next check retries
+            if ring is not None:
+                _ring, _sig = ring, sig
+        _checked = now
+        return _ring
+
+def signing_key():
+    """Return (kid, private key object) for the active signing key."""
+    ring = current()
+    if ring.active not in ring.signing:
+        raise RuntimeError('no active JWT signing key')
+    return ring.active, ring.signing[ring.active]
+
+def verification_key(kid: str|None):
+    """Public key object for kid; tokens minted before kids were stamped use the legacy pair."""
+    ring = current()
+    return ring.verifying.get(kid if kid else ring.legacy)
+
+def jwks() -> dict:
+    ring = current()
+    alg = current_app.config.get('JWT_ALG', 'RS256')
+    keys = []
+    for kid, pub in sorted(ring.verifying.items()):
+        jwk = to_jwk(pub)
+        jwk.update({'kid': kid, 'use': 'sig', 'alg': alg})
+        keys.append(jwk)
+    return {'keys': keys}
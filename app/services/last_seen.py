@@ -0,0 +1,152 @@
+import os, time, atexit, threading
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import update, bindparam, or_
+from ..models import db, Redemption
+from .rate_limit import r
+from .metrics import observe
+
+# Write-behind Redemption.last_seen_at. A content access only records a touch,
+# code_id -> unix time, in the store hash SEEN_KEY (shared by all workers when
+# Redis is up), and each worker skips repeat touches of the same code within
+# LAST_SEEN_MAX_STALENESS_S. A per-worker thread drains the hash every
+# LAST_SEEN_FLUSH_S and applies it as chunked executemany UPDATEs, which never
+# move last_seen_at backwards. The column therefore lags real access by at most
+# LAST_SEEN_MAX_STALENESS_S + LAST_SEEN_FLUSH_S.
+
+SEEN_KEY = 'seen'
+_CHUNK = 1000
+
+class _Recent:
+    """code_id -> monotonic time of this worker's last touch, to skip repeats."""
+
+    def __init__(self, max_items: int = 100_000):
+        self.max_items = max_items
+        self._items = {}
+        self.skipped = 0
+
+    def due(self, code_id: int, window: float) -> bool:
+        now = time.monotonic()
+        last = self._items.get(code_id)
+        if last is not None and now - last < window:
+            self.skipped += 1
+            return False
+        if len(self._items) >= self.max_items:
+            # Forgetting only costs a redundant touch
+            self._items.clear()
+        self._items[code_id] = now
+        return True
+
+_recent = _Recent()
+
+def _due(code_id: int) -> bool:
+    cfg = current_app.config
+    if not cfg.get('LAST_SEEN_ENABLED', True):
+        return False
+    ensure_flusher()
+    return _recent.due(code_id, cfg.get('LAST_SEEN_MAX_STALENESS_S', 60))
+
+def touch(code_id: int):
+    """Record a content access for the redemption of code_id."""
+    if _due(code_id):
+        r().hset(SEEN_KEY, str(code_id), int(time.time()))
+
+async def atouch(store, code_id: int):
+    """touch() for the ASGI app, through its AsyncStore."""
+    if _due(code_id):
+        await store.hset(SEEN_KEY, str(code_id), int(time.time()))
+
+_stmt = (update(Redemption.__table__)
+         .where(Redemption.__table__.c.code_id == bindparam('b_code_id'),
+                or_(Redemption.__table__.c.last_seen_at.is_(None),
+                    Redemption.__table__.c.last_seen_at < bindparam('b_ts')))
+         .values(last_seen_at=bindparam('b_ts')))
+
+def _drain() -> dict:
+    store = r()
+    seen = store.hdrain(SEEN_KEY)
+    fallback = getattr(store, 'fallback', None)
+    if fallback is not None:
+        # Touches recorded while the Redis breaker was open
+        for k, v in fallback.hdrain(SEEN_KEY).items():
+            if int(v) > int(seen.get(k, 0)):
+                seen[k] = v
+    return seen
+
+def flush() -> int:
+    """Apply pending touches; returns how many redemptions were considered."""
+    seen = _drain()
+    if not seen:
+        return 0
+    rows = [{'b_code_id': int(k), 'b_ts': datetime.fromtimestamp(int(v), timezone.utc)} for k, v in seen.items()]
+    t0 = time.perf_counter()
+    try:
+        for i in range(0, len(rows), _CHUNK):
+            db.session.execute(_stmt, rows[i:i + _CHUNK])
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Put back what was not written so the next flush retries it
+        store = r()
+        for row in rows[i:]:
+            store.hset(SEEN_KEY, str(row['b_code_id']), int(row['b_ts'].timestamp()))
+        raise
+    observe('last_seen.flush', time.perf_counter() - t0)
+    return len(rows)
+
+class _Flusher:
+    def __init__(self, app, interval: float):
+        self.app = app
+        self.interval = interval
+        self.stats = {'flushes': 0, 'rows': 0, 'errors': 0, 'last_flush_at': None}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='last-seen-flusher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+        self.run_once()
+
+    def run_once(self):
+        try:
+            with self.app.app_context():
+                n = flush()
+        except Exception:
+            self.stats['errors'] += 1
+            return
+        self.stats['flushes'] += 1
+        self.stats['rows'] += n
+        self.stats['last_flush_at'] = int(time.time())
+
+    def close(self, timeout: float = 5.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+_flusher = None
+_pid = None
+_lock = threading.Lock()
+
+def ensure_flusher():
+    # Started per worker after fork (gunicorn preload_app), like the audit writer
+    global _flusher, _pid
+    if _pid == os.getpid():
+        return _flusher
+    with _lock:
+        if _pid != os.getpid():
+            _recent._items.clear()
+            _flusher = _Flusher(current_app._get_current_object(), current_app.config.get('LAST_SEEN_FLUSH_S', 10.0))
+            _pid = os.getpid()
+    return _flusher
+
+def shutdown(timeout: float = 5.0):
+    if _flusher is not None and _pid == os.getpid():
+        _flusher.close(timeout)
+
+def stats() -> dict:
+    out = {'touch_skipped': _recent.skipped, 'recent': len(_recent._items)}
+    if _flusher is not None and _pid == os.getpid():
+        out.update(_flusher.stats)
+    return out
+
+atexit.register(shutdown)
@@ -0,0 +1,103 @@
+import os, time, hmac
+from flask import Response, request, g, jsonify, current_app
+try:
+    import prometheus_client as prom
+    from prometheus_client import multiprocess
+except ImportError:
+    prom = None
+
+# Prometheus metrics: per-route request histograms plus timed sub-spans
+# (resolve_opaque, redeem queries, Redis calls, JWT signing, QR rendering).
+# Under gunicorn, set PROMETHEUS_MULTIPROC_DIR to an empty directory: workers then
+# write samples to per-pid files that /metrics aggregates, and gunicorn.conf.py
+# marks exited workers dead. Without prometheus_client everything is a no-op.
+# /metrics answers only to `Authorization: Bearer <METRICS_TOKEN>` or the admin
+# key (X-Admin-Key); with neither configured it is closed.
+
+_BUCKETS = (.0002, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0)
+
+if prom is not None:
+    REQUEST_SECONDS = prom.Histogram('http_request_duration_seconds', 'Request latency by route',
+                                     ('route', 'method', 'status'), buckets=_BUCKETS)
+    STAGE_SECONDS = prom.Histogram('stage_duration_seconds', 'Latency of timed sub-spans of a request',
+                                   ('stage',), buckets=_BUCKETS)
+    # Pre-minted code pool (services/code_pool.py); depth is summed over live workers
+    POOL_DEPTH = prom.Gauge('code_pool_depth', 'Ready codes in the issuance pool',
+                            ('merchant_id', 'product_id', 'duration_min'), multiprocess_mode='livesum')
+    POOL_POPS = prom.Counter('code_pool_pops', 'Issuance pool lookups by result', ('result',))
+
+_stages = {}
+
+def observe(stage: str, seconds: float):
+    if prom is None:
+        return
+    child = _stages.get(stage)
+    if child is None:
+        # labels() takes a lock; resolve each stage's child once
+        child = _stages[stage] = STAGE_SECONDS.labels(stage)
+    child.observe(seconds)
+
+class span:
+    """with span('db.code_lookup'): ... -- records the block's duration under that stage."""
+    __slots__ = ('stage', 't0')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.t0)
+        return False
+
+def pool_depth(key: tuple, depth: int):
+    if prom is not None:
+        POOL_DEPTH.labels(*map(str, key)).set(depth)
+
+def pool_pop(result: str, n: int = 1):
+    if prom is not None:
+        POOL_POPS.labels(result).inc(n)
+
+def observe_request(route: str, method: str, status: int, seconds: float):
+    if prom is not None:
+        REQUEST_SECONDS.labels(route, method, str(status)).observe(seconds)
+
+def _start():
+    g._metrics_t0 = time.perf_counter()
+
+def _finish(resp):
+    t0 = g.pop('_metrics_t0', None)
+    if t0 is not None:
+        # The rule, not the path, keeps label cardinality bounded
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.labels(route, request.method, str(resp.status_code)).observe(time.perf_counter() - t0)
+    return resp
+
+def registry():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        reg = prom.CollectorRegistry()
+        multiprocess.MultiProcessCollector(reg)
+        return reg
+    return prom.REGISTRY
+
+def _authorized() -> bool:
+    cfg = current_app.config
+    auth = request.headers.get('Authorization', '')
+    given = [auth[7:] if auth.startswith('Bearer ') else '', request.headers.get('X-Admin-Key', '')]
+    keys = [k for k in (cfg.get('METRICS_TOKEN'), cfg.get('ADMIN_API_KEY')) if k]
+    return any(t and hmac.compare_digest(t.encode(), k.encode()) for t in given for k in keys)
+
+def metrics_view():
+    if not _authorized():
+        return jsonify({'error': 'unauthorized'}), 401
+    if prom is None:
+        return jsonify({'error': 'metrics_unavailable'}), 404
+    return Response(prom.generate_latest(registry()), mimetype=prom.CONTENT_TYPE_LATEST)
+
+def init_app(app):
+    if prom is not None:
+        app.before_request(_start)
+        app.after_request(_finish)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,253 @@
+import os, json, time, atexit, hashlib, threading
+from collections import deque
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from ..models import db, Code
+from .rate_limit import r
+from .issuance import batch_code_hash, code_expiry
+from .ids import code_ids
+from .metrics import observe
+from . import audit, catalog
+
+# payment.succeeded deliveries are acknowledged before any DB work:
+#   1. SET whk:<event_id> NX with WEBHOOK_PENDING_TTL_S; a retry that finds the key
+#      is a duplicate and is never enqueued again.
+#   2. the event goes into this worker's bounded queue and the webhook answers 202.
+#   3. a background thread mints queued events as multi-row INSERTs (ids from services/ids.py) and overwrites
+#      the key with the code for WEBHOOK_DEDUPE_TTL_S, so later retries get it back.
+# Each event's code has code_hash = batch_code_hash('evt:<event_id>', 0), unique in
+# the code table: even if the store forgets a key (restart, memory store under
+# several workers) a replay finds the existing code instead of minting another.
+# If a worker dies with events queued, their pending keys expire and the
+# provider's next retry enqueues them again.
+#
+# accept() refuses an event whose product does not exist or belongs to another
+# merchant, so rows that can never be inserted are not acknowledged. If a batch
+# still fails, its rows are retried one by one: a duplicate code_hash means the
+# event was minted elsewhere, and any other integrity error dead-letters that
+# event alone. A batch that fails for any other reason goes back to the head of
+# the queue, and an event is dead-lettered after WEBHOOK_MAX_ATTEMPTS tries.
+# Dead-lettering drops the pending key, so the provider's next retry is accepted
+# again, and records 'payment.dead_letter' in the audit log.
+
+class QueueFull(RuntimeError):
+    pass
+
+class InvalidEvent(ValueError):
+    pass
+
+def event_batch_id(event_id: str) -> str:
+    # Code.batch_id is 64 chars; very long provider ids are hashed
+    if len(event_id) > 60:
+        event_id = hashlib.sha256(event_id.encode()).hexdigest()[:60]
+    return f"evt:{event_id}"
+
+def _key(event_id: str) -> str:
+    return f"whk:{event_id}"
+
+class _Minter:
+    def __init__(self, app, max_queue: int, batch_size: int, interval: float, max_attempts: int = 5):
+        self.app = app
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self._q = deque()
+        self._cv = threading.Condition()
+        self._closed = False
+        self.stats = {'enqueued': 0, 'rejected': 0, 'minted': 0, 'replayed': 0, 'batches': 0, 'errors': 0,
+                      'dead_lettered': 0, 'last_batch_lag_ms': 0.0}
+        self._thread = threading.Thread(target=self._run, name='webhook-minter', daemon=True)
+        self._thread.start()
+
+    def put(self, job: dict) -> bool:
+        with self._cv:
+            if self._closed or len(self._q) >= self.max_queue:
+                self.stats['rejected'] += 1
+                return False
+            self._q.append((time.monotonic(), job))
+            self.stats['enqueued'] += 1
+            self._cv.notify()
+            return True
+
+    def _run(self):
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: self._q or self._closed)
+                if not self._q:
+                    return
+            # Let a burst accumulate into one batch
+            if len(self._q) < self.batch_size and not self._closed:
+                time.sleep(self.interval)
+            with self._cv:
+                batch = [self._q.popleft() for _ in range(min(self.batch_size, len(self._q)))]
+            try:
+                with self.app.app_context():
+                    self._mint(batch)
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.app.logger.warning('webhook mint failed for %d events: %s', len(batch), e)
+                retry = []
+                for item in batch:
+                    item[1]['attempts'] = item[1].get('attempts', 0) + 1
+                    if item[1]['attempts'] < self.max_attempts:
+                        retry.append(item)
+                    else:
+                        self._dead_letter_safely(item[1], f"failed {item[1]['attempts']} times: {e}")
+                with self._cv:
+                    self._q.extendleft(reversed(retry))
+                if self._closed:
+                    return
+                time.sleep(max(self.interval, 1.0))
+
+    def _dead_letter_safely(self, job: dict, reason: str):
+        try:
+            with self.app.app_context():
+                self._dead_letter(job, reason)
+        except Exception as e:
+            # The pending key still expires, so the provider's retry gets through either way
+            self.app.logger.error('webhook event %s dropped: %s (%s)', job['event_id'], reason, e)
+
+    def _dead_letter(self, job: dict, reason: str):
+        row = job['row']
+        self.stats['dead_lettered'] += 1
+        self.app.logger.error('webhook event %s dead-lettered: %s', job['event_id'], reason)
+        r().delete(_key(job['event_id']))
+        audit.record('webhook', row['merchant_id'], 'payment.dead_letter',
+                     {'event_id': job['event_id'], 'product_id': row['product_id'], 'reason': reason,
+                      'payment_id': job.get('payment_id')})
+
+    def _insert_each(self, rows: list, jobs: dict) -> dict:
+        """Insert rows one at a time after a batch conflict; returns code_hash -> id of those inserted.
+
+        A row that hits a duplicate code_hash was minted by another worker and is
+        picked up by the caller's re-read; any other integrity error (unknown
+        merchant or product) dead-letters its event.
+        """
+        inserted = {}
+        for row, code_id in zip(rows, code_ids().take(len(rows))):
+            try:
+                db.session.execute(insert(Code), [{**row, 'id': code_id}])
+                db.session.commit()
+                inserted[row['code_hash']] = code_id
+            except IntegrityError as e:
+                db.session.rollback()
+                if db.session.query(Code.id).filter(Code.code_hash == row['code_hash']).scalar() is None:
+                    self._dead_letter(jobs.pop(row['code_hash']), f"rejected by the database: {e.orig}")
+        return inserted
+
+    def _mint(self, batch: list):
+        t0 = time.monotonic()
+        jobs = {}
+        for _, job in batch:
+            jobs.setdefault(job['row']['code_hash'], job)
+        found = dict(db.session.query(Code.code_hash, Code.id).filter(Code.code_hash.in_(list(jobs))).all())
+        missing = [j['row'] for h, j in jobs.items() if h not in found]
+        new = {}
+        if missing:
+            ids = code_ids().take(len(missing))
+            try:
+                db.session.execute(insert(Code), [{**row, 'id': code_id} for row, code_id in zip(missing, ids)])
+                db.session.commit()
+                new = {row['code_hash']: code_id for row, code_id in zip(missing, ids)}
+            except IntegrityError:
+                # Some row conflicts (minted by another worker, or invalid): settle them one by one
+                db.session.rollback()
+                new = self._insert_each(missing, jobs)
+                found = dict(db.session.query(Code.code_hash, Code.id)
+                             .filter(Code.code_hash.in_(list(jobs))).all())
+            found.update(new)
+        store, ttl = r(), current_app.config.get('WEBHOOK_DEDUPE_TTL_S', 259200)
+        for h, job in jobs.items():
+            row = job['row']
+            store.setex(_key(job['event_id']), ttl, json.dumps({'code_id': found[h], 'merchant_id': row['merchant_id']}))
+            if h in new:
+                audit.record('webhook', row['merchant_id'], 'payment.succeeded',
+                             {'code_id': found[h], 'event_id': job['event_id'], 'product_id': row['product_id'],
+                              'duration_min': row['duration_min'], 'payment_id': job.get('payment_id')})
+        s = self.stats
+        s['minted'] += len(new)
+        s['replayed'] += len(jobs) - len(new)
+        s['batches'] += 1
+        s['last_batch_lag_ms'] = round((time.monotonic() - batch[0][0]) * 1000, 2)
+        observe('webhook.mint', time.monotonic() - t0)
+
+    def close(self, timeout: float = 5.0):
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+        self._thread.join(timeout)
+
+    def snapshot(self) -> dict:
+        with self._cv:
+            return {**self.stats, 'queued': len(self._q)}
+
+_minter = None
+_pid = None
+_lock = threading.Lock()
+
+def minter():
+    # Started per worker after fork (gunicorn preload_app)
+    global _minter, _pid
+    if _pid == os.getpid():
+        return _minter
+    with _lock:
+        if _pid != os.getpid():
+            cfg = current_app.config
+            _minter = _Minter(current_app._get_current_object(), cfg.get('WEBHOOK_QUEUE_MAX', 10000),
+                              cfg.get('WEBHOOK_BATCH_SIZE', 200), cfg.get('WEBHOOK_FLUSH_S', 0.05),
+                              cfg.get('WEBHOOK_MAX_ATTEMPTS', 5))
+            _pid = os.getpid()
+    return _minter
+
+def accept(event_id: str, merchant_id: int, product_id: int, duration_min: int, payment_id=None):
+    """Dedupe and enqueue one delivery; returns ('queued', None) or ('duplicate', state).
+
+    state is {'code_id', 'merchant_id'} once minted, None while still pending.
+    Raises InvalidEvent when the product does not exist or is not the merchant's
+    (the caller answers 422), QueueFull when the event could not be queued (503).
+    """
+    if catalog.product_merchant(product_id) != merchant_id:
+        raise InvalidEvent(f"product {product_id} does not belong to merchant {merchant_id}")
+    store = r()
+    key = _key(event_id)
+    if not store.set(key, json.dumps({'pending': True}), ex=current_app.config.get('WEBHOOK_PENDING_TTL_S', 300), nx=True):
+        raw = store.get(key)
+        state = json.loads(raw) if raw else None
+        return 'duplicate', state if state and 'code_id' in state else None
+    batch_id = event_batch_id(event_id)
+    job = {'event_id': event_id, 'payment_id': payment_id, 'row': {
+        'merchant_id': merchant_id,
+        'product_id': product_id,
+        'code_hash': batch_code_hash(batch_id, 0),
+        'batch_id': batch_id,
+        'duration_min': duration_min,
+        'expires_at': code_expiry(),
+        'status': 'issued',
+    }}
+    if not minter().put(job):
+        # Forget the event so the provider's retry is not taken for a duplicate
+        store.delete(key)
+        raise QueueFull(event_id)
+    return 'queued', None
+
+def lookup(event_id: str):
+    """('done', code) when minted, ('queued', None) while pending, (None, None) if unknown."""
+    code = Code.query.filter_by(code_hash=batch_code_hash(event_batch_id(event_id), 0)).first()
+    if code is not None:
+        return 'done', code
+    if r().exists(_key(event_id)):
+        return 'queued', None
+    return None, None
+
+def shutdown(timeout: float = 5.0):
+    if _minter is not None and _pid == os.getpid():
+        _minter.close(timeout)
+
+def stats() -> dict:
+    if _minter is None or _pid != os.getpid():
+        return {'queued': 0}
+    return _minter.snapshot()
+
+atexit.register(shutdown)
@@ -1,13 +1,140 @@
+import os, struct, threading, zlib
+from collections import OrderedDict
 import qrcode
-import io
+from qrcode import constants
+from .metrics import span
 
-def make_qr(url: str, path: str):
-    img = qrcode.make(url)
-    img.save(path)
+EC_LEVELS = {
+    'L': constants.ERROR_CORRECT_L,
+    'M': constants.ERROR_CORRECT_M,
+    'Q': constants.ERROR_CORRECT_Q,
+    'H': constants.ERROR_CORRECT_H,
+}
 
-def make_qr_bytes(url: str) -> bytes:
+class RenderCache:
+    """LRU of rendered QR bytes keyed by (payload, options), bounded by total byte size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            val = self._items.get(key)
+            if val is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return val
+
+    def put(self, key, val: bytes):
+        size = len(val)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = val
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, ev = self._items.popitem(last=False)
+                self._bytes -= len(ev)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'items': len(self._items), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+_cache = RenderCache(int(os.environ.get('QR_CACHE_BYTES', str(8 * 1024 * 1024))))
+# Pinning a mask pattern (0-7) skips the 8-way mask trial that dominates matrix
+# construction; codes stay valid but the penalty-optimal mask is no longer chosen.
+_MASK = os.environ.get('QR_MASK_PATTERN')
+DEFAULT_MASK = int(_MASK) if _MASK not in (None, '') else None
+
+def cache_stats() -> dict:
+    return _cache.stats()
+
+def qr_matrix(payload: str, error_correction: str = 'M', border: int = 4, mask: int|None = None) -> list:
+    """Module matrix (border included) as rows of booleans, True = dark."""
+    qr = qrcode.QRCode(error_correction=EC_LEVELS[error_correction], border=border, mask_pattern=mask)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+def matrix_to_png(matrix: list, box_size: int) -> bytes:
+    """Encode the matrix as a 1-bit grayscale PNG, each module box_size pixels square."""
+    size = len(matrix) * box_size
+    pad = '1' * (-size % 8)
+    expand = {ord('0'): '0' * box_size, ord('1'): '1' * box_size}
+    raw = bytearray()
+    for row in matrix:
+        # PNG grayscale: 0 = black, 1 = white; each scanline starts with filter type 0
+        bits = ''.join('0' if dark else '1' for dark in row).translate(expand) + pad
+        line = b'\x00' + int(bits, 2).to_bytes(len(bits) // 8, 'big')
+        raw += line * box_size
+    ihdr = struct.pack('>IIBBBBB', size, size, 1, 0, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', ihdr)
+            + _png_chunk(b'IDAT', zlib.compress(bytes(raw), 9)) + _png_chunk(b'IEND', b''))
+
+def matrix_to_svg(matrix: list, box_size: int) -> bytes:
+    """Encode the matrix as an SVG path, one horizontal run per subpath."""
+    n = len(matrix)
+    parts = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < n:
+            if row[x]:
+                start = x
+                while x < n and row[x]:
+                    x += 1
+                parts.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+            else:
+                x += 1
+    px = n * box_size
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{px}" height="{px}" viewBox="0 0 {n} {n}" '
+            f'shape-rendering="crispEdges"><rect width="{n}" height="{n}" fill="#fff"/>'
+            f'<path d="{"".join(parts)}" fill="#000"/></svg>').encode()
+
+def render(payload: str, fmt: str = 'png', error_correction: str = 'M', box_size: int = 10, border: int = 4,
+           mask: int|None = DEFAULT_MASK) -> bytes:
+    if fmt not in ('png', 'svg'):
+        raise ValueError('unsupported format')
+    if error_correction not in EC_LEVELS:
+        raise ValueError('bad error correction level')
+    key = (payload, fmt, error_correction, box_size, border, mask)
+    out = _cache.get(key)
+    if out is None:
+        matrix = qr_matrix(payload, error_correction, border, mask)
+        out = matrix_to_png(matrix, box_size) if fmt == 'png' else matrix_to_svg(matrix, box_size)
+        _cache.put(key, out)
+    return out
+
+def make_qr(url: str, path: str, **opts):
+    fmt = 'svg' if path.lower().endswith('.svg') else 'png'
+    with open(path, 'wb') as f:
+        f.write(render(url, fmt, **opts))
+
+def make_qr_bytes(url: str, error_correction: str = 'M', box_size: int = 10, border: int = 4) -> bytes:
     """Return QR PNG bytes for the provided URL."""
-    img = qrcode.make(url)
-    buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    return buf.getvalue()
+    with span('make_qr_bytes'):
+        return render(url, 'png', error_correction, box_size, border)
+
+def make_qr_svg(url: str, error_correction: str = 'M', box_size: int = 10, border: int = 4) -> bytes:
+    """Return QR SVG bytes for the provided URL."""
+    return render(url, 'svg', error_correction, box_size, border)
@@ -1,53 +1,254 @@
-import os, time, json, threading
+import os, time, json, math, heapq, threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import redis
 from flask import current_app
+from .breaker import ManagedStore
 
 _r = None
 _lock = threading.Lock()
 
-class _MemStore:
+class _Shard:
+    __slots__ = ('lock', 'data', 'exp', 'heap', 'evictions', 'expirations')
+
     def __init__(self):
-        self._data = {}
-        self._exp = {}
-        self._lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.data = OrderedDict()   # key -> value, in LRU order
+        self.exp = {}               # key -> absolute expiry
+        self.heap = []              # (expiry, key); stale entries skipped lazily
+        self.evictions = 0          # counters are per shard, updated under its lock
+        self.expirations = 0
+
+class _MemStore:
+    """In-process fallback for Redis.
+
+    Keys are spread over independently locked shards. Expiry is driven by a
+    per-shard min-heap so each call only pops what is due, and every shard
+    holds at most max_keys/shards keys, evicting least recently used ones.
+    """
 
-    def _cleanup(self):
-        now = time.time()
-        expired = [k for k, ts in self._exp.items() if ts <= now]
-        for k in expired:
-            self._data.pop(k, None)
-            self._exp.pop(k, None)
+    def __init__(self, max_keys=1_000_000, shards=16):
+        self._shards = [_Shard() for _ in range(shards)]
+        self._cap = max(1, max_keys // shards)
+        self.max_keys = self._cap * shards
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    @contextmanager
+    def _locked(self, *keys):
+        # Multi-key operations lock their shards in a fixed order
+        n = len(self._shards)
+        shards = [self._shards[i] for i in sorted({hash(k) % n for k in keys})]
+        for sh in shards:
+            sh.lock.acquire()
+        try:
+            now = time.time()
+            for sh in shards:
+                self._expire_due(sh, now)
+            yield now
+        finally:
+            for sh in reversed(shards):
+                sh.lock.release()
+
+    def _expire_due(self, sh, now):
+        heap = sh.heap
+        while heap and heap[0][0] <= now:
+            ts, key = heapq.heappop(heap)
+            if sh.exp.get(key) == ts:
+                del sh.exp[key]
+                sh.data.pop(key, None)
+                sh.expirations += 1
+        if len(heap) > 2 * len(sh.exp) + 64:
+            sh.heap = [(ts, k) for k, ts in sh.exp.items()]
+            heapq.heapify(sh.heap)
+
+    def _put(self, key, value, ttl=None, now=None):
+        sh = self._shard(key)
+        sh.data[key] = value
+        sh.data.move_to_end(key)
+        if ttl is not None:
+            ts = now + ttl
+            sh.exp[key] = ts
+            heapq.heappush(sh.heap, (ts, key))
+        while len(sh.data) > self._cap:
+            old, _ = sh.data.popitem(last=False)
+            sh.exp.pop(old, None)
+            sh.evictions += 1
+
+    def _get(self, key):
+        sh = self._shard(key)
+        val = sh.data.get(key)
+        if val is not None:
+            sh.data.move_to_end(key)
+        return val
 
     def incr(self, key):
-        with self._lock:
-            self._cleanup()
-            v = int(self._data.get(key, '0')) + 1
-            self._data[key] = str(v)
+        with self._locked(key) as now:
+            v = int(self._get(key) or '0') + 1
+            self._put(key, str(v), None, now)
             return v
 
     def expire(self, key, ttl):
-        with self._lock:
-            self._cleanup()
-            self._exp[key] = time.time() + ttl
+        with self._locked(key) as now:
+            sh = self._shard(key)
+            if key not in sh.data:
+                return 0
+            self._put(key, sh.data[key], ttl, now)
+            return 1
 
     def setex(self, key, ttl, value):
-        with self._lock:
-            self._cleanup()
-            self._data[key] = value
-            self._exp[key] = time.time() + ttl
+        with self._locked(key) as now:
+            self._put(key, value, ttl, now)
+
+    def set(self, key, value, ex=None, nx=False):
+        # redis-py semantics: None when nx and the key exists
+        with self._locked(key) as now:
+            if nx and key in self._shard(key).data:
+                return None
+            self._put(key, value, ex, now)
+            return True
+
+    def delete(self, *keys):
+        with self._locked(*keys):
+            n = 0
+            for key in keys:
+                sh = self._shard(key)
+                if sh.data.pop(key, None) is not None:
+                    sh.exp.pop(key, None)
+                    n += 1
+            return n
 
     def exists(self, key):
-        with self._lock:
-            self._cleanup()
-            return 1 if key in self._data else 0
+        with self._locked(key):
+            return 1 if key in self._shard(key).data else 0
 
     def get(self, key):
-        with self._lock:
-            self._cleanup()
-            return self._data.get(key)
+        with self._locked(key):
+            return self._get(key)
+
+    def hset(self, key, field, value):
+        with self._locked(key) as now:
+            h = self._get(key)
+            if not isinstance(h, dict):
+                h = {}
+                self._put(key, h, None, now)
+            new = field not in h
+            h[field] = value
+            return int(new)
+
+    def hdrain(self, key):
+        """HGETALL + DEL as one step."""
+        with self._locked(key):
+            sh = self._shard(key)
+            h = sh.data.pop(key, None)
+            sh.exp.pop(key, None)
+            return dict(h) if isinstance(h, dict) else {}
+
+    def take_tokens(self, buckets, writes=()):
+        # Same contract as _TAKE_LUA, atomic under the shard locks
+        keys = [b[0] for b in buckets] + [w[0] for w in writes]
+        with self._locked(*keys) as now:
+            now_ms = now * 1000
+            wait, state = 0, []
+            for key, cap, rate in buckets:
+                tokens, ts = self._get(key) or (cap, now_ms)
+                tokens = min(cap, tokens + max(0, now_ms - ts) * rate)
+                if tokens < 1:
+                    wait = max(wait, math.ceil((1 - tokens) / rate))
+                state.append(tokens)
+            if wait:
+                return wait
+            for (key, cap, rate), tokens in zip(buckets, state):
+                self._put(key, (tokens - 1, now_ms), math.ceil(cap / rate) / 1000, now)
+            for key, ttl, value in writes:
+                self._put(key, value, ttl, now)
+            return 0
+
+    def last_expiry(self) -> float:
+        """When the last key with a TTL expires (epoch seconds, 0 when there is none)."""
+        last = 0.0
+        for sh in self._shards:
+            with sh.lock:
+                last = max(last, max(sh.exp.values(), default=0.0))
+        return last
+
+    def stats(self) -> dict:
+        keys = heap = evictions = expirations = 0
+        for sh in self._shards:
+            with sh.lock:
+                keys += len(sh.data)
+                heap += len(sh.heap)
+                evictions += sh.evictions
+                expirations += sh.expirations
+        return {'backend': 'memory', 'keys': keys, 'max_keys': self.max_keys, 'shards': len(self._shards),
+                'heap_entries': heap, 'evictions': evictions, 'expirations': expirations}
+
+# Token buckets: KEYS[1..n] are buckets (hash t=tokens, ts=last refill in ms), ARGV[1] = n,
+# then capacity and refill rate (tokens/ms) per bucket. Any remaining KEYS are SETEX'd
+# with (ttl, value) pairs from the rest of ARGV, but only when every bucket had a token.
+# Returns 0 when admitted, else the milliseconds until the emptiest bucket refills.
+_TAKE_LUA = """
+local n = tonumber(ARGV[1])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local wait, state = 0, {}
+for i = 1, n do
+  local cap, rate = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+  local h = redis.call('HMGET', KEYS[i], 't', 'ts')
+  local tokens = tonumber(h[1]) or cap
+  local ts = tonumber(h[2]) or now
+  tokens = math.min(cap, tokens + math.max(0, now - ts) * rate)
+  if tokens < 1 then wait = math.max(wait, math.ceil((1 - tokens) / rate)) end
+  state[i] = tokens
+end
+if wait > 0 then return wait end
+for i = 1, n do
+  local cap, rate = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+  redis.call('HSET', KEYS[i], 't', tostring(state[i] - 1), 'ts', now)
+  redis.call('PEXPIRE', KEYS[i], math.ceil(cap / rate))
+end
+local a = 2 * n + 2
+for j = n + 1, #KEYS do
+  redis.call('SETEX', KEYS[j], ARGV[a], ARGV[a + 1])
+  a = a + 2
+end
+return 0
+"""
+
+class _RedisStore:
+    """Thin adapter giving a redis client the same surface as _MemStore."""
+
+    def __init__(self, client):
+        self.client = client
+        self._take = client.register_script(_TAKE_LUA)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def stats(self) -> dict:
+        return {'backend': 'redis'}
+
+    def hdrain(self, key):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(key)
+        pipe.delete(key)
+        return pipe.execute()[0]
+
+    def take_tokens(self, buckets, writes=()):
+        keys = [b[0] for b in buckets] + [w[0] for w in writes]
+        args = [len(buckets)]
+        for _, cap, rate in buckets:
+            args += [cap, repr(rate)]
+        for _, ttl, value in writes:
+            args += [max(1, int(ttl)), value]
+        return int(self._take(keys=keys, args=args))
+
+def _mem_store():
+    return _MemStore(current_app.config.get('MEMSTORE_MAX_KEYS', 1_000_000),
+                     current_app.config.get('MEMSTORE_SHARDS', 16))
 
 def r():
-    global _r
     if _r is not None:
         return _r
     with _lock:
@@ -57,28 +258,109 @@ def r():
         use_redis = os.environ.get('USE_REDIS', '1').lower() not in ('0', 'false', 'no')
         url = current_app.config.get('REDIS_URL')
         if use_redis and url:
-            try:
-                client = redis.from_url(url, decode_responses=True)
-                # Test connection once; fallback to memory on failure
-                client.ping()
-                _set(client)
-                return _r
-            except Exception:
-                pass
+            cfg = current_app.config
+            # Bounded pool with short timeouts; the breaker degrades to the memory
+            # store while Redis is unreachable and reconnects in the background.
+            pool = redis.BlockingConnectionPool.from_url(
+                url, decode_responses=True,
+                max_connections=cfg.get('REDIS_MAX_CONNECTIONS', 50),
+                timeout=cfg.get('REDIS_POOL_TIMEOUT', 1.0),
+                socket_timeout=cfg.get('REDIS_SOCKET_TIMEOUT', 0.25),
+                socket_connect_timeout=cfg.get('REDIS_CONNECT_TIMEOUT', 0.25),
+                health_check_interval=30,
+            )
+            _set(ManagedStore(_RedisStore(redis.Redis(connection_pool=pool)), _mem_store(),
+                              threshold=cfg.get('REDIS_BREAKER_THRESHOLD', 3),
+                              interval=cfg.get('REDIS_RECOVERY_INTERVAL_S', 2.0)))
+            return _r
         # Fallback to in-memory store
-        _set(_MemStore())
+        _set(_mem_store())
         return _r
 
 def _set(store):
     global _r
     _r = store
 
-def check_rate_ip(ip: str, limit=20, window=60):
-    k = f"rl:ip:{ip}:{int(time.time()//window)}"
-    v = r().incr(k)
-    r().expire(k, window)
-    if v > limit:
-        raise ValueError('rate exceeded')
+# Token-bucket rate limits, two tiers:
+#   1. a process-local bucket per key with the same capacity/rate as the global one.
+#      A worker alone can never see more traffic than the global limit admits, so an
+#      empty local bucket means the global one is empty too: floods are rejected
+#      without touching the store.
+#   2. the shared bucket in Redis/_MemStore, checked atomically for all keys at once.
+
+class RateLimited(ValueError):
+    def __init__(self, retry_after: float):
+        super().__init__('rate exceeded')
+        self.retry_after = retry_after
+
+def parse_limit(spec: str):
+    """'20/60' -> (capacity 20, refill rate in tokens per ms)."""
+    count, per = spec.split('/')
+    return int(count), int(count) / (float(per) * 1000)
+
+def buckets_for(ip: str|None = None, merchant_id: int|None = None, code_id: int|None = None) -> list:
+    cfg = current_app.config
+    out = []
+    for kind, ident, spec in (('ip', ip, 'RATE_LIMIT_IP'), ('m', merchant_id, 'RATE_LIMIT_MERCHANT'),
+                              ('code', code_id, 'RATE_LIMIT_CODE')):
+        if ident is not None and cfg.get(spec):
+            cap, rate = parse_limit(cfg[spec])
+            out.append((f"tb:{kind}:{ident}", cap, rate))
+    return out
+
+class _LocalBuckets:
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._b = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def take(self, buckets) -> float:
+        """Consume one token from each bucket; return ms to wait (0 = admitted)."""
+        now_ms = time.monotonic() * 1000
+        with self._lock:
+            wait = 0
+            for key, cap, rate in buckets:
+                tokens, ts = self._b.get(key) or (cap, now_ms)
+                tokens = min(cap, tokens + (now_ms - ts) * rate)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+                self._b[key] = (tokens, now_ms)
+                self._b.move_to_end(key)
+            if wait:
+                self.rejected += 1
+                return wait
+            for key, _, _ in buckets:
+                tokens, ts = self._b[key]
+                self._b[key] = (tokens - 1, ts)
+            while len(self._b) > self.max_keys:
+                self._b.popitem(last=False)
+            return 0
+
+_local = None
+
+def prefilter(buckets):
+    """Reject from the process-local tier only; raises RateLimited without any store call."""
+    global _local
+    if not buckets or not current_app.config.get('RATE_LIMIT_LOCAL', True):
+        return
+    if _local is None:
+        _local = _LocalBuckets(current_app.config.get('RATE_LIMIT_LOCAL_MAX_KEYS', 100_000))
+    wait = _local.take(buckets)
+    if wait:
+        raise RateLimited(wait / 1000)
+
+def check_rate(buckets):
+    prefilter(buckets)
+    wait = r().take_tokens(buckets)
+    if wait:
+        raise RateLimited(wait / 1000)
+
+def check_rate_ip(ip: str):
+    check_rate(buckets_for(ip=ip))
+
+def local_stats() -> dict:
+    return {'keys': len(_local._b), 'rejected': _local.rejected} if _local else {'keys': 0, 'rejected': 0}
 
 # anti-replay jti
 
@@ -97,3 +379,15 @@ def save_session(code_id: int, device_id: str, jti: str, exp_ts: int):
 def load_session(code_id: int):
     raw = r().get(f"sess:{code_id}")
     return json.loads(raw) if raw else None
+
+# redeem hot path: one round trip
+
+def redeem_writes(code_id: int, device_id: str, jti: str, exp_ts: int, jti_ttl: int) -> list:
+    """(key, ttl, value) for the session and jti keys written by a successful redeem."""
+    sess_ttl = max(1, exp_ts - int(time.time()) + 60)
+    sess = json.dumps({'device_id': device_id, 'jti': jti, 'exp': exp_ts})
+    return [(f"sess:{code_id}", sess_ttl, sess), (f"jti:{jti}", jti_ttl, '1')]
+
+def redeem_txn(code_id: int, device_id: str, jti: str, exp_ts: int, jti_ttl: int):
+    """save_session + remember_jti as a single atomic store call."""
+    r().take_tokens((), redeem_writes(code_id, device_id, jti, exp_ts, jti_ttl))
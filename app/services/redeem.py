@@ -1,43 +1,136 @@
-import time, uuid
+import time, uuid, math
 from flask import request, jsonify
 from .tokens import resolve_opaque, sign_access_jwt
-from .rate_limit import check_rate_ip, save_session, remember_jti
-from ..models import db, Code, Redemption, Product, Content
+from .rate_limit import redeem_txn, check_rate, buckets_for, RateLimited
+from .catalog import product_terms
+from .expiry import utc_ts
+from .metrics import span
+from . import audit
+from ..models import db, Code, Redemption
 
+# The redeem flow is split into framework-neutral steps so the WSGI view below
+# and the ASGI app (app/asgi.py) run the same checks around their own DB/store I/O.
 
-def do_redeem():
-    data = request.get_json() or {}
-    opaque = data.get('opaque')
-    device_id = data.get('device_id')
-    ip = request.remote_addr or '0.0.0.0'
-    check_rate_ip(ip)
+class RedeemError(Exception):
+    def __init__(self, error: str, status: int):
+        super().__init__(error)
+        self.error = error
+        self.status = status
 
-    code_id, merchant_id, ts = resolve_opaque(opaque)
-    code = Code.query.get(code_id)
-    if not code or code.status != 'issued':
-        return jsonify({'error': 'invalid_code'}), 400
+def resolve(opaque: str):
+    """Opaque token check; returns (code_id, merchant_id)."""
+    try:
+        with span('resolve_opaque'):
+            code_id, merchant_id, ts = resolve_opaque(opaque)
+    except (ValueError, TypeError):
+        raise RedeemError('invalid_code', 400)
+    return code_id, merchant_id
 
-    red = Redemption.query.filter_by(code_id=code.id).first()
-    if red is None:
-        red = Redemption(code_id=code.id, device_id=device_id, ip_first=ip, user_agent_first=request.headers.get('User-Agent'))
-        db.session.add(red)
-    elif red.device_id != device_id:
-        return jsonify({'error': 'device_mismatch'}), 403
+def admission(opaque: str, ip: str):
+    """(code_id, merchant_id), or None for a bad token, and the buckets the attempt is charged to.
 
-    prod = Product.query.get(code.product_id)
-    content = Content.query.get(prod.content_id)
+    The opaque check is local HMAC work, so it runs first: a good token is charged
+    to its ip, merchant and code buckets in one store call, a bad one to its ip only.
+    """
+    try:
+        code_id, merchant_id = resolve(opaque)
+    except RedeemError:
+        return None, buckets_for(ip=ip)
+    return (code_id, merchant_id), buckets_for(ip=ip, merchant_id=merchant_id, code_id=code_id)
 
-    duration_min = code.duration_min or prod.default_duration_min
+def admit(opaque: str, ip: str):
+    """Both rate tiers and the opaque token check; returns (code_id, merchant_id)."""
+    # Every attempt pays the shared buckets before any DB or signing work, so bad
+    # tokens, unknown codes and device mismatches count against the limit across
+    # workers. The local tier still turns obvious floods away without a store call.
+    ids, buckets = admission(opaque, ip)
+    check_rate(buckets)
+    if ids is None:
+        raise RedeemError('invalid_code', 400)
+    return ids
+
+def check_code(code, red, device_id: str):
+    if code is not None and code.status == 'void':
+        # Revoked by an admin (or a pool code that never left the server)
+        raise RedeemError('code_revoked', 403)
+    if not code or code.status not in ('issued', 'expired'):
+        raise RedeemError('invalid_code', 400)
+    # The sweeper flips status in the background; expires_at is what counts
+    if code.status == 'expired' or (code.expires_at is not None and utc_ts(code.expires_at) <= time.time()):
+        raise RedeemError('code_expired', 410)
+    if red is not None and red.device_id != device_id:
+        raise RedeemError('device_mismatch', 403)
+
+def grant(code, terms, device_id: str, ip: str) -> dict:
+    """Sign the access token for a valid code; the caller persists session, jti and redemption."""
+    if terms is None:
+        raise RedeemError('invalid_code', 400)
+    content_id, default_duration_min = terms
+    duration_min = code.duration_min or default_duration_min
     exp_ts = int(time.time()) + duration_min * 60
     jti = uuid.uuid4().hex
+    return {
+        'token': sign_access_jwt(code.id, jti, exp_ts, code.merchant_id, device_id, content_id),
+        'jti': jti,
+        'exp_ts': exp_ts,
+        'jti_ttl': duration_min * 60 + 60,
+        'content_id': content_id,
+    }
 
-    token = sign_access_jwt(code.id, jti, exp_ts, code.merchant_id, device_id, content.id)
-    save_session(code.id, device_id, jti, exp_ts)
-    remember_jti(jti, duration_min * 60 + 60)
+def new_redemption(code_id: int, device_id: str, ip: str, user_agent: str|None):
+    return Redemption(code_id=code_id, device_id=device_id, ip_first=ip, user_agent_first=user_agent)
 
+def mark_redeemed(red, jti: str):
     red.first_redeemed_at = red.first_redeemed_at or db.func.now()
     red.last_seen_at = db.func.now()
     red.access_jwt_id = jti
-    db.session.commit()
 
-    return jsonify({'token': token, 'expires_at': exp_ts, 'content_id': content.id})
+def audit_redeemed(code, g: dict, device_id: str, ip: str):
+    # Queued for the background audit writer; never adds a DB round trip to the request
+    audit.record('device', device_id, 'redeem', {'code_id': code.id, 'merchant_id': code.merchant_id,
+                                                 'jti': g['jti'], 'exp_ts': g['exp_ts'], 'ip': ip})
+
+def response_body(g: dict) -> dict:
+    return {'token': g['token'], 'expires_at': g['exp_ts'], 'content_id': g['content_id']}
+
+def rate_limited_headers(e: RateLimited) -> dict:
+    return {'Retry-After': str(max(1, math.ceil(e.retry_after)))}
+
+def do_redeem():
+    try:
+        return _redeem()
+    except RedeemError as e:
+        db.session.rollback()
+        return jsonify({'error': e.error}), e.status
+    except RateLimited as e:
+        db.session.rollback()
+        return jsonify({'error': 'rate_limited'}), 429, rate_limited_headers(e)
+
+def _redeem():
+    data = request.get_json() or {}
+    device_id = data.get('device_id')
+    ip = request.remote_addr or '0.0.0.0'
+    code_id, merchant_id = admit(data.get('opaque'), ip)
+
+    # Code and its redemption in a single round trip
+    with span('db.code_lookup'):
+        row = (db.session.query(Code, Redemption)
+               .outerjoin(Redemption, Redemption.code_id == Code.id)
+               .filter(Code.id == code_id).first())
+    code, red = row if row else (None, None)
+    check_code(code, red, device_id)
+    if red is None:
+        red = new_redemption(code.id, device_id, ip, request.headers.get('User-Agent'))
+        db.session.add(red)
+
+    g = grant(code, product_terms(code.product_id), device_id, ip)
+    # Session and jti in one store round trip. It cannot share admit()'s call: the
+    # buckets must be charged before the lookup, and these keys only once it passed.
+    redeem_txn(code.id, device_id, g['jti'], g['exp_ts'], g['jti_ttl'])
+
+    mark_redeemed(red, g['jti'])
+    with span('db.commit'):
+        db.session.commit()
+    audit_redeemed(code, g, device_id, ip)
+
+    return jsonify(response_body(g))
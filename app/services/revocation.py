@@ -0,0 +1,210 @@
+import os, time, threading
+from collections import OrderedDict
+import redis
+from flask import current_app
+from sqlalchemy import update
+from ..models import db, Code, Redemption
+from . import rate_limit
+from .breaker import ManagedStore, StoreUnavailable
+
+# Per-worker cache of jtis the store has confirmed live, so repeated content
+# requests with the same token skip the EXISTS round trip. An entry lives until
+# the token's exp (capped at JTI_CACHE_MAX_AGE_S). Revocations are published on
+# REVOKE_CHANNEL and every worker's subscriber evicts the jti at once; while the
+# subscriber is not connected the cache is bypassed, since messages may be lost.
+# With the memory store there are no other workers to tell: revoke() evicts locally.
+#
+# Each eviction also leaves a tombstone for SEGMENT_TOKEN_TTL_S, the longest a
+# playback token minted before the revocation can live, so HLS requests can
+# refuse a revoked jti without a store round trip.
+
+class _LiveJtis:
+    def __init__(self, max_keys: int, max_age: int, tombstone_s: int = 120):
+        self.max_keys = max_keys
+        self.max_age = max_age
+        self.tombstone_s = tombstone_s
+        self.generation = 0     # bumped by every eviction; guards against caching a jti revoked mid-lookup
+        self._data = OrderedDict()  # jti -> expiry (epoch seconds)
+        self._revoked = OrderedDict()   # jti -> tombstone expiry (epoch seconds), oldest first
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'revocations': 0}
+
+    def get(self, jti: str) -> bool:
+        exp = self._data.get(jti)
+        if exp is not None and exp > time.time():
+            self.stats['hits'] += 1
+            return True
+        self.stats['misses'] += 1
+        return False
+
+    def put(self, jti: str, exp_ts: int|None, generation: int):
+        until = time.time() + self.max_age
+        if exp_ts is not None:
+            until = min(until, exp_ts)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._data[jti] = until
+            self._data.move_to_end(jti)
+            while len(self._data) > self.max_keys:
+                self._data.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def discard(self, jti: str):
+        now = time.time()
+        with self._lock:
+            self.generation += 1
+            self._data.pop(jti, None)
+            self.stats['revocations'] += 1
+            self._revoked[jti] = now + self.tombstone_s
+            self._revoked.move_to_end(jti)
+            while self._revoked and (len(self._revoked) > self.max_keys
+                                     or next(iter(self._revoked.values())) <= now):
+                self._revoked.popitem(last=False)
+
+    def revoked(self, jti: str) -> bool:
+        until = self._revoked.get(jti)
+        return until is not None and until > time.time()
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+_cache = None
+_lock = threading.Lock()
+_sub = {'pid': None, 'connected': False, 'reconnects': 0}
+
+def _live() -> _LiveJtis:
+    global _cache
+    if _cache is None:
+        cfg = current_app.config
+        with _lock:
+            if _cache is None:
+                _cache = _LiveJtis(cfg.get('JTI_CACHE_SIZE', 100_000), cfg.get('JTI_CACHE_MAX_AGE_S', 300),
+                                   cfg.get('SEGMENT_TOKEN_TTL_S', 120))
+    return _cache
+
+def _uses_redis() -> bool:
+    return isinstance(rate_limit.r(), ManagedStore)
+
+def _subscriber_client(cfg):
+    # Dedicated connection without a read timeout: it blocks in get_message()
+    return redis.Redis.from_url(cfg['REDIS_URL'], decode_responses=True,
+                                socket_connect_timeout=cfg.get('REDIS_CONNECT_TIMEOUT', 0.25),
+                                health_check_interval=30)
+
+def _listen(cfg, cache: _LiveJtis, fallback):
+    channel, retry = cfg.get('REVOKE_CHANNEL', 'jti:revoked'), cfg.get('REDIS_RECOVERY_INTERVAL_S', 2.0)
+    while True:
+        try:
+            pubsub = _subscriber_client(cfg).pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(channel)
+            _sub['connected'] = True
+            while True:
+                msg = pubsub.get_message(timeout=1.0)
+                if msg and msg['type'] == 'message':
+                    cache.discard(msg['data'])
+                    # A copy written here during an outage would outlive the revocation
+                    fallback.delete(f"jti:{msg['data']}")
+        except redis.RedisError:
+            pass
+        # Anything published while disconnected is lost: start over empty
+        _sub['connected'] = False
+        _sub['reconnects'] += 1
+        cache.clear()
+        time.sleep(retry)
+
+def _usable() -> bool:
+    """Whether cached entries can be trusted in this worker right now."""
+    if not _uses_redis():
+        return True
+    if _sub['pid'] != os.getpid():
+        # The subscriber thread does not survive a fork (gunicorn preload_app)
+        with _lock:
+            if _sub['pid'] != os.getpid():
+                _sub.update(pid=os.getpid(), connected=False)
+                cache = _live()
+                cache.clear()
+                threading.Thread(target=_listen, args=(current_app.config, cache, rate_limit.r().fallback),
+                                 name='jti-revocations', daemon=True).start()
+    return _sub['connected']
+
+def lookup(jti: str):
+    """(live, generation): live is True on a trusted cache hit; pass generation to remember()."""
+    cache = _live()
+    if _usable() and cache.get(jti):
+        return True, cache.generation
+    return False, cache.generation
+
+def remember(jti: str, exp_ts: int|None, generation: int):
+    if _usable():
+        _live().put(jti, exp_ts, generation)
+
+def revoked_recently(jti: str) -> bool:
+    """Whether this worker saw jti revoked within the last SEGMENT_TOKEN_TTL_S; no store round trip.
+
+    Revocations published while the subscriber was disconnected are missed, so
+    those tokens run until their own exp, SEGMENT_TOKEN_TTL_S at most.
+    """
+    _usable()   # make sure this worker is subscribed
+    return _live().revoked(jti)
+
+def is_live(jti: str, exp_ts: int|None = None) -> bool:
+    """Cached rate_limit.has_jti for a token expiring at exp_ts."""
+    live, gen = lookup(jti)
+    if live:
+        return True
+    if rate_limit.has_jti(jti):
+        remember(jti, exp_ts, gen)
+        return True
+    return False
+
+def void_code(code_id: int|None = None, jti: str|None = None) -> int|None:
+    """Set the code behind a revoked token to 'void' so it cannot be redeemed again; returns its id.
+
+    Without code_id the code is found from the redemption that last received jti.
+    """
+    if code_id is None and jti:
+        code_id = db.session.query(Redemption.code_id).filter(Redemption.access_jwt_id == jti).scalar()
+    if code_id is None:
+        return None
+    n = db.session.execute(update(Code).where(Code.id == code_id).values(status='void')).rowcount
+    db.session.commit()
+    return code_id if n else None
+
+def revoke(jti: str) -> bool:
+    """Delete the jti from the store and evict it from every worker's cache.
+
+    With Redis, the delete must reach the primary: while it is unreachable the
+    revocation is refused with StoreUnavailable rather than applied to this
+    worker's fallback only, where it would be undone by the recovery.
+    """
+    store = rate_limit.r()
+    key = f"jti:{jti}"
+    if not isinstance(store, ManagedStore):
+        existed = bool(store.delete(key))
+        _live().discard(jti)
+        return existed
+    if store.is_open:
+        raise StoreUnavailable('redis unreachable, revocation not applied')
+    try:
+        existed = bool(store.primary.delete(key))
+    except redis.RedisError as e:
+        raise StoreUnavailable('redis unreachable, revocation not applied') from e
+    # Keys written during a Redis outage live on in the fallback too
+    existed = bool(store.fallback.delete(key)) or existed
+    _live().discard(jti)
+    try:
+        store.primary.publish(current_app.config.get('REVOKE_CHANNEL', 'jti:revoked'), jti)
+    except redis.RedisError:
+        pass
+    return existed
+
+def stats() -> dict:
+    cache = _live()
+    return {**cache.stats, 'size': len(cache), 'subscribed': _sub['connected'],
+            'reconnects': _sub['reconnects'], 'mode': 'redis' if _uses_redis() else 'local'}
@@ -1,4 +1,236 @@
-from flask import Response
+import os, hashlib, threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit, unquote
+from flask import Response, current_app
+from werkzeug.http import parse_range_header, parse_etags, parse_if_range_header, quote_etag, http_date
+from werkzeug.wsgi import wrap_file
+
+# Content.url_or_blob_ref resolved through per-scheme backends (file://, s3://,
+# http(s):// proxied from the origin).
+# Bodies are streamed in CHUNK-sized pieces, or handed to the server's
+# wsgi.file_wrapper (sendfile under gunicorn) for local files, so memory per
+# request does not depend on blob size.
+
+CHUNK = 64 * 1024
+
+class BlobNotFound(LookupError):
+    pass
+
+class StorageError(RuntimeError):
+    pass
+
+class FileStorage:
+    """file:///abs/path refs; optionally confined to STORAGE_FILE_ROOT."""
+
+    def __init__(self, root: str|None = None):
+        self.root = os.path.realpath(root) if root else None
+
+    def local_path(self, key: str) -> str:
+        path = os.path.realpath(key)
+        if self.root and os.path.commonpath([self.root, path]) != self.root:
+            raise BlobNotFound(key)
+        return path
+
+    def stat(self, key: str):
+        """(size, etag, mtime) of a blob."""
+        try:
+            st = os.stat(self.local_path(key))
+        except (FileNotFoundError, NotADirectoryError):
+            raise BlobNotFound(key)
+        return st.st_size, f"{st.st_mtime_ns:x}-{st.st_size:x}", st.st_mtime
+
+    def open_file(self, key: str):
+        return open(self.local_path(key), 'rb')
+
+    def read_chunks(self, key: str, start: int, length: int):
+        with self.open_file(key) as f:
+            f.seek(start)
+            while length > 0:
+                buf = f.read(min(CHUNK, length))
+                if not buf:
+                    return
+                length -= len(buf)
+                yield buf
+
+class S3Storage:
+    """s3://bucket/key refs through boto3; S3_ENDPOINT_URL points it at MinIO or another S3-compatible store."""
+
+    def __init__(self, endpoint_url: str|None = None, region: str|None = None):
+        import boto3
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None, region_name=region or None)
+
+    @staticmethod
+    def _split(key: str):
+        bucket, _, name = key.partition('/')
+        return bucket, name
+
+    def stat(self, key: str):
+        from botocore.exceptions import ClientError
+        bucket, name = self._split(key)
+        try:
+            head = self.client.head_object(Bucket=bucket, Key=name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                raise BlobNotFound(key)
+            raise StorageError(str(e))
+        return head['ContentLength'], head['ETag'].strip('"'), head['LastModified'].timestamp()
+
+    def read_chunks(self, key: str, start: int, length: int):
+        if length <= 0:
+            return
+        bucket, name = self._split(key)
+        obj = self.client.get_object(Bucket=bucket, Key=name, Range=f"bytes={start}-{start + length - 1}")
+        body = obj['Body']
+        try:
+            yield from body.iter_chunks(CHUNK)
+        finally:
+            body.close()
+
+class HttpStorage:
+    """http(s):// refs proxied from the origin: HEAD for size and validators, ranged GETs for the body."""
+
+    def __init__(self, timeout: float = 5.0):
+        import requests
+        self.requests = requests
+        self.session = requests.Session()
+        self.timeout = timeout
+
+    def stat(self, key: str):
+        try:
+            resp = self.session.head(key, allow_redirects=True, timeout=self.timeout)
+        except self.requests.RequestException as e:
+            raise StorageError(str(e))
+        if resp.status_code in (404, 410):
+            raise BlobNotFound(key)
+        length = resp.headers.get('Content-Length')
+        if resp.status_code >= 400 or length is None:
+            raise StorageError(f"origin answered HEAD {resp.status_code}" + ('' if length else ' without a length'))
+        size = int(length)
+        modified = resp.headers.get('Last-Modified')
+        mtime = parsedate_to_datetime(modified).timestamp() if modified else None
+        etag = (resp.headers.get('ETag') or '').removeprefix('W/').strip('"')
+        if not etag:
+            etag = hashlib.sha256(f"{key}|{size}|{modified}".encode()).hexdigest()[:16]
+        return size, etag, mtime
+
+    def read_chunks(self, key: str, start: int, length: int):
+        if length <= 0:
+            return
+        try:
+            resp = self.session.get(key, headers={'Range': f"bytes={start}-{start + length - 1}"},
+                                    stream=True, timeout=self.timeout)
+        except self.requests.RequestException as e:
+            raise StorageError(str(e))
+        with resp:
+            if resp.status_code not in (200, 206):
+                raise StorageError(f"origin answered GET {resp.status_code}")
+            # An origin that ignores Range sends the whole body: skip up to the window
+            skip = start if resp.status_code == 200 else 0
+            for buf in resp.iter_content(CHUNK):
+                if skip:
+                    cut = min(skip, len(buf))
+                    buf, skip = buf[cut:], skip - cut
+                if not buf:
+                    continue
+                buf = buf[:length]
+                length -= len(buf)
+                yield buf
+                if length <= 0:
+                    return
+
+_FACTORIES = {
+    'file': lambda cfg: FileStorage(cfg.get('STORAGE_FILE_ROOT')),
+    's3': lambda cfg: S3Storage(cfg.get('S3_ENDPOINT_URL'), cfg.get('S3_REGION')),
+    'http': lambda cfg: HttpStorage(cfg.get('STORAGE_HTTP_TIMEOUT_S', 5.0)),
+    'https': lambda cfg: HttpStorage(cfg.get('STORAGE_HTTP_TIMEOUT_S', 5.0)),
+}
+_backends = {}
+_lock = threading.Lock()
+
+def register_backend(scheme: str, factory):
+    """factory(config) -> backend with stat/read_chunks (and open_file for local files)."""
+    with _lock:
+        _FACTORIES[scheme] = factory
+        _backends.pop(scheme, None)
+
+def resolve(ref: str):
+    """(backend, key) for a blob ref."""
+    parts = urlsplit(ref)
+    scheme = parts.scheme or 'file'
+    backend = _backends.get(scheme)
+    if backend is None:
+        if scheme not in _FACTORIES:
+            raise StorageError(f"unsupported scheme: {scheme}")
+        with _lock:
+            backend = _backends.get(scheme)
+            if backend is None:
+                backend = _backends[scheme] = _FACTORIES[scheme](current_app.config)
+    if scheme == 'file':
+        key = unquote(parts.path)
+    elif scheme in ('http', 'https'):
+        key = ref
+    else:
+        key = parts.netloc + unquote(parts.path)
+    return backend, key
+
+def plan(ref: str, if_none_match: str|None = None, range_header: str|None = None, if_range: str|None = None) -> dict:
+    """Status, headers and byte window for serving a blob; shared by the WSGI and ASGI routes."""
+    backend, key = resolve(ref)
+    return plan_for(backend, key, if_none_match, range_header, if_range)
+
+def plan_for(backend, key: str, if_none_match: str|None = None, range_header: str|None = None,
+             if_range: str|None = None) -> dict:
+    size, etag, mtime = backend.stat(key)
+    headers = {'ETag': quote_etag(etag), 'Accept-Ranges': 'bytes', 'Cache-Control': 'private, no-cache'}
+    if mtime is not None:
+        headers['Last-Modified'] = http_date(mtime)
+    if if_none_match and parse_etags(if_none_match).contains_weak(etag):
+        return {'status': 304, 'headers': headers, 'backend': backend, 'key': key, 'start': 0, 'length': 0, 'size': size}
+    start, length, status = 0, size, 200
+    rng = parse_range_header(range_header) if range_header else None
+    if rng is not None and len(rng.ranges) == 1 and _if_range_ok(if_range, etag):
+        window = rng.range_for_length(size)
+        if window is None:
+            headers['Content-Range'] = f"bytes */{size}"
+            return {'status': 416, 'headers': headers, 'backend': backend, 'key': key, 'start': 0, 'length': 0, 'size': size}
+        start, stop = window
+        length, status = stop - start, 206
+        headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+    headers['Content-Length'] = str(length)
+    return {'status': status, 'headers': headers, 'backend': backend, 'key': key, 'start': start, 'length': length, 'size': size}
+
+def _if_range_ok(if_range: str|None, etag: str) -> bool:
+    if not if_range:
+        return True
+    parsed = parse_if_range_header(if_range)
+    return parsed.etag == etag and not parsed.date
+
+def body_chunks(p: dict):
+    """Bounded-chunk iterator over the planned window."""
+    if p['length'] <= 0:
+        return iter(())
+    return p['backend'].read_chunks(p['key'], p['start'], p['length'])
+
+def send_blob(ref: str, mimetype: str|None, request) -> Response:
+    """Flask response for a blob, honouring If-None-Match and a single Range."""
+    return send_from(*resolve(ref), mimetype, request)
+
+def send_from(backend, key: str, mimetype: str|None, request) -> Response:
+    p = plan_for(backend, key, request.headers.get('If-None-Match'), request.headers.get('Range'),
+                 request.headers.get('If-Range'))
+    headers = p['headers']
+    if p['status'] in (304, 416):
+        return Response(status=p['status'], headers=headers)
+    open_file = getattr(p['backend'], 'open_file', None)
+    if open_file is not None and p['start'] + p['length'] == p['size']:
+        # The window runs to EOF, so the server's file wrapper (sendfile) sends exactly Content-Length bytes
+        f = open_file(p['key'])
+        f.seek(p['start'])
+        body = wrap_file(request.environ, f, CHUNK)
+    else:
+        body = body_chunks(p)
+    return Response(body, status=p['status'], headers=headers,
+                    mimetype=mimetype or 'application/octet-stream', direct_passthrough=True)
 
 def stream_bytes(iterable, headers: dict):
     return Response(iterable, headers=headers)
@@ -1,28 +1,127 @@
-import time, jwt, hmac, hashlib, base64
+import re, time, jwt, hmac, hashlib, base64, threading
+from collections import OrderedDict
 from flask import current_app
+from . import keyring
+from .metrics import span
 
 # Opaque QR token (HMAC)
+#
+# v1 (default): base32(version | varint code_id | varint merchant_id | varint minutes
+# since OPAQUE_EPOCH | HMAC-SHA256[:OPAQUE_MAC_BYTES]). Base32 stays inside the QR
+# alphanumeric charset, so the token is encoded at 5.5 bits/char instead of 8, and
+# the whole token is ~29 chars instead of ~67.
+# legacy: urlsafe_b64("{code_id}.{merchant_id}.{ts}" + full 32-byte HMAC); still accepted.
+OPAQUE_V1 = 1
+OPAQUE_EPOCH = 1704067200  # 2024-01-01T00:00:00Z
+_B32 = re.compile(r'[A-Za-z2-7]+')
+_B32_DIGITS = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ234567', '0123456789ABCDEFGHIJKLMNOPQRSTUV')
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+def _read_varint(data: bytes, pos: int):
+    n = shift = 0
+    while True:
+        if pos >= len(data) or shift > 63:
+            raise ValueError('truncated')
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return n, pos
+        shift += 7
+
+def _mac_bytes() -> int:
+    return min(32, max(8, int(current_app.config.get('OPAQUE_MAC_BYTES', 10))))
+
 def make_opaque(code_id: int, merchant_id: int, ts: int|None=None) -> str:
     if ts is None:
         ts = int(time.time())
-    msg = f"{code_id}.{merchant_id}.{ts}".encode()
     secret = current_app.config['MERCHANT_SALT'].encode()
-    sig = hmac.new(secret, msg, hashlib.sha256).digest()
-    return base64.urlsafe_b64encode(msg + sig).rstrip(b'=').decode()
+    if current_app.config.get('OPAQUE_FORMAT', 'v1') == 'legacy':
+        msg = f"{code_id}.{merchant_id}.{ts}".encode()
+        sig = hmac.new(secret, msg, hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(msg + sig).rstrip(b'=').decode()
+    body = bytes([OPAQUE_V1]) + _varint(code_id) + _varint(merchant_id) + _varint(max(0, ts - OPAQUE_EPOCH) // 60)
+    sig = hmac.digest(secret, body, 'sha256')[:_mac_bytes()]
+    return base64.b32encode(body + sig).rstrip(b'=').decode()
+
+def _resolve_v1(token: str, secret: bytes):
+    # base32 -> int via the base32hex digit set, which int() parses in C
+    bits = len(token) * 5
+    pad = bits % 8
+    n = int(token.upper().translate(_B32_DIGITS), 32)
+    if n & ((1 << pad) - 1):
+        raise ValueError('non-canonical')
+    data = (n >> pad).to_bytes(bits // 8, 'big')
+    if not data or data[0] != OPAQUE_V1:
+        raise ValueError('not v1')
+    code_id, pos = _read_varint(data, 1)
+    merchant_id, pos = _read_varint(data, pos)
+    minutes, pos = _read_varint(data, pos)
+    body, sig = data[:pos], data[pos:]
+    # Longer MACs than OPAQUE_MAC_BYTES (issued before it was lowered) still verify
+    if len(sig) < _mac_bytes() or not hmac.compare_digest(sig, hmac.digest(secret, body, 'sha256')[:len(sig)]):
+        raise ValueError('bad signature')
+    return code_id, merchant_id, OPAQUE_EPOCH + minutes * 60
 
-def resolve_opaque(b64: str):
+def _resolve_legacy(b64: str, secret: bytes):
     data = base64.urlsafe_b64decode(b64 + '==')
     msg, sig = data[:-32], data[-32:]
-    secret = current_app.config['MERCHANT_SALT'].encode()
     exp_sig = hmac.new(secret, msg, hashlib.sha256).digest()
     if not hmac.compare_digest(sig, exp_sig):
         raise ValueError('bad signature')
     parts = msg.decode().split('.')
-    code_id, merchant_id, ts = int(parts[0]), int(parts[1]), int(parts[2])
-    if time.time() - ts > 86400:
+    return int(parts[0]), int(parts[1]), int(parts[2])
+
+def resolve_opaque(token: str):
+    secret = current_app.config['MERCHANT_SALT'].encode()
+    decoded = None
+    if _B32.fullmatch(token):
+        try:
+            decoded = _resolve_v1(token, secret)
+        except ValueError:
+            decoded = None
+    if decoded is None:
+        decoded = _resolve_legacy(token, secret)
+    code_id, merchant_id, ts = decoded
+    if time.time() - ts > current_app.config.get('OPAQUE_MAX_AGE_S', 86400):
         raise ValueError('stale')
     return code_id, merchant_id, ts
 
+# Playback token (HMAC) for HLS playlists and segments: one access JWT check buys
+# SEGMENT_TOKEN_TTL_S of segment fetches, each verified with a single HMAC. The
+# token carries the access jti, so revoking it also stops the segment tokens
+# minted from it (see revocation.revoked_recently).
+def _segment_key() -> bytes:
+    cfg = current_app.config
+    return (cfg.get('SEGMENT_TOKEN_KEY') or f"segment:{cfg['SECRET_KEY']}").encode()
+
+def make_segment_token(content_id: int, exp_ts: int, jti: str) -> str:
+    msg = f"{content_id}.{exp_ts}.{jti}"
+    sig = hmac.new(_segment_key(), msg.encode(), hashlib.sha256).digest()[:16]
+    return f"{msg}.{base64.urlsafe_b64encode(sig).rstrip(b'=').decode()}"
+
+def check_segment_token(token: str, content_id: int) -> str|None:
+    """The access jti when token was minted for content_id and has not expired, else None."""
+    try:
+        cid, exp_ts, jti, sig = token.split('.')
+        if int(cid) != content_id or int(exp_ts) < time.time():
+            return None
+        got = base64.urlsafe_b64decode(sig + '==')
+    except (ValueError, AttributeError):
+        return None
+    want = hmac.new(_segment_key(), f"{cid}.{exp_ts}.{jti}".encode(), hashlib.sha256).digest()[:16]
+    return jti if hmac.compare_digest(got, want) else None
+
 # Access JWT (RS256)
 def sign_access_jwt(sub_code_id: int, jti: str, exp_ts: int, merchant_id: int, device_id: str, content_id: int) -> str:
     payload = {
@@ -33,5 +132,69 @@ def sign_access_jwt(sub_code_id: int, jti: str, exp_ts: int, merchant_id: int, d
         'device_id': device_id,
         'content_id': content_id,
     }
-    key = current_app.config['JWT_PRIVATE_KEY']
-    return jwt.encode(payload, key, algorithm=current_app.config['JWT_ALG'])
+    with span('sign_access_jwt'):
+        kid, key = keyring.signing_key()
+        return jwt.encode(payload, key, algorithm=current_app.config['JWT_ALG'], headers={'kid': kid})
+
+class _VerifiedTokens:
+    """Bounded LRU of already-verified token payloads keyed by sha256(token), valid until exp."""
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: bytes, now: float):
+        with self._lock:
+            hit = self._items.get(digest)
+            if hit is None:
+                self.misses += 1
+                return None
+            if hit[0] <= now:
+                del self._items[digest]
+                raise jwt.ExpiredSignatureError('Signature has expired')
+            self._items.move_to_end(digest)
+            self.hits += 1
+            return hit[1]
+
+    def put(self, digest: bytes, exp: float, payload: dict):
+        with self._lock:
+            self._items[digest] = (exp, payload)
+            self._items.move_to_end(digest)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+_verified = None
+_verified_gen = 0
+
+def verify_access_jwt(token: str) -> dict:
+    """Decode and verify an access JWT; repeat presentations skip the signature check until exp."""
+    global _verified, _verified_gen
+    if _verified is None:
+        _verified = _VerifiedTokens(current_app.config.get('JWT_VERIFY_CACHE_SIZE', 10000))
+    # A key ring reload may have retired a key: drop everything verified under the old ring
+    gen = keyring.current().generation
+    if gen != _verified_gen:
+        _verified.clear()
+        _verified_gen = gen
+    digest = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+    payload = _verified.get(digest, now)
+    if payload is None:
+        key = keyring.verification_key(jwt.get_unverified_header(token).get('kid'))
+        if key is None:
+            raise jwt.InvalidTokenError('unknown kid')
+        payload = jwt.decode(token, key, algorithms=[current_app.config.get('JWT_ALG', 'RS256')])
+        if 'exp' in payload:
+            _verified.put(digest, float(payload['exp']), payload)
+    return dict(payload)
@@ -1,4 +1,4 @@
-import multiprocessing
+import os, glob, multiprocessing
 
 # Sensible defaults for a small dyno/container; tune as needed
 workers = int((multiprocessing.cpu_count() * 2) + 1)
@@ -16,3 +16,34 @@ keepalive = 75
 accesslog = "-"
 errorlog = "-"
 loglevel = "info"
+
+# Prometheus multiprocess mode (see app/services/metrics.py): start from an empty
+# PROMETHEUS_MULTIPROC_DIR and drop the live gauges of workers that exit.
+def on_starting(server):
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for f in glob.glob(os.path.join(path, '*.db')):
+            os.remove(f)
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+# Start the worker's code pool and decode processes as soon as it is forked, so
+# the first issue-qr or upload does not pay for a cold pool
+def post_fork(server, worker):
+    from app.services import code_pool, decode
+    app = worker.app.wsgi()
+    code_pool.warm(app)
+    decode.warm(app)
+
+# Void unissued pool codes and drain queued webhook events, audit rows and last_seen
+# touches before a worker goes away
+def worker_exit(server, worker):
+    from app.services import audit, last_seen, payments, code_pool
+    code_pool.shutdown()
+    payments.shutdown()
+    audit.shutdown()
+    last_seen.shutdown()
@@ -0,0 +1,34 @@
+import os, glob, multiprocessing
+
+# ASGI profile: gunicorn supervises uvicorn workers running app.asgi.
+#   gunicorn -c gunicorn_asgi.conf.py 'app.asgi:create_asgi_app()'
+# Each worker is a single event loop, so slow clients and long polls on
+# /api/content no longer hold a thread that /api/redeem needs.
+workers = int(multiprocessing.cpu_count() + 1)
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+bind = ":8000"
+# Heroku/Render style proxy headers
+forwarded_allow_ips = "*"
+# Keep-alive tuning
+timeout = 60
+keepalive = 75
+graceful_timeout = 30
+# Access logging
+accesslog = "-"
+errorlog = "-"
+loglevel = "info"
+
+# Prometheus multiprocess mode (see app/services/metrics.py): start from an empty
+# PROMETHEUS_MULTIPROC_DIR and drop the live gauges of workers that exit.
+def on_starting(server):
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for f in glob.glob(os.path.join(path, '*.db')):
+            os.remove(f)
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
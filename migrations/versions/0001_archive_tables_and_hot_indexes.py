@@ -0,0 +1,94 @@
+"""archive tables and hot-path indexes
+
+Revision ID: 0001_archive
+Revises:
+Create Date: 2026-10-18 12:00:00
+
+Tables are created by db.create_all() at startup, so every operation here is
+guarded: it only runs when the table or an index on the same columns is missing.
+On PostgreSQL the indexes are built CONCURRENTLY to avoid locking code/redemption.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_archive'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Every one of these is also declared on the models (index=True), so create_all
+# builds them on fresh databases; the migration adds them to existing ones.
+INDEXES = [
+    ('ix_redemption_code_id', 'redemption', ['code_id']),
+    ('ix_code_status', 'code', ['status']),
+    ('ix_code_expires_at', 'code', ['expires_at']),
+    ('ix_code_batch_id', 'code', ['batch_id']),
+    ('ix_redemption_archive_code_id', 'redemption_archive', ['code_id']),
+]
+
+
+def _has_table(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def _has_index(table, columns):
+    return any(ix['column_names'] == columns for ix in sa.inspect(op.get_bind()).get_indexes(table))
+
+
+def _create_index(name, table, columns):
+    if not _has_table(table) or _has_index(table, columns):
+        return
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+    else:
+        op.create_index(name, table, columns)
+
+
+def upgrade():
+    if not _has_table('code_archive'):
+        op.create_table(
+            'code_archive',
+            sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=False),
+            sa.Column('merchant_id', sa.Integer()),
+            sa.Column('product_id', sa.Integer()),
+            sa.Column('code_hash', sa.Text(), nullable=False),
+            sa.Column('batch_id', sa.String(64)),
+            sa.Column('duration_min', sa.Integer()),
+            sa.Column('issued_at', sa.DateTime(timezone=True)),
+            sa.Column('expires_at', sa.DateTime(timezone=True)),
+            sa.Column('status', sa.String(32)),
+            sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+    if not _has_table('redemption_archive'):
+        op.create_table(
+            'redemption_archive',
+            sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=False),
+            sa.Column('code_id', sa.BigInteger()),
+            sa.Column('device_id', sa.String(64)),
+            sa.Column('first_redeemed_at', sa.DateTime(timezone=True)),
+            sa.Column('last_seen_at', sa.DateTime(timezone=True)),
+            sa.Column('access_jwt_id', sa.String(64)),
+            sa.Column('ip_first', sa.String(64)),
+            sa.Column('user_agent_first', sa.Text()),
+            sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+    if not _has_table('job_cursor'):
+        op.create_table(
+            'job_cursor',
+            sa.Column('name', sa.String(32), primary_key=True),
+            sa.Column('position', sa.BigInteger(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+    for name, table, columns in INDEXES:
+        _create_index(name, table, columns)
+
+
+def downgrade():
+    # Nothing is dropped on purpose. The archive tables may hold the only copy of
+    # archived rows, and every index above is also declared on the models:
+    # dropping one would leave the schema out of step with them, and create_all
+    # does not add indexes to tables that already exist.
+    pass
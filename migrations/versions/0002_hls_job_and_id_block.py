@@ -0,0 +1,55 @@
+"""hls_job and id_block tables
+
+Revision ID: 0002_hls_id_block
+Revises: 0001_archive
+Create Date: 2026-10-18 12:30:00
+
+The HLS packaging queue (workers/hls_packager.py) and the hi-lo id allocator
+state (services/ids.py). Like 0001, every operation is guarded because
+db.create_all() may already have created them at startup.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_hls_id_block'
+down_revision = '0001_archive'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade():
+    if not _has_table('hls_job'):
+        op.create_table(
+            'hls_job',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('content_id', sa.Integer(), sa.ForeignKey('content.id'), nullable=False),
+            sa.Column('status', sa.String(16)),
+            sa.Column('attempts', sa.Integer()),
+            sa.Column('worker', sa.String(64)),
+            sa.Column('heartbeat_at', sa.DateTime(timezone=True)),
+            sa.Column('error', sa.Text()),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index('ix_hls_job_content_id', 'hls_job', ['content_id'])
+        op.create_index('ix_hls_job_status', 'hls_job', ['status'])
+    if not _has_table('id_block'):
+        op.create_table(
+            'id_block',
+            sa.Column('name', sa.String(32), primary_key=True),
+            sa.Column('next_id', sa.BigInteger(), nullable=False),
+        )
+
+
+def downgrade():
+    # Both hold operational state only: queued packaging jobs are lost, and the
+    # allocator reseeds from max(code.id) + 1 the next time it reserves a block.
+    if _has_table('id_block'):
+        op.drop_table('id_block')
+    if _has_table('hls_job'):
+        op.drop_table('hls_job')
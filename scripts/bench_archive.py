@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import os, sys, json, time, random, sqlite3, tempfile, pathlib, statistics
+from datetime import datetime, timedelta, timezone
+# Ensure project root is on PYTHONPATH when running directly
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# Usage: python scripts/bench_archive.py [ROWS] [DEAD_PCT] [CHUNK]
+# Builds a SQLite db of ROWS codes (default 10M), DEAD_PCT % of them past the
+# retention window (expired, voided or redeemed long ago), half of all codes with
+# a redemption. Measures redeem-style lookups and an issued-codes count before and
+# after archival, the archival rate and per-chunk transaction time. The run is
+# stopped halfway and resumed to check that nothing is lost or copied twice.
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+DEAD_PCT = float(sys.argv[2]) if len(sys.argv) > 2 else 30.0
+CHUNK = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+RETENTION_DAYS = 90
+LOAD_BATCH = 100_000
+
+def ts(dt: datetime) -> str:
+    # SQLAlchemy's SQLite DateTime storage format
+    return dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+def load(path: str) -> int:
+    now = datetime.now(timezone.utc)
+    old, recent = now - timedelta(days=RETENTION_DAYS + 30), now - timedelta(days=1)
+    rnd = random.Random(3)
+    dead = 0
+    con = sqlite3.connect(path)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=OFF')
+    rid = 0
+    for lo in range(1, ROWS + 1, LOAD_BATCH):
+        codes, reds = [], []
+        for i in range(lo, min(lo + LOAD_BATCH, ROWS + 1)):
+            is_dead = rnd.random() * 100 < DEAD_PCT
+            dead += is_dead
+            kind = rnd.randrange(3)
+            issued = ts(old if is_dead else recent)
+            expires = ts(old) if is_dead and kind == 0 else ts(now + timedelta(days=30))
+            status = 'void' if is_dead and kind == 1 else 'issued'
+            codes.append((i, 1, 1, f"h{i}", None, 15, issued, expires, status))
+            if (is_dead and kind == 2) or rnd.random() < 0.5:
+                rid += 1
+                seen = ts(old if is_dead and kind == 2 else recent)
+                reds.append((rid, i, f"dev{i}", seen, seen, f"jti{i}", '10.0.0.1', 'bench'))
+        con.executemany('INSERT INTO code (id, merchant_id, product_id, code_hash, batch_id, duration_min, '
+                        'issued_at, expires_at, status) VALUES (?,?,?,?,?,?,?,?,?)', codes)
+        con.executemany('INSERT INTO redemption (id, code_id, device_id, first_redeemed_at, last_seen_at, '
+                        'access_jwt_id, ip_first, user_agent_first) VALUES (?,?,?,?,?,?,?,?)', reds)
+        con.commit()
+    con.execute('ANALYZE')
+    con.close()
+    return dead
+
+def probes(n: int = 2000) -> dict:
+    from app.models import db, Code, Redemption
+    rnd = random.Random(11)
+    lat = []
+    for _ in range(n):
+        cid = rnd.randrange(1, ROWS + 1)
+        t0 = time.perf_counter()
+        (db.session.query(Code, Redemption).outerjoin(Redemption, Redemption.code_id == Code.id)
+         .filter(Code.id == cid).first())
+        lat.append((time.perf_counter() - t0) * 1e6)
+    t0 = time.perf_counter()
+    issued = db.session.query(db.func.count(Code.id)).filter(Code.status == 'issued').scalar()
+    count_ms = (time.perf_counter() - t0) * 1000
+    db.session.rollback()
+    return {'lookup_p50_us': round(statistics.median(lat), 1), 'issued_count_ms': round(count_ms, 1),
+            'issued': issued}
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({'DATABASE_URL': f"sqlite:///{tmp}/archive.db", 'USE_REDIS': '0'})
+        from app import create_app
+        from app.models import db, Merchant, Product, Content, Code, Redemption, CodeArchive, RedemptionArchive
+        from app.services import archive
+        app = create_app()
+        with app.app_context():
+            db.session.add(Merchant(name='Bench', slug='bench'))
+            db.session.add(Content(url_or_blob_ref='https://example.com', type='page'))
+            db.session.flush()
+            db.session.add(Product(merchant_id=1, name='Pass', content_id=1, default_duration_min=15))
+            db.session.commit()
+        t0 = time.perf_counter()
+        dead = load(f"{tmp}/archive.db")
+        report = {'rows': ROWS, 'dead': dead, 'chunk': CHUNK, 'load_s': round(time.perf_counter() - t0, 1)}
+        with app.app_context():
+            reds_before = db.session.query(db.func.count(Redemption.id)).scalar()
+            report['before'] = probes()
+            cutoff = archive.cutoff_for(RETENTION_DAYS)
+            chunk_ms = []
+            t0 = time.perf_counter()
+            moved, stopped_at = 0, None
+            while True:
+                c0 = time.perf_counter()
+                n = archive.archive_chunk(cutoff, CHUNK)
+                chunk_ms.append((time.perf_counter() - c0) * 1000)
+                moved += n
+                if stopped_at is None and moved >= dead // 2:
+                    # Simulated stop: drop the session and resume from the stored cursor
+                    stopped_at = moved
+                    db.session.remove()
+                if not n:
+                    break
+            elapsed = time.perf_counter() - t0
+            q = statistics.quantiles(chunk_ms, n=100, method='inclusive')
+            report['archive'] = {'moved': moved, 'seconds': round(elapsed, 1), 'rows_per_s': round(moved / elapsed),
+                                 'chunk_p50_ms': round(q[49], 1), 'chunk_p99_ms': round(q[98], 1),
+                                 'chunk_max_ms': round(max(chunk_ms), 1), 'resumed_after': stopped_at}
+            report['after'] = probes()
+            codes = db.session.query(db.func.count(Code.id)).scalar()
+            archived = db.session.query(db.func.count(CodeArchive.id)).scalar()
+            reds = db.session.query(db.func.count(Redemption.id)).scalar()
+            reds_archived = db.session.query(db.func.count(RedemptionArchive.id)).scalar()
+            report['ok'] = (archived == dead and codes + archived == ROWS and reds + reds_archived == reds_before)
+            report['counts'] = {'code': codes, 'code_archive': archived, 'redemption': reds,
+                                'redemption_archive': reds_archived}
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report['ok'] else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+import os, sys, json, time, socket, asyncio, tempfile, subprocess, pathlib, statistics
+# Ensure project root is on PYTHONPATH when running directly
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# Usage: python scripts/bench_asgi.py [REQUESTS] [CONCURRENCY] [SLOW_CLIENTS]
+# Starts one gunicorn worker per profile on a temp SQLite db -- gthread (threads=2,
+# as in gunicorn.conf.py) and uvicorn (gunicorn_asgi.conf.py) -- holds SLOW_CLIENTS
+# connections to /api/content that trickle their headers, and measures /api/redeem
+# latency and throughput at fixed CONCURRENCY.
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+SLOW = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+TIMEOUT = 5.0
+
+PROFILES = {
+    'wsgi_gthread': ['-k', 'gthread', '--threads', '2', 'app:create_app()'],
+    'asgi_uvicorn': ['-k', 'uvicorn_worker.UvicornWorker', 'app.asgi:create_asgi_app()'],
+}
+
+def env_for(db_path: str) -> dict:
+    return {**os.environ, 'DATABASE_URL': f"sqlite:///{db_path}", 'USE_REDIS': '0',
+            'RATE_LIMIT_IP': '', 'RATE_LIMIT_MERCHANT': '', 'RATE_LIMIT_CODE': ''}
+
+def seed(db_path: str, n: int) -> list:
+    os.environ.update(env_for(db_path))
+    from app import create_app
+    from app.models import db, Merchant, Product, Content
+    from app.services.issuance import mint_batch
+    from app.services.tokens import make_opaque
+    app = create_app()
+    with app.app_context():
+        db.session.add(Merchant(name='Bench', slug='bench'))
+        db.session.add(Content(url_or_blob_ref='file:///dev/null', mime_type='text/html', type='page'))
+        db.session.add(Product(merchant_id=1, name='Bench pass', content_id=1, default_duration_min=15))
+        db.session.commit()
+        ids = list(mint_batch('bench', 1, 1, 15, 0, n))
+        return [make_opaque(i, 1) for i in ids]
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+async def http(port: int, method: str, path: str, body: bytes = b'') -> int:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    head = (f"{method} {path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode()
+    writer.write(head + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    await reader.read()
+    writer.close()
+    return status
+
+async def slow_client(port: int, stop: asyncio.Event):
+    # A phone on a bad link: the request line arrives, headers dribble in
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b"GET /api/content/1 HTTP/1.1\r\nHost: bench\r\n")
+    while not stop.is_set():
+        writer.write(b"X")
+        await writer.drain()
+        await asyncio.sleep(0.5)
+    writer.close()
+
+async def drive(port: int, opaques: list) -> dict:
+    stop = asyncio.Event()
+    slow = [asyncio.create_task(slow_client(port, stop)) for _ in range(SLOW)]
+    await asyncio.sleep(0.5)
+    queue = list(enumerate(opaques))
+    lat, errors = [], 0
+
+    async def worker():
+        nonlocal errors
+        while queue:
+            i, op = queue.pop()
+            t0 = time.perf_counter()
+            try:
+                st = await asyncio.wait_for(
+                    http(port, 'POST', '/api/redeem', json.dumps({'opaque': op, 'device_id': f"d{i}"}).encode()), TIMEOUT)
+                if st != 200:
+                    errors += 1
+            except (asyncio.TimeoutError, OSError):
+                errors += 1
+            lat.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await asyncio.gather(*slow, return_exceptions=True)
+    q = statistics.quantiles(lat, n=100)
+    return {'requests': len(lat), 'errors_or_timeouts': errors, 'rps': round(len(lat) / elapsed, 1),
+            'p50_ms': round(q[49], 2), 'p95_ms': round(q[94], 2), 'p99_ms': round(q[98], 2)}
+
+def main():
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        opaques = seed(db_path, REQUESTS * len(PROFILES))
+        for n, (name, args) in enumerate(PROFILES.items()):
+            port = free_port()
+            proc = subprocess.Popen(['gunicorn', '-w', '1', '-b', f"127.0.0.1:{port}", '--log-level', 'warning', *args],
+                                    cwd=ROOT, env=env_for(db_path))
+            try:
+                for _ in range(100):
+                    try:
+                        socket.create_connection(('127.0.0.1', port), 0.2).close()
+                        break
+                    except OSError:
+                        time.sleep(0.1)
+                results[name] = asyncio.run(drive(port, opaques[n * REQUESTS:(n + 1) * REQUESTS]))
+            finally:
+                proc.terminate()
+                proc.wait(10)
+    print(json.dumps({'concurrency': CONCURRENCY, 'slow_clients': SLOW, 'results': results}, indent=2))
+
+if __name__ == '__main__':
+    main()
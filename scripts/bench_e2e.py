@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+import os, sys, json, time, random, socket, asyncio, tempfile, subprocess, pathlib, statistics
+# Ensure project root is on PYTHONPATH when running directly
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# Usage: python scripts/bench_e2e.py [CODES] [REQUESTS] [CONCURRENCY] [OUT.json]
+# Seeds a temp SQLite db (MERCHANTS merchants with one product each, CODES codes
+# spread over them), serves create_app() from one gunicorn gthread worker on the
+# _MemStore fallback (one worker so jtis written by redeem are visible to content),
+# then drives each scenario at fixed CONCURRENCY:
+#   redeem     POST /api/redeem with a fresh code per request
+#   content    GET /api/content/<id> with the tokens minted by redeem
+#   issue_qr   POST /admin/issue-qr (PNG)
+#   decode     POST /api/decode with a rendered redeem QR
+# Prints (and optionally writes) JSON with rps and p50/p95/p99 per scenario.
+
+CODES = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+REQUESTS = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+CONCURRENCY = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+OUT = sys.argv[4] if len(sys.argv) > 4 else None
+MERCHANTS = int(os.environ.get('BENCH_MERCHANTS', '10'))
+CONTENT_BYTES = int(os.environ.get('BENCH_CONTENT_BYTES', str(64 * 1024)))
+TIMEOUT = 30.0
+ADMIN_KEY = 'bench-admin'
+
+def env_for(tmp: str) -> dict:
+    return {**os.environ, 'DATABASE_URL': f"sqlite:///{tmp}/bench.db", 'USE_REDIS': '0',
+            'ADMIN_API_KEY': ADMIN_KEY, 'RATE_LIMIT_IP': '', 'RATE_LIMIT_MERCHANT': '', 'RATE_LIMIT_CODE': ''}
+
+def seed(tmp: str) -> dict:
+    os.environ.update(env_for(tmp))
+    from app import create_app
+    from app.models import db, Merchant, Product, Content
+    from app.services.issuance import mint_batch
+    from app.services.tokens import make_opaque
+    from app.services.qr import make_qr_bytes
+    blob = os.path.join(tmp, 'content.bin')
+    with open(blob, 'wb') as f:
+        f.write(os.urandom(CONTENT_BYTES))
+    app = create_app()
+    t0 = time.perf_counter()
+    with app.app_context():
+        for m in range(1, MERCHANTS + 1):
+            db.session.add(Merchant(name=f"Bench {m}", slug=f"bench-{m}"))
+            db.session.add(Content(url_or_blob_ref=f"file://{blob}", mime_type='application/octet-stream', type='page'))
+        db.session.flush()
+        for m in range(1, MERCHANTS + 1):
+            db.session.add(Product(merchant_id=m, name=f"Pass {m}", content_id=m, default_duration_min=60))
+        db.session.commit()
+        per = CODES // MERCHANTS
+        sample, rnd = [], random.Random(7)
+        for m in range(1, MERCHANTS + 1):
+            ids = list(mint_batch(f"bench-{m}", m, m, 60, 0, per, 5000))
+            sample += [(i, m) for i in rnd.sample(ids, min(len(ids), REQUESTS // MERCHANTS + 1))]
+        rnd.shuffle(sample)
+        opaques = [make_opaque(i, m) for i, m in sample[:REQUESTS]]
+        png = make_qr_bytes(f"{app.config['BASE_URL']}/redeem?c={opaques[0]}")
+    return {'opaques': opaques, 'png': png, 'codes': per * MERCHANTS, 'seconds': round(time.perf_counter() - t0, 1)}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+async def http(port: int, method: str, path: str, body: bytes = b'', headers: dict|None = None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    hdrs = {'Host': 'bench', 'Connection': 'close', 'Content-Length': str(len(body)), **(headers or {})}
+    head = f"{method} {path} HTTP/1.1\r\n" + ''.join(f"{k}: {v}\r\n" for k, v in hdrs.items()) + "\r\n"
+    writer.write(head.encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    rest = await reader.read()
+    writer.close()
+    return status, rest.split(b'\r\n\r\n', 1)[-1]
+
+def multipart(png: bytes):
+    boundary = 'benchboundary'
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"qr.png\"\r\n"
+            f"Content-Type: image/png\r\n\r\n").encode() + png + f"\r\n--{boundary}--\r\n".encode()
+    return body, {'Content-Type': f"multipart/form-data; boundary={boundary}"}
+
+async def drive(port: int, make_request, n: int) -> dict:
+    """Run n requests through CONCURRENCY workers; make_request(i) -> (method, path, body, headers, on_ok)."""
+    lat, errors, nxt = [], 0, iter(range(n))
+
+    async def worker():
+        nonlocal errors
+        for i in nxt:
+            method, path, body, headers, on_ok = make_request(i)
+            t0 = time.perf_counter()
+            try:
+                status, payload = await asyncio.wait_for(http(port, method, path, body, headers), TIMEOUT)
+                if status == 200:
+                    if on_ok:
+                        on_ok(payload)
+                else:
+                    errors += 1
+            except (asyncio.TimeoutError, OSError):
+                errors += 1
+            lat.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - t0
+    q = statistics.quantiles(lat, n=100)
+    return {'requests': len(lat), 'errors': errors, 'rps': round(len(lat) / elapsed, 1),
+            'p50_ms': round(q[49], 2), 'p95_ms': round(q[94], 2), 'p99_ms': round(q[98], 2)}
+
+async def scenarios(port: int, data: dict) -> dict:
+    tokens = []
+    opaques = data['opaques']
+
+    def redeem(i):
+        body = json.dumps({'opaque': opaques[i], 'device_id': f"bench-{i}"}).encode()
+        return 'POST', '/api/redeem', body, {'Content-Type': 'application/json'}, \
+            lambda p: tokens.append(json.loads(p))
+
+    def content(i):
+        t = tokens[i % len(tokens)]
+        return 'GET', f"/api/content/{t['content_id']}", b'', {'Authorization': f"Bearer {t['token']}"}, None
+
+    def issue_qr(i):
+        body = json.dumps({'merchant_id': 1 + i % MERCHANTS, 'product_id': 1 + i % MERCHANTS}).encode()
+        return 'POST', '/admin/issue-qr', body, {'Content-Type': 'application/json', 'X-Admin-Key': ADMIN_KEY}, None
+
+    decode_body, decode_headers = multipart(data['png'])
+
+    def decode(i):
+        return 'POST', '/api/decode', decode_body, decode_headers, None
+
+    results = {'redeem': await drive(port, redeem, len(opaques))}
+    if not tokens:
+        raise SystemExit('no successful redeem: cannot run content scenario')
+    results['content'] = await drive(port, content, REQUESTS)
+    results['issue_qr'] = await drive(port, issue_qr, REQUESTS)
+    results['decode'] = await drive(port, decode, max(1, REQUESTS // 4))
+    return results
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        data = seed(tmp)
+        port = free_port()
+        proc = subprocess.Popen(['gunicorn', '-w', '1', '-k', 'gthread', '--threads', str(CONCURRENCY),
+                                 '-b', f"127.0.0.1:{port}", '--log-level', 'warning', '--access-logfile', '/dev/null',
+                                 'app:create_app()'],
+                                cwd=ROOT, env=env_for(tmp))
+        try:
+            for _ in range(100):
+                try:
+                    socket.create_connection(('127.0.0.1', port), 0.2).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            results = asyncio.run(scenarios(port, data))
+        finally:
+            proc.terminate()
+            proc.wait(10)
+    report = {'codes': data['codes'], 'seed_s': data['seconds'], 'requests': REQUESTS,
+              'concurrency': CONCURRENCY, 'merchants': MERCHANTS, 'content_bytes': CONTENT_BYTES,
+              'results': results}
+    out = json.dumps(report, indent=2)
+    if OUT:
+        with open(OUT, 'w') as f:
+            f.write(out + '\n')
+    print(out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import os, sys, time, json, random, pathlib, statistics
+# Ensure project root is on PYTHONPATH when running directly
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import qrcode
+import numpy as np
+import cv2
+from flask import Flask
+from app.services import qr, tokens
+
+# Usage: python scripts/bench_opaque.py [N]
+# Legacy vs v1 opaque tokens in a redeem URL: token/URL length, QR version, PNG
+# size, render time, and OpenCV decode time at the default module size and at
+# 2 px/module (a small printed badge or a cheap camera).
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+BASE = os.environ.get('BASE_URL', 'https://qr-access.example.com')
+
+def profile(fmt: str, mac_bytes: int = 10) -> dict:
+    app = Flask(__name__)
+    app.config.update(MERCHANT_SALT='bench-salt', OPAQUE_FORMAT=fmt, OPAQUE_MAC_BYTES=mac_bytes)
+    rnd = random.Random(1)
+    with app.app_context():
+        urls = [f"{BASE}/redeem?c={tokens.make_opaque(rnd.randrange(1, 5_000_000), rnd.randrange(1, 500))}"
+                for _ in range(N)]
+        t0 = time.perf_counter()
+        for u in urls:
+            tokens.resolve_opaque(u.rsplit('=', 1)[1])
+        resolve_us = (time.perf_counter() - t0) * 1e6 / N
+    versions, pngs, render_ms, decode = [], [], [], {10: [], 2: []}
+    detector = cv2.QRCodeDetector()
+    failures = {10: 0, 2: 0}
+    for u in urls:
+        q = qrcode.QRCode(error_correction=qr.EC_LEVELS['M'])
+        q.add_data(u)
+        q.make(fit=True)
+        versions.append(q.version)
+        t0 = time.perf_counter()
+        png = qr.render(u, 'png')
+        render_ms.append((time.perf_counter() - t0) * 1000)
+        pngs.append(len(png))
+        for box in decode:
+            img = cv2.imdecode(np.frombuffer(qr.render(u, 'png', box_size=box), np.uint8), cv2.IMREAD_GRAYSCALE)
+            t0 = time.perf_counter()
+            val, _, _ = detector.detectAndDecode(img)
+            decode[box].append((time.perf_counter() - t0) * 1000)
+            if val != u:
+                failures[box] += 1
+    return {
+        'format': fmt if fmt == 'legacy' else f"v1/mac{mac_bytes}",
+        'token_chars': round(statistics.mean(len(u.rsplit('=', 1)[1]) for u in urls), 1),
+        'url_chars': round(statistics.mean(len(u) for u in urls), 1),
+        'qr_version': {'min': min(versions), 'max': max(versions)},
+        'png_bytes': round(statistics.mean(pngs)),
+        'render_ms': round(statistics.median(render_ms), 3),
+        'decode_ms_box10': round(statistics.median(decode[10]), 3),
+        'decode_ms_box2': round(statistics.median(decode[2]), 3),
+        'decode_failures_box2': failures[2],
+        'resolve_us': round(resolve_us, 2),
+    }
+
+if __name__ == '__main__':
+    qr._cache.max_bytes = 0
+    results = [profile('legacy'), profile('v1', 10), profile('v1', 16)]
+    print(json.dumps({'n': N, 'base_url': BASE, 'results': results}, indent=2))
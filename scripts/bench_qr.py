@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+import sys, io, time, json, pathlib, secrets
+# Ensure project root is on PYTHONPATH when running directly
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import qrcode
+from app.services import qr
+
+# Usage: python scripts/bench_qr.py [N]
+# Compares qrcode.make + PIL PNG encoder with the direct 1-bit renderer (cold and cached).
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+urls = [f"https://qr-access.example.com/redeem?c={secrets.token_urlsafe(54)}" for _ in range(N)]
+
+def legacy(url):
+    img = qrcode.make(url)
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+def run(name, fn):
+    t0 = time.perf_counter()
+    sizes = [len(fn(u)) for u in urls]
+    dt = time.perf_counter() - t0
+    return {'name': name, 'n': N, 'ms_per_qr': round(dt * 1000 / N, 3), 'avg_bytes': sum(sizes) // N}
+
+results = [run('pil_png', legacy)]
+qr._cache.clear()
+qr._cache.max_bytes = 0
+results.append(run('direct_png', qr.make_qr_bytes))
+results.append(run('direct_svg', qr.make_qr_svg))
+results.append(run('matrix_only', lambda u: qr.qr_matrix(u)))
+results.append(run('direct_png_mask0', lambda u: qr.render(u, 'png', mask=0)))
+qr._cache.max_bytes = 64 * 1024 * 1024
+run('warm', qr.make_qr_bytes)
+results.append(run('direct_png_cached', qr.make_qr_bytes))
+print(json.dumps({'results': results, 'cache': qr.cache_stats()}, indent=2))
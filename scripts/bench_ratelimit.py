@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import os, sys, json, time, random, pathlib
+# Ensure project root is on PYTHONPATH when running directly
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+os.environ['USE_REDIS'] = '0'
+
+from app import create_app
+from app.services import rate_limit
+
+# Usage: python scripts/bench_ratelimit.py [BOT_REQUESTS] [USERS]
+# Synthetic flood: a few bot IPs hammer redeem while USERS legitimate IPs make a
+# handful of attempts each. Counts shared-store round trips with the local
+# pre-filter on and off; every store call would be a Redis round trip in production.
+
+BOT_REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+USERS = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+class CountingStore(rate_limit._MemStore):
+    calls = 0
+
+    def take_tokens(self, buckets, writes=()):
+        self.calls += 1
+        return super().take_tokens(buckets, writes)
+
+def traffic():
+    rnd = random.Random(42)
+    reqs = [f"10.0.0.{rnd.randint(1, 5)}" for _ in range(BOT_REQUESTS)]
+    reqs += [f"192.168.{u // 250}.{u % 250}" for u in range(USERS) for _ in range(3)]
+    rnd.shuffle(reqs)
+    return reqs
+
+def run(app, local: bool):
+    app.config['RATE_LIMIT_LOCAL'] = local
+    rate_limit._local = None
+    store = CountingStore()
+    rate_limit._set(store)
+    admitted = rejected_local = rejected_global = 0
+    t0 = time.perf_counter()
+    with app.app_context():
+        for ip in traffic():
+            buckets = rate_limit.buckets_for(ip=ip)
+            try:
+                rate_limit.prefilter(buckets)
+            except rate_limit.RateLimited:
+                rejected_local += 1
+                continue
+            if store.take_tokens(buckets):
+                rejected_global += 1
+            else:
+                admitted += 1
+    dt = time.perf_counter() - t0
+    return {'local_prefilter': local, 'requests': BOT_REQUESTS + USERS * 3, 'admitted': admitted,
+            'rejected_local': rejected_local, 'rejected_store': rejected_global,
+            'store_round_trips': store.calls, 'elapsed_s': round(dt, 3)}
+
+app = create_app()
+off, on = run(app, False), run(app, True)
+print(json.dumps({'without_prefilter': off, 'with_prefilter': on,
+                  'store_ops_saved': off['store_round_trips'] - on['store_round_trips'],
+                  'store_ops_saved_pct': round(100 * (1 - on['store_round_trips'] / off['store_round_trips']), 2)},
+                 indent=2))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import os, sys, json, time, random, tempfile, pathlib, statistics
+from concurrent.futures import ThreadPoolExecutor
+# Ensure project root is on PYTHONPATH when running directly
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# Usage: python scripts/bench_webhook.py [DELIVERIES] [EVENTS] [CONCURRENCY]
+# Retry storm against POST /admin/payment-webhook on a temp SQLite db and the
+# memory store: DELIVERIES deliveries of EVENTS distinct payment events, shuffled,
+# from CONCURRENCY threads. Then the same storm is replayed after wiping the
+# store, as after a Redis flush or a restart. Checks that exactly one code exists
+# per event and that every response naming a code names the same one; prints
+# ack latency, the time for the background minter to drain, and its counters.
+
+DELIVERIES = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+EVENTS = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+CONCURRENCY = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+WEBHOOK_KEY = 'bench-webhook'
+
+def storm(client, deliveries: list) -> tuple:
+    lat, codes, statuses = [], {}, {}
+
+    def fire(event_id):
+        body = {'id': event_id, 'event': 'payment.succeeded',
+                'data': {'merchant_id': 1, 'product_id': 1, 'duration_min': 60, 'id': f"pi_{event_id}"}}
+        t0 = time.perf_counter()
+        resp = client.post('/admin/payment-webhook', json=body, headers={'X-Webhook-Key': WEBHOOK_KEY})
+        lat.append((time.perf_counter() - t0) * 1000)
+        statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+        code_id = (resp.get_json() or {}).get('code_id')
+        if code_id is not None:
+            codes.setdefault(event_id, set()).add(code_id)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(CONCURRENCY) as ex:
+        list(ex.map(fire, deliveries))
+    elapsed = time.perf_counter() - t0
+    q = statistics.quantiles(lat, n=100)
+    return {'deliveries': len(lat), 'statuses': {str(k): v for k, v in sorted(statuses.items())},
+            'rps': round(len(lat) / elapsed, 1), 'ack_p50_ms': round(q[49], 3),
+            'ack_p99_ms': round(q[98], 3)}, codes
+
+def drain(app, payments, timeout: float = 60.0) -> float:
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        with app.app_context():
+            if payments.stats()['queued'] == 0:
+                break
+        time.sleep(0.01)
+    # The last batch may still be committing
+    time.sleep(0.2)
+    return round(time.perf_counter() - t0, 3)
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({'DATABASE_URL': f"sqlite:///{tmp}/bench.db", 'USE_REDIS': '0',
+                           'WEBHOOK_KEY': WEBHOOK_KEY, 'AUDIT_ENABLED': '0'})
+        from app import create_app
+        from app.models import db, Merchant, Product, Content, Code
+        from app.services import payments, rate_limit
+        app = create_app()
+        with app.app_context():
+            db.session.add(Merchant(name='Bench', slug='bench'))
+            db.session.add(Content(url_or_blob_ref='https://example.com', type='page'))
+            db.session.flush()
+            db.session.add(Product(merchant_id=1, name='Pass', content_id=1, default_duration_min=60))
+            db.session.commit()
+        rnd = random.Random(7)
+        deliveries = [f"evt_{i % EVENTS:06d}" for i in range(DELIVERIES)]
+        rnd.shuffle(deliveries)
+        client = app.test_client()
+
+        report = {'deliveries': DELIVERIES, 'events': EVENTS, 'concurrency': CONCURRENCY}
+        seen = {}
+        for phase in ('storm', 'replay_after_store_wipe'):
+            if phase != 'storm':
+                with app.app_context():
+                    rate_limit._set(rate_limit._mem_store())
+            result, codes = storm(client, deliveries)
+            result['drain_s'] = drain(app, payments)
+            for eid, ids in codes.items():
+                seen.setdefault(eid, set()).update(ids)
+            with app.app_context():
+                result['codes_in_db'] = db.session.query(Code).filter(Code.batch_id.like('evt:%')).count()
+                result['minter'] = payments.stats()
+            report[phase] = result
+        report['events_with_conflicting_codes'] = sum(1 for ids in seen.values() if len(ids) > 1)
+        report['ok'] = (report['events_with_conflicting_codes'] == 0
+                        and all(report[p]['codes_in_db'] == EVENTS for p in ('storm', 'replay_after_store_wipe')))
+        with app.app_context():
+            payments.shutdown()
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report['ok'] else 1)
+
+if __name__ == '__main__':
+    main()
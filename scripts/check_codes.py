@@ -1,44 +1,81 @@
 #!/usr/bin/env python3
-import sys, base64, hmac, hashlib, time
+import re, sys, base64, binascii, hmac, hashlib, time
 
-# Usage: python scripts/check_codes.py <OPAQUE> <MERCHANT_SALT>
-# Decodes our opaque token format and validates signature + staleness
+# Usage: python scripts/check_codes.py <OPAQUE> <MERCHANT_SALT> [MAX_AGE_S]
+# Decodes our opaque token formats (binary v1 and legacy) and validates signature + staleness
+# (MAX_AGE_S defaults to 86400, as OPAQUE_MAX_AGE_S)
+
+OPAQUE_EPOCH = 1704067200
 
 def err(msg):
     print(f"ERROR: {msg}")
     sys.exit(1)
 
-if len(sys.argv) < 3:
-    err("Usage: check_codes.py <OPAQUE> <MERCHANT_SALT>")
+def read_varint(data, pos):
+    n = shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError('truncated varint')
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return n, pos
+        shift += 7
 
-opaque = sys.argv[1].strip()
-merchant_salt = sys.argv[2].strip().encode()
+def decode_v1(opaque, salt):
+    t = opaque.upper()
+    raw = base64.b32decode(t + '=' * (-len(t) % 8))
+    if not raw or raw[0] != 1:
+        raise ValueError('not a v1 token')
+    code_id, pos = read_varint(raw, 1)
+    merchant_id, pos = read_varint(raw, pos)
+    minutes, pos = read_varint(raw, pos)
+    body, sig = raw[:pos], raw[pos:]
+    if not hmac.compare_digest(sig, hmac.new(salt, body, hashlib.sha256).digest()[:len(sig)]):
+        err("bad signature")
+    return 'v1', code_id, merchant_id, OPAQUE_EPOCH + minutes * 60, len(sig)
 
-try:
-    raw = base64.urlsafe_b64decode(opaque + '==')
-except Exception as e:
-    err(f"base64 decode: {e}")
+def decode_legacy(opaque, salt):
+    try:
+        raw = base64.urlsafe_b64decode(opaque + '==')
+    except Exception as e:
+        err(f"base64 decode: {e}")
+    if len(raw) < 33:
+        err("too short")
+    msg, sig = raw[:-32], raw[-32:]
+    if not hmac.compare_digest(sig, hmac.new(salt, msg, hashlib.sha256).digest()):
+        err("bad signature")
+    try:
+        code_id_s, merchant_id_s, ts_s = msg.decode().split('.')
+        return 'legacy', int(code_id_s), int(merchant_id_s), int(ts_s), 32
+    except Exception as e:
+        err(f"parse: {e}")
 
-if len(raw) < 33:
-    err("too short")
+if len(sys.argv) < 3:
+    err("Usage: check_codes.py <OPAQUE> <MERCHANT_SALT> [MAX_AGE_S]")
 
-msg, sig = raw[:-32], raw[-32:]
-exp_sig = hmac.new(merchant_salt, msg, hashlib.sha256).digest()
-if not hmac.compare_digest(sig, exp_sig):
-    err("bad signature")
+opaque = sys.argv[1].strip()
+merchant_salt = sys.argv[2].strip().encode()
+max_age = int(sys.argv[3]) if len(sys.argv) > 3 else 86400
 
-try:
-    code_id_s, merchant_id_s, ts_s = msg.decode().split('.')
-    code_id, merchant_id, ts = int(code_id_s), int(merchant_id_s), int(ts_s)
-except Exception as e:
-    err(f"parse: {e}")
+decoded = None
+if re.fullmatch(r'[A-Za-z2-7]+', opaque):
+    try:
+        decoded = decode_v1(opaque, merchant_salt)
+    except (ValueError, binascii.Error):
+        decoded = None
+fmt, code_id, merchant_id, ts, mac_bytes = decoded or decode_legacy(opaque, merchant_salt)
 
 age = int(time.time()) - ts
-stale = age > 86400
+stale = age > max_age
 print({
+    'format': fmt,
     'code_id': code_id,
     'merchant_id': merchant_id,
     'ts': ts,
+    'mac_bytes': mac_bytes,
     'age_s': age,
-    'stale_>1d': stale,
+    'max_age_s': max_age,
+    'stale': stale,
 })
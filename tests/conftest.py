@@ -0,0 +1,55 @@
+import os, sys, pathlib, tempfile
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# Config reads the environment at import time: set it before the app is imported.
+# Background writers are off so each test sees its own writes synchronously.
+_TMP = tempfile.mkdtemp(prefix='qr-access-tests-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{_TMP}/test.db",
+    'USE_REDIS': '0',
+    'ADMIN_API_KEY': 'test-admin',
+    'WEBHOOK_KEY': 'test-webhook',
+    'AUDIT_ENABLED': '0',
+    'LAST_SEEN_ENABLED': '0',
+    'CODE_POOL_ENABLED': '0',
+})
+for var, name in (('JWT_PRIVATE_KEY', 'jwt.key'), ('JWT_PUBLIC_KEY', 'jwt.pub')):
+    if var not in os.environ and (ROOT / name).exists():
+        os.environ[var] = (ROOT / name).read_text().strip()
+
+from app import create_app
+from app.models import db, Merchant, Product, Content
+from app.services import rate_limit
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    with app.app_context():
+        db.session.add(Merchant(name='Test', slug='test'))
+        db.session.add(Content(url_or_blob_ref='https://example.com/p.html', mime_type='text/html', type='page'))
+        db.session.flush()
+        db.session.add(Product(merchant_id=1, name='Pass', content_id=1, default_duration_min=15))
+        db.session.commit()
+    return app
+
+@pytest.fixture
+def ctx(app):
+    with app.app_context():
+        yield app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture(autouse=True)
+def fresh_store():
+    # The store and the local rate tier are per-process singletons
+    rate_limit._set(None)
+    rate_limit._local = None
+    yield
+    rate_limit._set(None)
+    rate_limit._local = None
@@ -0,0 +1,35 @@
+import time
+import jwt
+import pytest
+from app.services import tokens
+
+def _token(exp_in=60):
+    return tokens.sign_access_jwt(1, 'jti-test', int(time.time()) + exp_in, 1, 'dev', 1)
+
+def test_repeat_presentation_skips_the_signature_check(ctx):
+    token = _token()
+    first = tokens.verify_access_jwt(token)
+    hits = tokens._verified.stats()['hits']
+    first['sub'] = 'tampered'
+    # A fresh copy each time: callers cannot poison the cache
+    assert tokens.verify_access_jwt(token)['sub'] == '1'
+    assert tokens._verified.stats()['hits'] == hits + 1
+
+def test_tampered_token_is_refused(ctx):
+    head, body, sig = _token().split('.')
+    with pytest.raises(jwt.InvalidTokenError):
+        tokens.verify_access_jwt(f"{head}.{body}.{sig[:-4]}AAAA")
+
+def test_cached_token_still_expires(ctx):
+    token = _token(exp_in=1)
+    tokens.verify_access_jwt(token)
+    time.sleep(1.1)
+    with pytest.raises(jwt.ExpiredSignatureError):
+        tokens.verify_access_jwt(token)
+
+def test_cache_is_bounded():
+    cache = tokens._VerifiedTokens(max_items=2)
+    for i in range(3):
+        cache.put(bytes([i]), time.time() + 60, {'i': i})
+    assert cache.get(bytes([0]), time.time()) is None
+    assert cache.get(bytes([2]), time.time()) == {'i': 2}
@@ -0,0 +1,55 @@
+import uuid
+from datetime import datetime, timezone
+import pytest
+from sqlalchemy import update
+from app.models import db, Code, Redemption, CodeArchive, RedemptionArchive
+from app.services import archive
+from app.services.issuance import mint_batch
+
+OLD = datetime(2020, 1, 1, tzinfo=timezone.utc)
+# Only rows dated before this are dead: the rest of the test database is untouched
+CUTOFF = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+def _mint(n, **values):
+    ids = list(mint_batch(f"test-{uuid.uuid4().hex[:8]}", 1, 1, 15, 0, n))
+    if values:
+        db.session.execute(update(Code).where(Code.id.in_(ids)).values(**values))
+        db.session.commit()
+    return ids
+
+@pytest.fixture(autouse=True)
+def fresh_cursor(ctx):
+    archive._cursor().position = 0
+    db.session.commit()
+
+def test_dead_codes_move_with_their_redemptions(ctx):
+    expired, = _mint(1, expires_at=OLD)
+    voided, = _mint(1, status='void', issued_at=OLD)
+    used, live = _mint(2)
+    db.session.add_all([Redemption(code_id=expired, device_id='a'),
+                        Redemption(code_id=used, device_id='b', first_redeemed_at=OLD),
+                        Redemption(code_id=live, device_id='c', first_redeemed_at=OLD, last_seen_at=datetime.now(timezone.utc))])
+    db.session.commit()
+    while archive.archive_chunk(CUTOFF, chunk=2):
+        pass
+    dead = {expired, voided, used}
+    assert {c.id for c in CodeArchive.query.filter(CodeArchive.id.in_(dead | {live}))} == dead
+    assert {r.code_id for r in RedemptionArchive.query.filter(RedemptionArchive.code_id.in_(dead))} == {expired, used}
+    assert {c.id for c in Code.query.filter(Code.id.in_(dead | {live}))} == {live}
+    assert Redemption.query.filter(Redemption.code_id.in_(dead)).count() == 0
+    assert archive._cursor().position == 0
+
+def test_a_stopped_run_resumes_after_its_last_chunk(ctx):
+    ids = _mint(3, expires_at=OLD)
+    assert archive.archive_chunk(CUTOFF, chunk=2) == 2
+    assert archive._cursor().position == ids[1]
+    assert archive.archive_chunk(CUTOFF, chunk=2) == 1
+    assert archive.archive_chunk(CUTOFF, chunk=2) == 0
+    assert CodeArchive.query.filter(CodeArchive.id.in_(ids)).count() == 3
+
+def test_run_stops_after_max_chunks(ctx, monkeypatch):
+    _mint(3, expires_at=OLD)
+    monkeypatch.setattr(archive, 'cutoff_for', lambda days: CUTOFF)
+    result = archive.run(30, chunk=1, max_chunks=2)
+    assert result['moved'] == 2 and result['chunks'] == 2 and result['cursor'] > 0
+    assert archive.run(30, chunk=1)['moved'] == 1
@@ -0,0 +1,44 @@
+import uuid
+from datetime import datetime, timezone
+import pytest
+from app.models import db, AuditLog
+from app.services.audit import AuditWriter
+
+def _row(event_type):
+    return {'ts': datetime.now(timezone.utc), 'actor_type': 'test', 'actor_id': '1',
+            'event_type': event_type, 'payload_json': {'n': 1}}
+
+def _written(event_type):
+    db.session.rollback()
+    return AuditLog.query.filter_by(event_type=event_type).count()
+
+def test_rows_are_written_in_batches_and_drained_on_close(ctx):
+    kind = f"test.{uuid.uuid4().hex[:8]}"
+    # A long interval: only a full batch or close() writes anything
+    w = AuditWriter(ctx, max_queue=100, batch_size=3, interval=60)
+    for _ in range(4):
+        assert w.put(_row(kind))
+    w.close()
+    assert _written(kind) == 4
+    assert w.stats['written'] == 4 and w.stats['batches'] == 2
+    assert not w.put(_row(kind))
+
+@pytest.mark.parametrize('overflow, kept, accepted', [
+    ('drop_oldest', ['1', '2'], True),
+    ('drop_new', ['0', '1'], False),
+    ('block', ['0', '1'], False),   # nothing drains within block_s
+])
+def test_overflow_policies(ctx, overflow, kept, accepted):
+    w = AuditWriter(ctx, max_queue=2, batch_size=100, interval=60, overflow=overflow, block_s=0.01)
+    try:
+        assert w.put({'actor_id': '0'}) and w.put({'actor_id': '1'})
+        assert w.put({'actor_id': '2'}) is accepted
+        assert [row['actor_id'] for _, row in w._q] == kept
+        assert w.stats['dropped'] == 1
+    finally:
+        w._q.clear()
+        w.close()
+
+def test_unknown_overflow_policy_is_refused(ctx):
+    with pytest.raises(ValueError):
+        AuditWriter(ctx, overflow='drop_all')
@@ -0,0 +1,27 @@
+import json, uuid
+
+H = {'X-Admin-Key': 'test-admin'}
+
+def _batch(client, **body):
+    r = client.post('/admin/issue-qr/batch', json=body, headers=H)
+    return r.status_code, [json.loads(l) for l in r.get_data(as_text=True).splitlines()] if r.status_code == 200 else r.get_json()
+
+def test_resume_mints_only_missing_slots(client):
+    bid = f"b-{uuid.uuid4().hex[:8]}"
+    status, lines = _batch(client, batch_id=bid, count=3)
+    assert status == 200 and lines[-1]['minted'] == 3
+    first = [l['code_id'] for l in lines[1:-1]]
+    _, lines = _batch(client, batch_id=bid, count=5)
+    assert lines[0]['resumed_from'] == 3 and lines[-1]['minted'] == 2
+    assert [l['code_id'] for l in lines[1:4]] == first
+    # A smaller count re-streams its slots and mints nothing
+    _, lines = _batch(client, batch_id=bid, count=2)
+    assert lines[0]['resumed_from'] == 2 and lines[-1]['minted'] == 0 and len(lines) == 4
+
+def test_resume_with_other_terms_is_refused(client):
+    bid = f"b-{uuid.uuid4().hex[:8]}"
+    assert _batch(client, batch_id=bid, count=1)[0] == 200
+    assert _batch(client, batch_id=bid, count=1, duration_min=60) == (409, {'error': 'batch_mismatch', 'batch_id': bid})
+
+def test_webhook_batch_ids_are_reserved(client):
+    assert _batch(client, batch_id='evt:abc', count=1)[0] == 400
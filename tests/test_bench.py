@@ -0,0 +1,18 @@
+import sys, json, shutil, pathlib, subprocess
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+pytest.importorskip('cv2')
+
+@pytest.mark.skipif(shutil.which('gunicorn') is None, reason='gunicorn not installed')
+def test_e2e_bench_smoke(tmp_path):
+    # A tiny run of scripts/bench_e2e.py: every scenario completes without errors and reports latencies
+    out = tmp_path / 'bench.json'
+    subprocess.run([sys.executable, 'scripts/bench_e2e.py', '200', '40', '4', str(out)], cwd=ROOT, check=True,
+                   timeout=120, capture_output=True)
+    report = json.loads(out.read_text())
+    assert set(report['results']) == {'redeem', 'content', 'issue_qr', 'decode'}
+    for name, result in report['results'].items():
+        assert result['errors'] == 0, name
+        assert 0 < result['p50_ms'] <= result['p95_ms'] <= result['p99_ms']
@@ -0,0 +1,116 @@
+import time
+import pytest
+import redis
+from app.services import rate_limit
+from app.services.breaker import ManagedStore, StoreUnavailable
+from app.services.rate_limit import _MemStore
+
+class FlakyStore(_MemStore):
+    """A memory store standing in for Redis that can be taken down."""
+
+    def __init__(self):
+        super().__init__(max_keys=1000, shards=2)
+        self.down = False
+        self.busy = False
+
+    def _check(self):
+        if self.down:
+            raise redis.ConnectionError('Connection refused')
+        if self.busy:
+            raise redis.ConnectionError('No connection available.')
+
+    def ping(self):
+        self._check()
+        return True
+
+    def setex(self, *args):
+        self._check()
+        return super().setex(*args)
+
+    def get(self, key):
+        self._check()
+        return super().get(key)
+
+    def exists(self, key):
+        self._check()
+        return super().exists(key)
+
+    def delete(self, *keys):
+        self._check()
+        return super().delete(*keys)
+
+    def publish(self, channel, message):
+        self._check()
+        return 0
+
+def _wait(pred, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not pred() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return pred()
+
+def _managed(primary):
+    return ManagedStore(primary, _MemStore(max_keys=1000, shards=2), threshold=2, interval=0.02)
+
+def test_trips_after_threshold_and_recovers():
+    primary = FlakyStore()
+    store = ManagedStore(primary, _MemStore(max_keys=1000, shards=2), threshold=2, interval=0.02)
+    store.setex('a', 60, '1')
+    assert primary.get('a') == '1'
+    primary.down = True
+    store.setex('b', 60, '1')
+    assert not store.is_open
+    store.setex('c', 60, '1')
+    assert store.is_open
+    # Served by the fallback while open
+    assert store.get('c') == '1'
+    primary.down = False
+    assert _wait(lambda: not store.is_open)
+    assert store.stats()['recovered'] == 1
+    store.setex('d', 60, '1')
+    assert primary.get('d') == '1'
+
+def test_outage_writes_are_read_back_only_until_they_expire():
+    primary = FlakyStore()
+    store = _managed(primary)
+    primary.down = True
+    store.setex('sess:1', 0.2, 'outage')
+    store.setex('sess:2', 0.2, 'outage')
+    assert store.is_open
+    primary.down = False
+    assert _wait(lambda: not store.is_open)
+    # Primary misses fall through to what was written during the outage...
+    assert store.get('sess:1') == 'outage'
+    time.sleep(0.25)
+    assert store.get('sess:1') is None
+    # ...and stop doing so once those keys have expired
+    store.fallback.set('stale', '1')
+    assert store.get('stale') is None
+
+def test_pool_exhaustion_does_not_trip():
+    primary = FlakyStore()
+    store = _managed(primary)
+    primary.busy = True
+    for _ in range(5):
+        with pytest.raises(StoreUnavailable):
+            store.setex('a', 60, '1')
+    assert not store.is_open
+    assert store.stats()['pool_exhausted'] == 5
+    assert store.fallback.get('a') is None
+
+def test_revoke_refused_while_open(client):
+    primary = FlakyStore()
+    store = _managed(primary)
+    rate_limit._set(store)
+    primary.setex('jti:j1', 60, '1')
+    primary.down = True
+    store.setex('a', 60, '1')
+    store.setex('a', 60, '1')
+    assert store.is_open
+    r = client.post('/admin/revoke', json={'jti': 'j1'}, headers={'X-Admin-Key': 'test-admin'})
+    assert r.status_code == 503 and r.headers['Retry-After']
+    primary.down = False
+    assert _wait(lambda: not store.is_open)
+    r = client.post('/admin/revoke', json={'jti': 'j1'}, headers={'X-Admin-Key': 'test-admin'})
+    assert r.status_code == 200 and r.get_json()['revoked'] is True
+    assert primary.exists('jti:j1') == 0
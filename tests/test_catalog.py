@@ -0,0 +1,44 @@
+from app.models import db, Product, Content
+from app.services import catalog
+
+def test_product_terms_are_cached_until_the_product_changes(ctx):
+    catalog.invalidate()
+    assert catalog.product_terms(1) == (1, 15)
+    before = catalog.stats()['hits']
+    assert catalog.product_terms(1) == (1, 15)
+    assert catalog.stats()['hits'] == before + 1
+    product = db.session.get(Product, 1)
+    product.default_duration_min = 30
+    db.session.commit()
+    try:
+        # The ORM write invalidated this worker's entry
+        assert catalog.lookup(1) is catalog.MISS
+        assert catalog.product_terms(1) == (1, 30)
+    finally:
+        product.default_duration_min = 15
+        db.session.commit()
+
+def test_unknown_product_is_not_cached(ctx):
+    assert catalog.product_terms(999) is None
+    assert catalog.lookup(999) is catalog.MISS
+
+def test_entries_expire_after_the_ttl(ctx):
+    catalog.invalidate()
+    ctx.config['CATALOG_TTL_S'] = -1
+    try:
+        catalog.product_terms(1)
+        assert catalog.lookup(1) is catalog.MISS
+    finally:
+        ctx.config['CATALOG_TTL_S'] = 300
+
+def test_content_blob_cache_follows_content_updates(ctx):
+    catalog.invalidate()
+    assert catalog.content_blob(1) == ('https://example.com/p.html', 'text/html')
+    content = db.session.get(Content, 1)
+    content.mime_type = 'text/plain'
+    db.session.commit()
+    try:
+        assert catalog.content_blob(1)[1] == 'text/plain'
+    finally:
+        content.mime_type = 'text/html'
+        db.session.commit()
@@ -0,0 +1,65 @@
+import time
+import pytest
+from app.models import db, Code
+from app.services.code_pool import CodePool, parse_keys, POOL_BATCH_ID
+
+KEY = (1, 1, 15)
+
+def _wait(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+def _status(code_id):
+    db.session.rollback()
+    return db.session.get(Code, code_id).status
+
+@pytest.fixture
+def make_pool(ctx):
+    pools = []
+    def make(keys=(KEY,), **kw):
+        kw = {'low_water': 1, 'target': 3, 'idle_s': 0.05, **kw}
+        pools.append(CodePool(ctx, list(keys), **kw))
+        return pools[-1]
+    yield make
+    for p in pools:
+        p.close()
+
+def _depth(pool, key=KEY):
+    return pool.snapshot()['depth'].get(':'.join(map(str, key)), 0)
+
+def test_parse_keys():
+    assert parse_keys(' 1:2:15, 1:3:60 ,') == [(1, 2, 15), (1, 3, 60)]
+    assert parse_keys('') == []
+
+def test_configured_keys_fill_and_pop_committed_codes(make_pool):
+    pool = make_pool()
+    _wait(lambda: _depth(pool) == 3)
+    code_id, url, png = pool.pop(KEY)
+    code = db.session.get(Code, code_id)
+    assert code.status == 'issued' and code.batch_id == POOL_BATCH_ID and code.duration_min == 15
+    assert url and png.startswith(b'\x89PNG')
+    assert pool.stats['hits'] == 1
+
+def test_a_miss_adds_the_key(make_pool):
+    pool = make_pool(keys=())
+    assert pool.pop(KEY) is None and pool.stats['misses'] == 1
+    _wait(lambda: _depth(pool) == 3)
+    assert pool.pop(KEY) is not None
+
+def test_stale_entries_are_voided_not_handed_out(make_pool):
+    pool = make_pool(max_age=0.3)
+    _wait(lambda: _depth(pool) == 3)
+    stale = [item[1] for item in pool._pools[KEY]]
+    time.sleep(0.4)
+    item = pool.pop(KEY)
+    assert item is None or item[0] not in stale
+    _wait(lambda: all(_status(code_id) == 'void' for code_id in stale))
+
+def test_close_voids_what_is_left(make_pool):
+    pool = make_pool()
+    _wait(lambda: _depth(pool) == 3)
+    left = [item[1] for item in pool._pools[KEY]]
+    pool.close()
+    assert {_status(code_id) for code_id in left} == {'void'}
@@ -0,0 +1,48 @@
+import io
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+
+pytest.importorskip('cv2')
+qrcode = pytest.importorskip('qrcode')
+
+from app.services.decode import DecodePool, DecoderBusy
+
+def _png(text: str) -> bytes:
+    buf = io.BytesIO()
+    qrcode.make(text).save(buf, format='PNG')
+    return buf.getvalue()
+
+@pytest.fixture
+def pool():
+    p = DecodePool(processes=1, queue_depth=1, timeout=30)
+    yield p
+    p.shutdown()
+
+def test_decodes_and_releases_slots(pool):
+    assert pool.decode_many([_png('hello')]) == [{'ok': True, 'raw': 'hello'}]
+    assert pool.stats()['in_flight'] == 0
+    with pytest.raises(DecoderBusy):
+        pool.decode_many([b'x'] * 3)
+    assert pool.stats()['in_flight'] == 0
+
+def _children(pool):
+    return len(pool._pool._processes)
+
+def test_every_child_starts_with_the_pool():
+    p = DecodePool(processes=2, queue_depth=0, timeout=30)
+    try:
+        assert _children(p) == 2
+    finally:
+        p.shutdown()
+
+def test_dead_child_fails_one_batch_then_pool_is_rebuilt(pool):
+    pool.decode_many([_png('warm')])
+    for proc in list(pool._pool._processes.values()):
+        proc.kill()
+        proc.join()
+    with pytest.raises(BrokenProcessPool):
+        pool.decode_many([_png('lost')])
+    assert pool.decode_many([_png('again')]) == [{'ok': True, 'raw': 'again'}]
+    assert pool.stats()['rebuilds'] == 1
+    assert _children(pool) == pool.processes
+    assert pool.stats()['in_flight'] == 0
@@ -0,0 +1,49 @@
+import time, uuid
+from datetime import datetime, timezone
+from sqlalchemy import update
+from app.models import db, Code
+from app.services import expiry
+from app.services.expiry import ExpiryHeap, Sweeper
+from app.services.issuance import mint_batch
+
+# Simulated clock, well past every code the other tests issue
+BASE = int(time.time()) + 10 * 86400
+
+def _mint(n, expires_ts, **values):
+    ids = list(mint_batch(f"test-{uuid.uuid4().hex[:8]}", 1, 1, 15, 0, n))
+    db.session.execute(update(Code).where(Code.id.in_(ids))
+                       .values(expires_at=datetime.fromtimestamp(expires_ts, timezone.utc), **values))
+    db.session.commit()
+    return ids
+
+def _statuses(ids):
+    db.session.rollback()
+    return [db.session.get(Code, i).status for i in ids]
+
+def test_heap_keeps_distinct_seconds_up_to_its_bound():
+    heap = ExpiryHeap(max_items=2)
+    assert heap.push(10.2) and heap.push(10.9) and heap.push(5)
+    assert len(heap) == 2 and heap.next_due() == 5
+    assert not heap.push(20)
+    assert heap.pop_due(10) == 1 and heap.next_due() == 11
+
+def test_sweep_expires_only_due_issued_codes(ctx):
+    due = _mint(3, BASE - 1)
+    voided = _mint(1, BASE - 1, status='void')
+    later = _mint(1, BASE + 60)
+    assert expiry.sweep(BASE, batch=2) >= 3
+    assert _statuses(due) == ['expired'] * 3
+    assert _statuses(voided) == ['void'] and _statuses(later) == ['issued']
+
+def test_sweeper_wakes_at_the_next_expiry(ctx):
+    expiry.sweep(BASE)
+    first = _mint(2, BASE + 5)
+    second = _mint(1, BASE + 20.5)
+    sweeper = Sweeper(lookahead=30, max_sleep=300)
+    sweeper.step(BASE)
+    assert len(sweeper.heap) == 2 and sweeper.heap.next_due() == BASE + 5
+    sweeper.step(BASE + 5)
+    assert _statuses(first) == ['expired'] * 2 and _statuses(second) == ['issued']
+    assert sweeper.heap.next_due() == BASE + 21
+    sweeper.step(BASE + 21)
+    assert _statuses(second) == ['expired'] and sweeper.stats['sweeps'] == 3
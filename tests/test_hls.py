@@ -0,0 +1,83 @@
+import os
+import pytest
+from sqlalchemy import update
+from app.models import db, Content, HlsJob
+from app.services import hls
+
+@pytest.fixture
+def media(ctx):
+    content = Content(url_or_blob_ref='file:///tmp/movie.mp4', mime_type='video/mp4', type='media')
+    db.session.add(content)
+    db.session.commit()
+    yield content.id
+    # Leave no runnable job behind for the other tests
+    db.session.execute(update(HlsJob).where(HlsJob.content_id == content.id).values(status='done'))
+    db.session.commit()
+
+def test_parse_renditions():
+    assert hls.parse_renditions('720:2800, 1080:5000') == [(1080, 5000), (720, 2800)]
+    assert hls.parse_renditions('') == []
+
+def test_enqueue_reuses_the_pending_job(ctx, media):
+    job, created = hls.enqueue(media)
+    assert created and db.session.get(Content, media).meta['hls']['status'] == 'queued'
+    assert hls.enqueue(media) == (job, False)
+    with pytest.raises(hls.PackagingError):
+        hls.enqueue(1)      # a page, not media
+
+def test_a_stale_lease_is_taken_over(ctx, media):
+    job, _ = hls.enqueue(media)
+    first = hls.claim('w1', stale_s=60, max_attempts=3)
+    assert first.id == job.id and first.attempts == 1
+    assert hls.claim('w2', stale_s=60, max_attempts=3) is None
+    assert hls.heartbeat(job.id, 'w1', 1)
+    # No heartbeat for stale_s: another worker takes the job, the first one loses it
+    second = hls.claim('w2', stale_s=0, max_attempts=3)
+    assert second.id == job.id and second.worker == 'w2' and second.attempts == 2
+    assert not hls.heartbeat(job.id, 'w1', 1)
+    assert not hls.set_progress(media, {'progress': 0.5}, (job.id, 'w1', 1))
+    assert hls.set_progress(media, {'progress': 0.5}, (job.id, 'w2', 2))
+
+def test_a_job_out_of_attempts_is_abandoned(ctx, media):
+    job, _ = hls.enqueue(media)
+    assert hls.claim('w1', stale_s=60, max_attempts=1).id == job.id
+    assert hls.claim('w2', stale_s=0, max_attempts=1) is None
+    db.session.refresh(job)
+    assert (job.status, job.error) == ('failed', 'abandoned')
+
+def _playlist(path, segments, ended=False):
+    lines = ['#EXTM3U'] + [f"#EXTINF:{d:.3f},\n{uri}" for d, uri in segments] + (['#EXT-X-ENDLIST'] if ended else [])
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def test_an_interrupted_rendition_resumes_after_its_last_whole_segment(tmp_path):
+    out = str(tmp_path / '720p')
+    os.makedirs(out)
+    _playlist(os.path.join(out, 'index.m3u8'), [(4, 'seg_00000.ts'), (4, 'seg_00001.ts')])
+    _playlist(os.path.join(out, 'run.m3u8'), [(4, 'seg_00002.ts')])
+    for i in range(4):
+        open(os.path.join(out, f"seg_{i:05d}.ts"), 'w').close()
+    cmd = hls.start_rendition('ffmpeg', 'src.mp4', out, 720, 2800, 4)
+    assert cmd[cmd.index('-ss') + 1] == '12.000' and cmd[cmd.index('-start_number') + 1] == '3'
+    assert hls.playlist_state(out) == ([4.0, 4.0, 4.0], False)
+    # seg 3 was being written when the job died
+    assert sorted(os.listdir(out)) == ['index.m3u8', 'seg_00000.ts', 'seg_00001.ts', 'seg_00002.ts']
+    _playlist(os.path.join(out, 'run.m3u8'), [(2.5, 'seg_00003.ts')], ended=True)
+    hls.finish_rendition(out, 4)
+    assert hls.playlist_state(out) == ([4.0, 4.0, 4.0, 2.5], True)
+    with open(os.path.join(out, 'index.m3u8')) as f:
+        assert f.read().count('#EXT-X-DISCONTINUITY') == 2
+    assert hls.start_rendition('ffmpeg', 'src.mp4', out, 720, 2800, 4) is None
+
+def test_takeover_and_publish(tmp_path):
+    root = str(tmp_path)
+    first = hls.attempt_dir(root, 7, 1, 1)
+    open(os.path.join(first, 'seg_00000.ts'), 'w').close()
+    second = hls.attempt_dir(root, 7, 1, 2)
+    assert not os.path.exists(first) and os.listdir(second) == ['seg_00000.ts']
+    hls.publish(root, 7, second)
+    assert os.path.realpath(os.path.join(root, '7')) == os.path.realpath(second)
+    third = hls.attempt_dir(root, 7, 2, 1)
+    hls.publish(root, 7, third)
+    assert os.path.realpath(os.path.join(root, '7')) == os.path.realpath(third)
+    assert not os.path.exists(second)
@@ -0,0 +1,28 @@
+from sqlalchemy import func
+from app.models import db, Code
+from app.services.ids import IdAllocator
+
+def test_workers_get_disjoint_blocks(ctx):
+    # Two allocators on the same row stand in for two workers
+    a = IdAllocator('test-ids', Code.__table__, block_size=10)
+    b = IdAllocator('test-ids', Code.__table__, block_size=10)
+    ids = [a.take()[0] for _ in range(25)] + b.take(15) + a.take(3)
+    assert len(ids) == len(set(ids))
+
+def test_large_take_is_a_dedicated_reservation(ctx):
+    a = IdAllocator('test-ids-large', Code.__table__, block_size=10)
+    first = a.take(2)
+    big = a.take(50)
+    assert big == list(range(big[0], big[0] + 50))
+    assert not set(first) & set(big)
+    assert a.take(1)[0] not in big
+
+def test_first_block_starts_after_existing_rows(ctx):
+    top = db.session.query(func.max(Code.id)).scalar() or 0
+    assert IdAllocator('test-ids-fresh', Code.__table__, block_size=10).take()[0] == top + 1
+
+def test_forked_worker_drops_the_inherited_block(ctx):
+    a = IdAllocator('test-ids-fork', Code.__table__, block_size=10)
+    inherited = a.take()[0]
+    a._pid = -1     # as if this process were a fork of the one that reserved it
+    assert a.take()[0] >= inherited + 10
@@ -0,0 +1,47 @@
+import time, uuid
+from datetime import datetime, timezone
+import pytest
+from app.models import db, Redemption
+from app.services import last_seen, rate_limit
+from app.services.issuance import mint_batch
+
+@pytest.fixture
+def enabled(app):
+    # A long flush interval: the tests call flush() themselves
+    app.config.update(LAST_SEEN_ENABLED=True, LAST_SEEN_FLUSH_S=3600, LAST_SEEN_MAX_STALENESS_S=60)
+    last_seen._recent._items.clear()
+    yield
+    app.config['LAST_SEEN_ENABLED'] = False
+
+@pytest.fixture
+def redemption(ctx):
+    code_id = next(mint_batch(f"test-{uuid.uuid4().hex[:8]}", 1, 1, 15, 0, 1))
+    row = Redemption(code_id=code_id, device_id='d', last_seen_at=datetime(2020, 1, 1, tzinfo=timezone.utc))
+    db.session.add(row)
+    db.session.commit()
+    return code_id
+
+def _last_seen(code_id):
+    db.session.rollback()
+    return Redemption.query.filter_by(code_id=code_id).one().last_seen_at.replace(tzinfo=timezone.utc)
+
+def test_repeat_touches_are_skipped_then_flushed_once(enabled, redemption):
+    skipped = last_seen._recent.skipped
+    last_seen.touch(redemption)
+    last_seen.touch(redemption)
+    assert last_seen._recent.skipped == skipped + 1
+    assert last_seen.flush() == 1
+    assert abs(_last_seen(redemption).timestamp() - time.time()) < 5
+    assert last_seen.flush() == 0
+
+def test_flush_never_moves_last_seen_backwards(enabled, redemption):
+    last_seen.touch(redemption)
+    last_seen.flush()
+    seen = _last_seen(redemption)
+    rate_limit.r().hset(last_seen.SEEN_KEY, str(redemption), int(seen.timestamp()) - 3600)
+    assert last_seen.flush() == 1
+    assert _last_seen(redemption) == seen
+
+def test_disabled_touches_record_nothing(ctx, redemption):
+    last_seen.touch(redemption)
+    assert last_seen.flush() == 0
@@ -0,0 +1,9 @@
+def test_metrics_needs_a_key(app, client):
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer nope'}).status_code == 401
+    assert client.get('/metrics', headers={'X-Admin-Key': 'test-admin'}).status_code == 200
+    app.config['METRICS_TOKEN'] = 'scrape'
+    try:
+        assert client.get('/metrics', headers={'Authorization': 'Bearer scrape'}).status_code == 200
+    finally:
+        app.config['METRICS_TOKEN'] = None
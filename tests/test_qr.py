@@ -0,0 +1,39 @@
+import cv2
+import numpy as np
+from app.services import qr
+
+def _decode_png(png: bytes) -> str:
+    img = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_GRAYSCALE)
+    return cv2.QRCodeDetector().detectAndDecode(img)[0]
+
+def test_png_decodes_back_to_the_payload():
+    url = 'https://example.com/redeem?c=ABCDEFGHIJKLMNOPQRSTUVWXYZ234'
+    png = qr.render(url, 'png', box_size=6)
+    n = len(qr.qr_matrix(url))
+    img = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_GRAYSCALE)
+    assert img.shape == (n * 6, n * 6)
+    assert _decode_png(png) == url
+
+def test_svg_draws_every_dark_module():
+    matrix = qr.qr_matrix('svg-test')
+    svg = qr.render('svg-test', 'svg').decode()
+    # One subpath per horizontal run covers exactly the dark modules
+    runs = [int(part.split('h')[1].split('v')[0]) for part in svg.split('d="')[1].split('"')[0].split('z') if part]
+    assert sum(runs) == sum(map(sum, matrix))
+
+def test_cache_is_bounded_by_bytes():
+    cache = qr.RenderCache(max_bytes=100)
+    for i in range(5):
+        cache.put(i, b'x' * 30)
+    stats = cache.stats()
+    assert stats['bytes'] <= 100 and stats['items'] == 3 and stats['evictions'] == 2
+    assert cache.get(0) is None and cache.get(4) == b'x' * 30
+    cache.put('huge', b'x' * 101)
+    assert cache.get('huge') is None
+
+def test_render_is_cached_per_options():
+    before = qr.cache_stats()['hits']
+    a = qr.render('cached', 'png', box_size=3)
+    assert qr.render('cached', 'png', box_size=3) is a
+    assert qr.cache_stats()['hits'] == before + 1
+    assert qr.render('cached', 'png', box_size=4) != a
@@ -0,0 +1,59 @@
+import time, threading
+import fakeredis
+import pytest
+from app.services.rate_limit import _MemStore, _RedisStore, parse_limit
+
+def _stores():
+    return [_MemStore(max_keys=1000, shards=4),
+            _RedisStore(fakeredis.FakeRedis(decode_responses=True))]
+
+@pytest.mark.parametrize('store', _stores(), ids=['memory', 'redis-lua'])
+def test_token_bucket_admits_capacity_then_waits(store):
+    cap, rate = parse_limit('3/60')
+    buckets = [('tb:ip:1', cap, rate), ('tb:code:7', 10, rate)]
+    results = [store.take_tokens(buckets, [(f"jti:{i}", 60, '1')]) for i in range(4)]
+    assert results[:3] == [0, 0, 0]
+    # One token back after 60s/3 = 20s, give or take the millisecond already elapsed
+    assert 19_000 < results[3] <= 20_000
+    assert store.get('jti:2') == '1'
+    assert store.get('jti:3') is None
+
+def test_memstore_matches_lua_on_mixed_buckets():
+    mem, lua = _stores()
+    cap, rate = parse_limit('5/60')
+    seq = [[('tb:ip:a', cap, rate)], [('tb:ip:a', cap, rate), ('tb:m:1', 2, rate)],
+           [('tb:m:1', 2, rate)], [('tb:m:1', 2, rate), ('tb:ip:a', cap, rate)], [('tb:ip:b', 1, rate)],
+           [('tb:ip:b', 1, rate)], [('tb:ip:a', cap, rate)], [('tb:ip:a', cap, rate)], [('tb:ip:a', cap, rate)],
+           [('tb:ip:a', cap, rate)]]
+    got_mem = [mem.take_tokens(b) == 0 for b in seq]
+    got_lua = [lua.take_tokens(b) == 0 for b in seq]
+    assert got_mem == got_lua == [True, True, True, False, True, False, True, True, True, False]
+
+def test_writes_only_without_buckets():
+    for store in _stores():
+        assert store.take_tokens([], [('sess:1', 60, 'x'), ('jti:j', 60, '1')]) == 0
+        assert store.get('sess:1') == 'x' and store.exists('jti:j') == 1
+
+def test_memstore_counters_exact_under_threads():
+    store = _MemStore(max_keys=64, shards=4)
+    per_thread, threads = 2000, 8
+
+    def work(t):
+        for i in range(per_thread):
+            store.setex(f"k:{t}:{i}", 60, '1')
+    ts = [threading.Thread(target=work, args=(t,)) for t in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    stats = store.stats()
+    assert stats['keys'] == store.max_keys
+    assert stats['evictions'] == per_thread * threads - store.max_keys
+
+def test_memstore_expires_from_heap():
+    store = _MemStore(max_keys=100, shards=2)
+    store.setex('a', 0.01, '1')
+    store.setex('b', 60, '1')
+    time.sleep(0.03)
+    assert store.get('a') is None and store.get('b') == '1'
+    assert store.stats()['expirations'] == 1
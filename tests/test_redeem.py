@@ -0,0 +1,85 @@
+import uuid
+import jwt
+import pytest
+from app.services import rate_limit
+from app.services.issuance import mint_batch
+from app.services.tokens import make_opaque
+
+@pytest.fixture
+def opaque(ctx):
+    code_id = next(mint_batch(f"test-{uuid.uuid4().hex[:8]}", 1, 1, 15, 0, 1))
+    return make_opaque(code_id, 1)
+
+@pytest.fixture
+def ip_limit(app):
+    app.config['RATE_LIMIT_IP'] = '5/60'
+    yield 5
+    app.config['RATE_LIMIT_IP'] = '20/60'
+
+def test_redeem_then_other_device(client, opaque):
+    r = client.post('/api/redeem', json={'opaque': opaque, 'device_id': 'dev-a'})
+    assert r.status_code == 200 and r.get_json()['token']
+    r = client.post('/api/redeem', json={'opaque': opaque, 'device_id': 'dev-b'})
+    assert r.status_code == 403
+
+def test_invalid_attempts_share_the_limit_across_workers(client, ip_limit):
+    # Each worker has its own local tier; the store behind them is shared
+    workers = [rate_limit._LocalBuckets(1000), rate_limit._LocalBuckets(1000)]
+    statuses = []
+    for i in range(ip_limit + 3):
+        rate_limit._local = workers[i % 2]
+        statuses.append(client.post('/api/redeem', json={'opaque': 'not-a-token', 'device_id': 'd'}).status_code)
+    assert statuses == [400] * ip_limit + [429] * 3
+
+def test_device_mismatches_count_against_the_code(app, client, opaque):
+    app.config['RATE_LIMIT_CODE'] = '3/60'
+    try:
+        assert client.post('/api/redeem', json={'opaque': opaque, 'device_id': 'owner'}).status_code == 200
+        workers = [rate_limit._LocalBuckets(1000), rate_limit._LocalBuckets(1000)]
+        statuses = []
+        for i in range(3):
+            rate_limit._local = workers[i % 2]
+            statuses.append(client.post('/api/redeem', json={'opaque': opaque, 'device_id': 'thief'}).status_code)
+        assert statuses == [403, 403, 429]
+    finally:
+        app.config['RATE_LIMIT_CODE'] = '10/60'
+
+def test_revoking_the_jwt_stops_its_playback_token(client, opaque):
+    r = client.post('/api/redeem', json={'opaque': opaque, 'device_id': 'dev-a'})
+    access = r.get_json()['token']
+    r = client.post('/api/playback/1', headers={'Authorization': f"Bearer {access}"})
+    assert r.status_code == 200 and 0 < r.get_json()['refresh_in'] < 120
+    url = r.get_json()['master_url']
+    # Token accepted: the playlist simply has not been packaged here
+    assert client.get(url).status_code == 404
+    jti = jwt.decode(access, options={'verify_signature': False})['jti']
+    assert client.post('/admin/revoke', json={'jti': jti}, headers={'X-Admin-Key': 'test-admin'}).get_json()['revoked']
+    assert client.get(url).status_code == 403
+    assert client.post('/api/playback/1', headers={'Authorization': f"Bearer {access}"}).status_code == 403
+
+class _CountingStore(rate_limit._MemStore):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def take_tokens(self, buckets, writes=()):
+        self.calls.append(([b[0].split(':')[1] for b in buckets], len(writes)))
+        return super().take_tokens(buckets, writes)
+
+def test_redeem_costs_two_store_calls(client, opaque):
+    store = _CountingStore()
+    rate_limit._set(store)
+    assert client.post('/api/redeem', json={'opaque': opaque, 'device_id': 'dev-a'}).status_code == 200
+    # Every bucket in one call before the lookup, then the session and jti
+    assert store.calls == [(['ip', 'm', 'code'], 0), ([], 2)]
+    store.calls.clear()
+    assert client.post('/api/redeem', json={'opaque': 'not-a-token', 'device_id': 'd'}).status_code == 400
+    assert store.calls == [(['ip'], 0)]
+
+def test_revoked_code_cannot_be_redeemed_again(client, opaque):
+    access = client.post('/api/redeem', json={'opaque': opaque, 'device_id': 'dev-a'}).get_json()['token']
+    jti = jwt.decode(access, options={'verify_signature': False})['jti']
+    r = client.post('/admin/revoke', json={'jti': jti}, headers={'X-Admin-Key': 'test-admin'})
+    assert r.get_json()['revoked'] and r.get_json()['code_id']
+    r = client.post('/api/redeem', json={'opaque': opaque, 'device_id': 'dev-a'})
+    assert r.status_code == 403 and r.get_json()['error'] == 'code_revoked'
@@ -0,0 +1,71 @@
+import time, uuid
+import pytest
+from app.services import rate_limit, revocation
+from app.services.breaker import ManagedStore
+from app.services.revocation import _LiveJtis
+
+fakeredis = pytest.importorskip('fakeredis')
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    # The cache and the subscriber state are per-worker singletons
+    revocation._cache = None
+    revocation._sub.update(pid=None, connected=False)
+    yield
+    revocation._cache = None
+    revocation._sub.update(pid=None, connected=False)
+
+def test_entries_live_until_exp_and_are_bounded():
+    cache = _LiveJtis(max_keys=2, max_age=300)
+    cache.put('a', int(time.time()) - 1, cache.generation)
+    assert not cache.get('a')
+    for jti in ('b', 'c', 'd'):
+        cache.put(jti, None, cache.generation)
+    # The expired entry went first, then the least recently used
+    assert not cache.get('b') and cache.get('c') and cache.get('d')
+    assert cache.stats['evictions'] == 2
+
+def test_a_lookup_raced_by_a_revocation_is_not_cached():
+    cache = _LiveJtis(max_keys=10, max_age=300)
+    gen = cache.generation
+    cache.discard('a')      # revoked between the store lookup and the put
+    cache.put('a', None, gen)
+    assert not cache.get('a') and cache.revoked('a')
+
+def test_tombstones_expire():
+    cache = _LiveJtis(max_keys=10, max_age=300, tombstone_s=0)
+    cache.discard('a')
+    assert not cache.revoked('a')
+
+def test_is_live_skips_the_store_until_revoked(ctx, monkeypatch):
+    jti = uuid.uuid4().hex
+    rate_limit.r().setex(f"jti:{jti}", 60, '1')
+    calls = []
+    has_jti = rate_limit.has_jti
+    monkeypatch.setattr(rate_limit, 'has_jti', lambda j: calls.append(j) or has_jti(j))
+    assert revocation.is_live(jti) and revocation.is_live(jti)
+    assert calls == [jti]
+    assert revocation.revoke(jti)
+    assert not revocation.is_live(jti) and revocation.revoked_recently(jti)
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+def test_revocations_published_by_other_workers_evict(ctx, monkeypatch):
+    server = fakeredis.FakeServer()
+    client = lambda: fakeredis.FakeRedis(server=server, decode_responses=True)
+    rate_limit._set(ManagedStore(client(), rate_limit._mem_store()))
+    monkeypatch.setattr(revocation, '_subscriber_client', lambda cfg: client())
+    jti = uuid.uuid4().hex
+    client().set(f"jti:{jti}", '1', ex=60)
+    revocation.lookup(jti)      # starts this worker's subscriber
+    _wait(lambda: revocation._sub['connected'])
+    assert revocation.is_live(jti) and revocation.lookup(jti)[0]
+    # Another worker deletes the key and publishes the jti
+    client().delete(f"jti:{jti}")
+    client().publish(ctx.config.get('REVOKE_CHANNEL', 'jti:revoked'), jti)
+    _wait(lambda: revocation.revoked_recently(jti))
+    assert not revocation.lookup(jti)[0] and not revocation.is_live(jti)
@@ -0,0 +1,119 @@
+import os, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import boto3
+import pytest
+from flask import request
+from moto import mock_aws
+from app.services import storage
+
+BLOB = bytes(range(256)) * 40    # 10 KiB
+
+@pytest.fixture
+def backends():
+    # Backends are built once per scheme from the config: rebuild them per test
+    storage._backends.clear()
+    yield
+    storage._backends.clear()
+
+@pytest.fixture
+def blob_file(tmp_path):
+    path = tmp_path / 'root' / 'blob.bin'
+    path.parent.mkdir()
+    path.write_bytes(BLOB)
+    return path
+
+def _get(ctx, ref, **headers):
+    with ctx.test_request_context(headers=headers):
+        resp = storage.send_blob(ref, 'application/octet-stream', request)
+        resp.direct_passthrough = False
+        return resp.status_code, resp.headers, resp.get_data()
+
+def test_full_and_ranged_reads(ctx, backends, blob_file):
+    ref = f"file://{blob_file}"
+    status, headers, body = _get(ctx, ref)
+    assert status == 200 and body == BLOB and headers['Accept-Ranges'] == 'bytes'
+    status, headers, body = _get(ctx, ref, Range='bytes=100-199')
+    assert status == 206 and body == BLOB[100:200] and headers['Content-Range'] == f"bytes 100-199/{len(BLOB)}"
+    status, _, body = _get(ctx, ref, Range='bytes=-10')
+    assert status == 206 and body == BLOB[-10:]
+    status, headers, body = _get(ctx, ref, Range=f"bytes={len(BLOB)}-")
+    assert status == 416 and headers['Content-Range'] == f"bytes */{len(BLOB)}" and body == b''
+
+def test_etag_validators(ctx, backends, blob_file):
+    ref = f"file://{blob_file}"
+    etag = _get(ctx, ref)[1]['ETag']
+    assert _get(ctx, ref, **{'If-None-Match': etag})[0] == 304
+    # A Range under a stale If-Range gets the whole, current body
+    status, _, body = _get(ctx, ref, Range='bytes=0-9', **{'If-Range': '"stale"'})
+    assert status == 200 and body == BLOB
+
+def test_file_root_confinement(ctx, backends, blob_file, tmp_path):
+    outside = tmp_path / 'secret.txt'
+    outside.write_text('no')
+    os.symlink(outside, blob_file.parent / 'link.txt')
+    ctx.config['STORAGE_FILE_ROOT'] = str(blob_file.parent)
+    try:
+        assert _get(ctx, f"file://{blob_file}")[0] == 200
+        for ref in (f"file://{outside}", f"file://{blob_file.parent}/../secret.txt", f"file://{blob_file.parent}/link.txt"):
+            with pytest.raises(storage.BlobNotFound):
+                _get(ctx, ref)
+    finally:
+        ctx.config['STORAGE_FILE_ROOT'] = None
+
+def test_s3_backend(ctx, backends, monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+    ctx.config['S3_REGION'] = 'us-east-1'
+    try:
+        with mock_aws():
+            boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='media')
+            boto3.client('s3', region_name='us-east-1').put_object(Bucket='media', Key='a/b.bin', Body=BLOB)
+            assert _get(ctx, 's3://media/a/b.bin')[2] == BLOB
+            status, _, body = _get(ctx, 's3://media/a/b.bin', Range='bytes=5000-5099')
+            assert status == 206 and body == BLOB[5000:5100]
+            with pytest.raises(storage.BlobNotFound):
+                _get(ctx, 's3://media/missing')
+    finally:
+        ctx.config['S3_REGION'] = None
+
+class _Origin(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, body_too: bool):
+        if self.path != '/blob.bin':
+            self.send_response(404)
+            self.end_headers()
+            return
+        body, status = BLOB, 200
+        rng = self.headers.get('Range')
+        if rng:
+            start, end = (int(x) for x in rng.removeprefix('bytes=').split('-'))
+            body, status = BLOB[start:end + 1], 206
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        if body_too:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self._reply(False)
+
+    def do_GET(self):
+        self._reply(True)
+
+@pytest.fixture
+def origin():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Origin)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+def test_http_refs_are_proxied(ctx, backends, origin):
+    status, headers, body = _get(ctx, f"{origin}/blob.bin")
+    assert status == 200 and body == BLOB and headers['ETag'] == '"v1"'
+    status, _, body = _get(ctx, f"{origin}/blob.bin", Range='bytes=10-19')
+    assert status == 206 and body == BLOB[10:20]
+    with pytest.raises(storage.BlobNotFound):
+        _get(ctx, f"{origin}/missing")
@@ -0,0 +1,52 @@
+import time
+import pytest
+from app.services import tokens
+
+def test_v1_round_trip(ctx):
+    token = tokens.make_opaque(123456789, 42)
+    assert len(token) < 40 and token.isalnum()
+    code_id, merchant_id, ts = tokens.resolve_opaque(token)
+    assert (code_id, merchant_id) == (123456789, 42)
+    # v1 keeps minutes since OPAQUE_EPOCH
+    assert 0 <= time.time() - ts < 120
+
+def test_v1_rejects_tampering(ctx):
+    token = tokens.make_opaque(5, 1)
+    flipped = token[:-1] + ('A' if token[-1] != 'A' else 'B')
+    with pytest.raises(ValueError):
+        tokens.resolve_opaque(flipped)
+    with pytest.raises(ValueError):
+        tokens.resolve_opaque(token[:-2])
+
+def test_legacy_still_accepted(ctx):
+    ctx.config['OPAQUE_FORMAT'] = 'legacy'
+    try:
+        token = tokens.make_opaque(9, 3)
+    finally:
+        ctx.config['OPAQUE_FORMAT'] = 'v1'
+    assert tokens.resolve_opaque(token)[:2] == (9, 3)
+
+def test_stale_token_refused(ctx):
+    token = tokens.make_opaque(9, 3, ts=int(time.time()) - 7200)
+    ctx.config['OPAQUE_MAX_AGE_S'] = 3600
+    try:
+        with pytest.raises(ValueError):
+            tokens.resolve_opaque(token)
+    finally:
+        ctx.config['OPAQUE_MAX_AGE_S'] = 86400
+
+def test_v1_stays_in_the_qr_alphanumeric_set(ctx):
+    # Largest ids the allocator can hand out still give a short, upper-case token
+    token = tokens.make_opaque(2**63 - 1, 2**31 - 1)
+    assert set(token) <= set('ABCDEFGHIJKLMNOPQRSTUVWXYZ234567') and len(token) < 48
+    assert tokens.resolve_opaque(token)[:2] == (2**63 - 1, 2**31 - 1)
+
+def test_segment_token_carries_the_jti(ctx):
+    token = tokens.make_segment_token(3, int(time.time()) + 60, 'jti-1')
+    assert tokens.check_segment_token(token, 3) == 'jti-1'
+    # Another content, a forged signature, an expired or a malformed token
+    assert tokens.check_segment_token(token, 4) is None
+    cid, exp, jti, sig = token.split('.')
+    assert tokens.check_segment_token(f"{cid}.{exp}.jti-2.{sig}", 3) is None
+    assert tokens.check_segment_token(tokens.make_segment_token(3, int(time.time()) - 1, 'jti-1'), 3) is None
+    assert tokens.check_segment_token('garbage', 3) is None
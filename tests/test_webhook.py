@@ -0,0 +1,78 @@
+import time, uuid
+import pytest
+from sqlalchemy import text
+from app.models import db, Code
+from app.services import payments, rate_limit
+
+H = {'X-Webhook-Key': 'test-webhook'}
+
+def _event(event_id, **data):
+    return {'id': event_id, 'event': 'payment.succeeded', 'data': {'merchant_id': 1, 'product_id': 1, **data}}
+
+def _wait_done(ctx, event_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, code = payments.lookup(event_id)
+        if status == 'done':
+            return code
+        db.session.rollback()
+        time.sleep(0.02)
+    raise AssertionError(f"{event_id} not minted")
+
+@pytest.fixture
+def store(ctx):
+    # The minter thread writes to the store long after the request: keep one for the whole test
+    rate_limit._set(rate_limit._mem_store())
+    return rate_limit.r()
+
+def test_unknown_product_is_refused_before_202(client, store):
+    eid = f"evt-{uuid.uuid4().hex[:8]}"
+    r = client.post('/admin/payment-webhook', json=_event(eid, product_id=999), headers=H)
+    assert r.status_code == 422 and r.get_json()['error'] == 'unknown_product'
+    assert not store.exists(f"whk:{eid}")
+
+def test_a_rejected_row_does_not_block_the_queue(ctx, client, store, monkeypatch):
+    # Stand-in for a foreign key violation (SQLite does not enforce them here)
+    db.session.execute(text("CREATE TRIGGER reject_999 BEFORE INSERT ON code WHEN NEW.product_id = 999 "
+                            "BEGIN SELECT RAISE(ABORT, 'FOREIGN KEY constraint failed'); END"))
+    db.session.commit()
+    try:
+        monkeypatch.setattr(payments.catalog, 'product_merchant', lambda product_id: 1)
+        bad, good = f"evt-{uuid.uuid4().hex[:8]}", f"evt-{uuid.uuid4().hex[:8]}"
+        before = payments.minter().snapshot()['dead_lettered']
+        assert payments.accept(bad, 1, 999, 15) == ('queued', None)
+        assert payments.accept(good, 1, 1, 15) == ('queued', None)
+        assert _wait_done(ctx, good).product_id == 1
+        assert payments.minter().snapshot()['dead_lettered'] == before + 1
+        assert payments.lookup(bad) == (None, None)
+    finally:
+        db.session.execute(text("DROP TRIGGER reject_999"))
+        db.session.commit()
+
+def _codes_for(event_id):
+    db.session.rollback()
+    return Code.query.filter_by(batch_id=payments.event_batch_id(event_id)).all()
+
+def test_retries_get_the_one_minted_code(ctx, client, store):
+    eid = f"evt-{uuid.uuid4().hex[:8]}"
+    first = client.post('/admin/payment-webhook', json=_event(eid), headers=H)
+    assert first.status_code == 202 and first.get_json()['status'] == 'queued'
+    code = _wait_done(ctx, eid)
+    retry = client.post('/admin/payment-webhook', json=_event(eid), headers=H)
+    assert retry.status_code == 200 and retry.get_json()['code_id'] == code.id
+    assert [c.id for c in _codes_for(eid)] == [code.id]
+
+def test_replay_after_a_store_flush_reuses_the_code(ctx, client, store):
+    eid = f"evt-{uuid.uuid4().hex[:8]}"
+    assert client.post('/admin/payment-webhook', json=_event(eid), headers=H).status_code == 202
+    code = _wait_done(ctx, eid)
+    # The store forgets every dedupe key (restart, memory store): the deterministic code_hash still matches
+    rate_limit._set(rate_limit._mem_store())
+    replayed = payments.minter().snapshot()['replayed']
+    assert client.post('/admin/payment-webhook', json=_event(eid), headers=H).status_code == 202
+    deadline = time.monotonic() + 5
+    while payments.minter().snapshot()['replayed'] == replayed and time.monotonic() < deadline:
+        time.sleep(0.02)
+    retry = client.post('/admin/payment-webhook', json=_event(eid), headers=H)
+    assert retry.status_code == 200 and retry.get_json()['code_id'] == code.id
+    assert [c.id for c in _codes_for(eid)] == [code.id]
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+import sys, time, json, signal, pathlib
+# Ensure project root is on PYTHONPATH when running directly
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app import create_app
+from app.services import archive
+
+# Usage: python workers/archiver.py [--once]
+# Moves codes dead for more than ARCHIVE_RETENTION_DAYS, and their redemptions,
+# to the archive tables in ARCHIVE_CHUNK-row transactions, then sleeps
+# ARCHIVE_INTERVAL_S. Stopping it (SIGTERM) loses at most the chunk in flight;
+# the next run resumes from the stored cursor. --once exits after one pass.
+
+_stop = False
+
+def _request_stop(signum, frame):
+    global _stop
+    _stop = True
+
+def main():
+    once = '--once' in sys.argv[1:]
+    app = create_app()
+    cfg = app.config
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+    with app.app_context():
+        while not _stop:
+            result = archive.run(cfg['ARCHIVE_RETENTION_DAYS'], cfg['ARCHIVE_CHUNK'],
+                                 pause_s=cfg['ARCHIVE_PAUSE_S'], should_stop=lambda: _stop)
+            print(json.dumps(result), flush=True)
+            if once:
+                break
+            deadline = time.monotonic() + cfg['ARCHIVE_INTERVAL_S']
+            while not _stop and time.monotonic() < deadline:
+                time.sleep(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import sys, time, json, signal, pathlib
+# Ensure project root is on PYTHONPATH when running directly
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app import create_app
+from app.services import expiry
+
+# Usage: python workers/expiry_sweeper.py [--once]
+# Sets status 'expired' on issued codes past their expires_at, EXPIRY_SWEEP_BATCH
+# rows per UPDATE. Upcoming expiries within EXPIRY_LOOKAHEAD_S are kept in a heap
+# so the worker sleeps until one is due, re-reading the window every
+# EXPIRY_MAX_SLEEP_S. --once runs a single sweep and exits.
+
+_stop = False
+
+def _request_stop(signum, frame):
+    global _stop
+    _stop = True
+
+def main():
+    once = '--once' in sys.argv[1:]
+    app = create_app()
+    cfg = app.config
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+    with app.app_context():
+        sweeper = expiry.Sweeper(cfg['EXPIRY_SWEEP_BATCH'], cfg['EXPIRY_LOOKAHEAD_S'], cfg['EXPIRY_HEAP_MAX'],
+                                 cfg['EXPIRY_MAX_SLEEP_S'])
+        while not _stop:
+            expired = sweeper.stats['expired']
+            delay = sweeper.step()
+            if once or sweeper.stats['expired'] != expired:
+                print(json.dumps({**sweeper.snapshot(), 'sleep_s': round(delay, 1)}), flush=True)
+            if once:
+                break
+            deadline = time.monotonic() + delay
+            while not _stop and time.monotonic() < deadline:
+                time.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,48 @@
-# Placeholder worker – replace with actual ffmpeg calls on uploaded assets.
-print('hls-packager worker placeholder')
+#!/usr/bin/env python3
+import os, sys, time, signal, socket, logging, pathlib
+# Ensure project root is on PYTHONPATH when running directly
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app import create_app
+from app.services import hls
+
+# Usage: python workers/hls_packager.py [--once]
+# Leases HLS jobs (POST /admin/content/<id>/hls) and packages them with ffmpeg,
+# HLS_PROCESSES renditions at a time. Run several of these for more throughput;
+# a job whose worker dies is taken over after HLS_JOB_STALE_S and resumes from
+# the segments already on disk. --once exits when the queue is empty.
+
+log = logging.getLogger('hls_packager')
+
+_stop = False
+
+def _request_stop(signum, frame):
+    global _stop
+    _stop = True
+
+def main():
+    once = '--once' in sys.argv[1:]
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    app = create_app()
+    cfg = app.config
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+    with app.app_context():
+        while not _stop:
+            job = hls.claim(worker, cfg['HLS_JOB_STALE_S'], cfg['HLS_MAX_ATTEMPTS'])
+            if job is None:
+                if once:
+                    break
+                time.sleep(cfg['HLS_POLL_S'])
+                continue
+            ok = hls.run_job(job, worker)
+            if ok:
+                log.info('job %s content %s: done', job.id, job.content_id)
+            else:
+                log.warning('job %s content %s: failed', job.id, job.content_id)
+
+if __name__ == '__main__':
+    main()